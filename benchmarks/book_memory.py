@@ -0,0 +1,63 @@
+# Measures resident memory per order for a deep book: pydantic Order models held in a
+# plain list (the old representation) vs RestingOrder records in a BookSide.
+#
+#   python benchmarks/book_memory.py --orders 1000000
+
+import os
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from engine import Order, OrderSide, BookSide  # noqa: E402
+
+USERS = ['user1', 'user2', 'user3', 'user4', 'user5']
+
+def generate_orders(count: int, levels: int, seed: int = 1):
+    rnd = random.Random(seed)
+    for _ in range(count):
+        # Build fresh strings the way json.loads would, so nothing is shared by accident
+        yield {
+            'ticker': 'AAPL',
+            'side': 'buy',
+            'quantity': rnd.randint(1, 1000),
+            'user_id': ''.join(rnd.choice(USERS)),
+            'order_type': 'limit',
+            'price': float(rnd.randint(1, levels) * 10),
+        }
+
+def measure(build, count: int, levels: int):
+    tracemalloc.start()
+    start = time.perf_counter()
+    book = build(generate_orders(count, levels))
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return book, current / count, elapsed
+
+def build_model_list(orders):
+    return [Order(**data) for data in orders]
+
+def build_book_side(orders):
+    side = BookSide(OrderSide.BUY)
+    for order_id, data in enumerate(orders, 1):
+        order = Order(**data)
+        side.add(order_id, round(order.price * 100), order.quantity, order.user_id, order.timestamp)  # 0.01 tick size
+    return side
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--orders', type=int, default=1_000_000)
+    parser.add_argument('--levels', type=int, default=1000)
+    args = parser.parse_args()
+
+    for name, build in (('pydantic Order list', build_model_list), ('BookSide/RestingOrder', build_book_side)):
+        book, per_order, elapsed = measure(build, args.orders, args.levels)
+        print(f"{name:<24} {per_order:8.1f} bytes/order  ({args.orders} orders, {args.levels} levels, built in {elapsed:.1f}s)")
+        del book
+
+if __name__ == '__main__':
+    main()
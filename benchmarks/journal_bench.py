@@ -0,0 +1,74 @@
+# Measures the write-ahead journal: append throughput through the order books with group
+# fsync, and recovery time from the journal alone vs from a checkpoint snapshot.
+#
+#   python benchmarks/journal_bench.py --orders 200000
+
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from engine import Order, OrderBookManager, VerifyMode  # noqa: E402
+
+TICKERS = ['AAPL', 'MSFT', 'GOOG', 'AMZN', 'TSLA']
+USERS = ['user1', 'user2', 'user3', 'user4', 'user5']
+
+def generate_orders(count: int, seed: int = 1):
+    rnd = random.Random(seed)
+    for _ in range(count):
+        # Spread around 100.00 so roughly a third of the orders trade
+        side = rnd.choice(['buy', 'sell'])
+        offset = rnd.randint(-50, 100) if side == 'sell' else rnd.randint(-100, 50)
+        yield Order(ticker=rnd.choice(TICKERS), side=side, quantity=rnd.randint(1, 100),
+                    user_id=rnd.choice(USERS), order_type='limit', price=round(100 + offset * 0.01, 2))
+
+async def fill_journal(directory: str, orders, checkpoint_every: int, durable_every: int):
+    manager = OrderBookManager(db_name=os.path.join(directory, 'bench.db'), verify_mode=VerifyMode.OFF,
+                               journal_dir=os.path.join(directory, 'journal'), checkpoint_every=checkpoint_every)
+    await manager.start()
+    start = time.perf_counter()
+    for i, order in enumerate(orders, 1):
+        # Occasional durable orders wait for the group fsync, like clients asking for acks
+        await manager.add_order(order, durable=i % durable_every == 0)
+    await manager.journal.sync()
+    elapsed = time.perf_counter() - start
+    records = sum(os.path.getsize(os.path.join(manager.journal.directory, name))
+                  for name in os.listdir(manager.journal.directory))
+    resting = sum(len(book.buy_orders) + len(book.sell_orders) for book in manager.order_books.values())
+    await manager.close()
+    return elapsed, records, resting
+
+async def recover(directory: str):
+    manager = OrderBookManager(db_name=os.path.join(directory, 'bench.db'),
+                               journal_dir=os.path.join(directory, 'journal'))
+    start = time.perf_counter()
+    await manager.start()
+    elapsed = time.perf_counter() - start
+    await manager.close()
+    return elapsed
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--orders', type=int, default=200_000)
+    parser.add_argument('--durable-every', type=int, default=100)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    orders = list(generate_orders(args.orders))
+    # No checkpoint: recovery replays every record. Checkpointed: only the resting book
+    # plus the records since the last snapshot.
+    for name, checkpoint_every in (('journal only', args.orders * 10), ('checkpointed', args.orders // 10)):
+        with tempfile.TemporaryDirectory() as directory:
+            elapsed, size, resting = await fill_journal(directory, orders, checkpoint_every, args.durable_every)
+            print(f"{name:<14} append: {args.orders / elapsed:10.0f} orders/s  "
+                  f"({size / 2**20:.1f} MiB on disk, {resting} resting orders)")
+            print(f"{name:<14} recover: {await recover(directory):8.3f}s")
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+# Compares the per-message cost of turning an /ws 'add' (or 'add_batch') text frame into
+# Order models: json.loads + Order(**data) / the batch TypeAdapter, as before, vs
+# server.json_loads (orjson when installed) + parse_order / parse_orders.
+#
+#   python benchmarks/order_parsing.py --iterations 100000
+
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from engine import Order, order_batch_adapter, parse_order, parse_orders  # noqa: E402
+from server import json_loads  # noqa: E402
+
+LIMIT = {'ticker': 'AAPL', 'side': 'buy', 'quantity': 25, 'user_id': 'user3', 'order_type': 'limit', 'price': 187.25}
+MARKET = {'ticker': 'AAPL', 'side': 'sell', 'quantity': 10, 'user_id': 'user1', 'order_type': 'market'}
+INVALID = {'ticker': 'AAPL', 'side': 'buy', 'quantity': -5, 'user_id': 'user3', 'order_type': 'limit'}
+
+def timed(function, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start) / iterations
+
+def rejected(parse, text: str):
+    try:
+        parse(text)
+    except ValueError:  # ValidationError
+        return
+    raise AssertionError("invalid order was accepted")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=100_000)
+    parser.add_argument('--batch', type=int, default=100, help='orders per add_batch message')
+    args = parser.parse_args()
+
+    decoder = 'orjson' if json_loads is not json.loads else 'json'
+    print(f"fast path decoder: {decoder}")
+    messages = {name: json.dumps({'command': 'add', 'order': order, 'id': 7})
+                for name, order in (('limit', LIMIT), ('market', MARKET), ('invalid', INVALID))}
+    batch = json.dumps({'command': 'add_batch', 'orders': [LIMIT, MARKET] * (args.batch // 2), 'id': 7})
+
+    cases = []
+    for name in ('limit', 'market'):
+        text = messages[name]
+        cases.append((f'add {name}', lambda text=text: Order(**json.loads(text)['order']),
+                      lambda text=text: parse_order(json_loads(text)['order']), args.iterations))
+    text = messages['invalid']
+    cases.append(('add invalid', lambda: rejected(lambda t: Order(**json.loads(t)['order']), text),
+                  lambda: rejected(lambda t: parse_order(json_loads(t)['order']), text), args.iterations))
+    cases.append((f'batch of {args.batch}', lambda: order_batch_adapter.validate_python(json.loads(batch)['orders']),
+                  lambda: parse_orders(json_loads(batch)['orders']), max(1, args.iterations // args.batch)))
+
+    for name, before, after, iterations in cases:
+        slow, fast = timed(before, iterations), timed(after, iterations)
+        print(f"{name:<14} pydantic {slow * 1e6:8.2f}us  fast path {fast * 1e6:8.2f}us  ({slow / fast:.1f}x)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# Trade insert throughput for persistence_service.py: the old connect/insert/commit per
+# trade, the group-commit BatchWriter with many concurrent single-trade saves (what
+# /save-trade/ does under load), and bulk saves (/save-trades/).
+#
+#   python benchmarks/persistence_bench.py --trades 100000
+
+import os
+import sys
+import time
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from batch_writer import BatchWriter  # noqa: E402
+from persistence_service import CREATE_TRADES, INSERT_TRADE, trade_row  # noqa: E402
+
+def trades(count: int):
+    return [trade_row({'ticker': 'AAPL', 'buyer_id': f'user{i % 50}', 'seller_id': f'user{(i + 7) % 50}',
+                       'price': 187.25 + (i % 20) * 0.01, 'quantity': 1 + i % 100,
+                       'timestamp': '2024-01-02 14:30:00'}) for i in range(count)]
+
+def connect_per_trade(db_path: str, rows):
+    # As persistence_service did before: default pragmas, a connection and a commit per trade
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(CREATE_TRADES)
+    for row in rows:
+        conn = sqlite3.connect(db_path)
+        conn.execute(INSERT_TRADE, row)
+        conn.commit()
+        conn.close()
+
+async def concurrent_saves(db_path: str, rows, concurrency: int):
+    writer = BatchWriter(db_path, schema=(CREATE_TRADES,))
+    await writer.start()
+    queue = iter(rows)
+
+    async def client():
+        for row in queue:
+            await writer.write(INSERT_TRADE, [row])
+
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    await writer.close()
+
+async def bulk_saves(db_path: str, rows, bulk: int):
+    writer = BatchWriter(db_path, schema=(CREATE_TRADES,))
+    await writer.start()
+    for start in range(0, len(rows), bulk):
+        await writer.write(INSERT_TRADE, rows[start:start + bulk])
+    await writer.close()
+
+def report(name: str, count: int, run):
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<40} {count / elapsed:>10,.0f} trades/s  ({count} trades in {elapsed:.2f}s)")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--trades', type=int, default=100_000)
+    parser.add_argument('--baseline-trades', type=int, default=2_000, help="trades for the slow connect-per-trade run")
+    parser.add_argument('--concurrency', type=int, default=256, help="concurrent single-trade savers")
+    parser.add_argument('--bulk', type=int, default=1000, help="trades per bulk save")
+    args = parser.parse_args()
+
+    rows = trades(args.trades)
+    with tempfile.TemporaryDirectory() as directory:
+        path = lambda name: os.path.join(directory, name)
+        report("connect + commit per trade", args.baseline_trades,
+               lambda: connect_per_trade(path('baseline.db'), rows[:args.baseline_trades]))
+        report(f"group commit, {args.concurrency} concurrent saves", args.trades,
+               lambda: asyncio.run(concurrent_saves(path('concurrent.db'), rows, args.concurrency)))
+        report(f"group commit, bulk saves of {args.bulk}", args.trades,
+               lambda: asyncio.run(bulk_saves(path('bulk.db'), rows, args.bulk)))
+
+if __name__ == '__main__':
+    main()
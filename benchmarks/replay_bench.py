@@ -0,0 +1,260 @@
+# Deterministic replay benchmark: feeds a recorded order stream (CSV like
+# client/100_orders.csv, or JSONL of orders / {"command": "add", "order": ...} messages)
+# into the engine at several resting book depths and reports throughput and latency.
+#
+#   python benchmarks/replay_bench.py --depths 1000,10000,100000,1000000 --output results.json
+#   python benchmarks/replay_bench.py --mode ws --baseline results.json
+#
+# Modes:
+#   inprocess  awaits OrderBookManager.add_order directly, one order at a time
+#   ws         sends each order over /ws and waits for its reply; the server runs under
+#              uvicorn in this same process, so the book can be pre-filled directly
+#
+# The book is pre-filled with `depth` resting orders priced away from the recorded stream,
+# then the stream is replayed `--repeat` times. Results (and a digest of every fill, so a
+# change in matching shows up too) are written as JSON; --baseline compares against an
+# earlier result file and exits non-zero on a regression.
+
+import os
+import sys
+import csv
+import json
+import time
+import socket
+import random
+import asyncio
+import hashlib
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+import server  # noqa: E402
+from engine import Order, OrderBookManager, VerifyMode  # noqa: E402
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+DEFAULT_INPUT = os.path.join(REPO_DIR, 'client', '100_orders.csv')
+
+def load_orders(path: str) -> List[Dict]:
+    """
+    Reads a recorded order stream. CSV rows use the client/100_orders.csv columns; JSONL
+    lines are either order objects or 'add' command messages (other commands are skipped).
+    """
+    orders = []
+    with open(path) as f:
+        if path.endswith('.csv'):
+            for row in csv.DictReader(f):
+                order = {
+                    'ticker': row['ticker'],
+                    'side': row['side'],
+                    'quantity': int(row['quantity']),
+                    'user_id': row['user_id'],
+                    'order_type': row['order_type'],
+                }
+                if row.get('price'):
+                    order['price'] = float(row['price'])
+                orders.append(order)
+        else:
+            for line in filter(None, (line.strip() for line in f)):
+                message = json.loads(line)
+                if 'command' in message:
+                    if message['command'] != 'add':
+                        continue
+                    message = message['order']
+                orders.append(message)
+    return orders
+
+def prefill_orders(stream: List[Dict], depth: int, seed: int = 1):
+    """
+    Yields `depth` resting orders spread over the stream's tickers: bids below its lowest
+    price and asks above its highest, so the stream rests inside the spread and only its
+    aggressive orders trade into the pre-filled depth.
+    """
+    tickers = sorted({order['ticker'] for order in stream})
+    prices = [order['price'] for order in stream if order.get('price') is not None] or [100.0]
+    low, high = min(prices), max(prices)
+    rnd = random.Random(seed)
+    for i in range(depth):
+        ticker = tickers[i % len(tickers)]
+        levels_away = rnd.randint(1, 1000)
+        if i % 2:
+            yield ticker, 'buy', max(low - levels_away, 1.0), rnd.randint(1, 100)
+        else:
+            yield ticker, 'sell', high + levels_away, rnd.randint(1, 100)
+
+async def prefill(manager: OrderBookManager, stream: List[Dict], depth: int):
+    # Straight into the book sides: replaying a deep book through matching would dominate the run
+    for ticker, side, price, quantity in prefill_orders(stream, depth):
+        order_book = await manager.get_order_book(ticker)
+        book_side = order_book.buy_orders if side == 'buy' else order_book.sell_orders
+        order_book.last_order_id += 1
+        book_side.add(order_book.last_order_id, order_book.to_ticks(price), quantity, 'prefill', 0.0)
+    for order_book in manager.order_books.values():
+        order_book.finish_replay()
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def summarize(latencies: List[float], fills: List[Dict], elapsed: float) -> Dict:
+    latencies.sort()
+    digest = hashlib.sha256()
+    for fill in fills:
+        digest.update(json.dumps({k: v for k, v in fill.items() if k != 'timestamp'}, sort_keys=True).encode())
+    return {
+        'orders': len(latencies),
+        'fills': len(fills),
+        'seconds': round(elapsed, 4),
+        'orders_per_sec': round(len(latencies) / elapsed, 1),
+        'fills_per_sec': round(len(fills) / elapsed, 1),
+        'latency_us': {
+            'p50': round(percentile(latencies, 0.50) * 1e6, 1),
+            'p99': round(percentile(latencies, 0.99) * 1e6, 1),
+            'p999': round(percentile(latencies, 0.999) * 1e6, 1),
+            'max': round(latencies[-1] * 1e6, 1) if latencies else 0.0,
+        },
+        'fills_digest': digest.hexdigest(),
+    }
+
+def new_manager(directory: str, verify_mode: str) -> OrderBookManager:
+    return OrderBookManager(db_name=os.path.join(directory, 'bench.db'), verify_mode=VerifyMode(verify_mode))
+
+async def run_inprocess(stream: List[Dict], depth: int, repeat: int, verify_mode: str) -> Dict:
+    with tempfile.TemporaryDirectory() as directory:
+        manager = new_manager(directory, verify_mode)
+        await manager.start()
+        await prefill(manager, stream, depth)
+        orders = [Order(**data) for data in stream]
+        latencies, fills = [], []
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for order in orders:
+                sent = time.perf_counter()
+                fills.extend(await manager.add_order(order))
+                latencies.append(time.perf_counter() - sent)
+        elapsed = time.perf_counter() - start
+        await manager.close()
+    return summarize(latencies, fills, elapsed)
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+async def run_ws(stream: List[Dict], depth: int, repeat: int, verify_mode: str) -> Dict:
+    import uvicorn
+    import websockets
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The endpoint looks the manager up as a module global, so it can be swapped out
+        manager = server.order_book_manager = new_manager(directory, verify_mode)
+        manager.on_depth_update = server.depth_feed.publish
+        await manager.start()
+        await prefill(manager, stream, depth)
+        port = free_port()
+        uvicorn_server = uvicorn.Server(uvicorn.Config(server.app, host='127.0.0.1', port=port, log_level='warning'))
+        serve = asyncio.create_task(uvicorn_server.serve())
+        while not uvicorn_server.started:
+            await asyncio.sleep(0.01)
+        messages = [json.dumps({'command': 'add', 'order': data}) for data in stream]
+        latencies, fills = [], []
+        async with websockets.connect(f'ws://127.0.0.1:{port}/ws', max_size=None) as websocket:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                for message in messages:
+                    sent = time.perf_counter()
+                    await websocket.send(message)
+                    # Sole client: every add gets exactly one reply, an ack or the fill broadcast
+                    reply = await websocket.recv()
+                    latencies.append(time.perf_counter() - sent)
+                    if reply.startswith('{'):
+                        fills.extend(json.loads(reply).get('matched_orders', []))
+                    elif reply.startswith('Error'):
+                        raise RuntimeError(f"Server rejected {message}: {reply}")
+            elapsed = time.perf_counter() - start
+        uvicorn_server.should_exit = True
+        await serve
+        await manager.close()
+    return summarize(latencies, fills, elapsed)
+
+def compare(results: List[Dict], baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Returns a description of every run that is slower than its baseline by more than
+    `tolerance` (a fraction) in throughput or p99 latency, or whose fills differ.
+    """
+    previous = {(run['mode'], run['depth']): run for run in baseline['runs']}
+    regressions = []
+    for run in results:
+        before = previous.get((run['mode'], run['depth']))
+        if before is None:
+            continue
+        name = f"{run['mode']} depth={run['depth']}"
+        if run['orders_per_sec'] < before['orders_per_sec'] * (1 - tolerance):
+            regressions.append(f"{name}: {run['orders_per_sec']} orders/s, baseline {before['orders_per_sec']}")
+        if run['latency_us']['p99'] > before['latency_us']['p99'] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {run['latency_us']['p99']}us, baseline {before['latency_us']['p99']}us")
+        if run['fills_digest'] != before['fills_digest'] and run['orders'] == before['orders']:
+            regressions.append(f"{name}: fills differ from the baseline")
+    return regressions
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', default=DEFAULT_INPUT, help='recorded orders, .csv or .jsonl')
+    parser.add_argument('--mode', choices=['inprocess', 'ws', 'both'], default='inprocess')
+    parser.add_argument('--depths', default='1000,10000,100000,1000000', help='comma-separated resting book depths')
+    parser.add_argument('--repeat', type=int, default=50, help='times to replay the recorded stream')
+    parser.add_argument('--verify-mode', choices=[mode.value for mode in VerifyMode], default=VerifyMode.OFF.value)
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='earlier --output file to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown vs the baseline')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(args.log_level)
+
+    stream = load_orders(args.input)
+    modes = ['inprocess', 'ws'] if args.mode == 'both' else [args.mode]
+    runners = {'inprocess': run_inprocess, 'ws': run_ws}
+    runs = []
+    for mode in modes:
+        for depth in (int(depth) for depth in args.depths.split(',')):
+            result = await runners[mode](stream, depth, args.repeat, args.verify_mode)
+            runs.append(dict(mode=mode, depth=depth, **result))
+            latency = result['latency_us']
+            print(f"{mode:<9} depth={depth:<8} {result['orders_per_sec']:9.0f} orders/s {result['fills_per_sec']:9.0f} fills/s  "
+                  f"p50={latency['p50']:.0f}us p99={latency['p99']:.0f}us p999={latency['p999']:.0f}us")
+
+    report = {
+        'input': os.path.relpath(args.input, REPO_DIR),
+        'repeat': args.repeat,
+        'verify_mode': args.verify_mode,
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'runs': runs,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(runs, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    asyncio.run(main())
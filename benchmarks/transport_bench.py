@@ -0,0 +1,68 @@
+# Message throughput and hop latency of the microservice transports (server/transport.py):
+# one publisher sends orders to the matching_engine queue as fast as it can, one consumer
+# handles them; then single messages are sent one at a time to time an idle hop.
+# 'amqp' needs a RabbitMQ at TINYTRADER_BROKER_URL.
+#
+#   python benchmarks/transport_bench.py --transports local,unix --messages 50000
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from transport import create_transport  # noqa: E402
+
+ORDER = {'ticker': 'AAPL', 'side': 'buy', 'quantity': 25, 'user_id': 'user3', 'order_type': 'limit', 'price': 187.25}
+
+async def run(kind: str, messages: int, pings: int):
+    received = []
+    done = asyncio.Event()
+    expected = messages
+
+    async def handle(message):
+        received.append(time.perf_counter() - message['sent'])
+        if len(received) == expected:
+            done.set()
+
+    consumer, publisher = create_transport(kind), create_transport(kind)
+    await consumer.start()
+    await publisher.start()
+    await consumer.consume('matching_engine', handle)
+
+    start = time.perf_counter()
+    for i in range(messages):
+        await publisher.publish('matching_engine', dict(ORDER, id=i, sent=time.perf_counter()))
+    await done.wait()
+    elapsed = time.perf_counter() - start
+
+    received.clear()
+    for i in range(pings):
+        done.clear()
+        expected = i + 1
+        await publisher.publish('matching_engine', dict(ORDER, id=i, sent=time.perf_counter()))
+        await done.wait()
+    await publisher.close()
+    await consumer.close()
+
+    received.sort()
+    percentile = lambda fraction: received[min(len(received) - 1, int(fraction * len(received)))] * 1e6
+    print(f"{kind:>6}: {messages / elapsed:>9,.0f} msg/s  idle hop p50 {percentile(0.5):>6,.0f}us  p99 {percentile(0.99):>6,.0f}us")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--transports', default='local,unix', help="comma-separated: local, unix, amqp")
+    parser.add_argument('--messages', type=int, default=50_000)
+    parser.add_argument('--pings', type=int, default=1000, help="one-at-a-time messages for the hop latency")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as socket_dir:
+        os.environ.setdefault('TINYTRADER_SOCKET_DIR', socket_dir)
+        for kind in args.transports.split(','):
+            asyncio.run(run(kind.strip(), args.messages, args.pings))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+# Compares the CPU cost and size of the JSON text protocol with the binary wire protocol
+# (server/wire.py) for the hot /ws messages: an add as the server decodes it, and a fill
+# report as the server encodes it.
+#
+#   python benchmarks/wire_codec.py --iterations 200000
+
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+import wire  # noqa: E402
+
+ORDER = {'ticker': 'AAPL', 'side': 'buy', 'quantity': 25, 'user_id': 'user3', 'order_type': 'limit', 'price': 187.25}
+FILLS = [
+    {'price': 187.25, 'quantity': 10, 'buy_user_id': 'user3', 'sell_user_id': 'user1',
+     'buy_order_id': 1042, 'sell_order_id': 977, 'timestamp': 1700000000.123456},
+    {'price': 187.25, 'quantity': 15, 'buy_user_id': 'user3', 'sell_user_id': 'user5',
+     'buy_order_id': 1042, 'sell_order_id': 981, 'timestamp': 1700000000.123456},
+]
+
+def timed(function, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start) / iterations
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=200_000)
+    args = parser.parse_args()
+
+    json_add = json.dumps({'command': 'add', 'order': ORDER, 'id': 7})
+    binary_add = wire.encode_add(7, ORDER)
+    json_fills = lambda: json.dumps({'id': 7, 'order_id': 1042, 'matched_orders': FILLS})
+    binary_fills = lambda: wire.encode_fills(7, 1042, FILLS)
+    cases = [
+        ('decode add', 'json', len(json_add), lambda: json.loads(json_add)['order']),
+        ('decode add', 'binary', len(binary_add), lambda: wire.decode_add(binary_add)),
+        ('encode fills', 'json', len(json_fills()), json_fills),
+        ('encode fills', 'binary', len(binary_fills()), binary_fills),
+    ]
+    for name, encoding, size, function in cases:
+        print(f"{name:<13} {encoding:<7} {timed(function, args.iterations) * 1e6:6.2f}us  {size:4} bytes")
+
+if __name__ == '__main__':
+    main()
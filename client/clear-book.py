@@ -1,4 +1,4 @@
-## clears book - gets active tickers sends buy/sell orders to clear the book at every price level and quantity
+## clears book - gets active tickers and cancels every resting order in their books
 
 import asyncio
 import websockets
@@ -38,45 +38,25 @@ async def fetch_order_book(ticker):
         # Parse and return the order book
         return json.loads(order_book_response)
 
-async def send_order(order, ticker):
+async def cancel_orders(ticker, orders):
     uri = "ws://localhost:8000/ws"
 
     async with websockets.connect(uri) as websocket:
-        # Send the order to the WebSocket server
-        order_message = {
-            "command": "add",
-            "order": {
+        for order in orders:
+            # Cancel each resting order by the id the server assigned it
+            cancel_message = {
+                "command": "cancel",
                 "ticker": ticker,
-                "side": order["side"],
-                "quantity": order["quantity"],
-                "user_id": "clear_bot",  # Arbitrary user ID
-                "order_type": "market",  # Use market orders to clear the book
-                "price": order["price"]
+                "order_id": order["order_id"]
             }
-        }
 
-        await websocket.send(json.dumps(order_message))
-        response = await websocket.recv()
-        print(f"Order Sent: {order_message} | Response: {response}")
+            await websocket.send(json.dumps(cancel_message))
+            response = await websocket.recv()
+            print(f"Cancel Sent: {cancel_message} | Response: {response}")
 
 async def clear_order_book(ticker, order_book):
-    # Send sell orders to match the buy orders in the book
-    for buy_order in order_book["buy"]:
-        order = {
-            "side": "sell",
-            "price": buy_order["price"],
-            "quantity": buy_order["quantity"]
-        }
-        await send_order(order, ticker)
-
-    # Send buy orders to match the sell orders in the book
-    for sell_order in order_book["sell"]:
-        order = {
-            "side": "buy",
-            "price": sell_order["price"],
-            "quantity": sell_order["quantity"]
-        }
-        await send_order(order, ticker)
+    # Cancel every resting order on both sides; nothing trades
+    await cancel_orders(ticker, order_book["buy"] + order_book["sell"])
 
 async def main():
     # Step 1: Fetch active tickers
@@ -0,0 +1,225 @@
+import os
+import sys
+import time
+import json
+import random
+import asyncio
+import argparse
+import itertools
+from typing import Dict, List
+
+import websockets
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+import wire  # noqa: E402
+
+# Pipelined load generator for the /ws endpoint. Each connection sends on a fixed
+# schedule (open loop) without waiting for replies; every request carries an "id" that
+# the server echoes, so replies are matched up as they arrive. Latency is measured from
+# the time a request was *scheduled*, so a server that falls behind can't hide it by
+# slowing the sender down.
+#
+#   python client/load-generator.py --connections 16 --rate 1000,5000,20000 --duration 10
+#
+# With --binary, adds go out as binary frames over the tinytrader.v1 subprotocol (see
+# server/wire.py) and checks stay JSON, so the two encodings can be compared at the same rate.
+#
+# Step --rate up until the reply rate stops following the send rate or latency climbs:
+# that's the saturation point of the endpoint.
+
+# The ticker set the dashboard used to poll
+TICKERS = ['AAPL', 'MSFT', 'NVDA', 'AMZN', 'GOOGL', 'META', 'BRK.A', 'BRK.B', 'LLY', 'TSM', 'TSLA']
+USERS = ['user1', 'user2', 'user3', 'user4', 'user5']
+
+# Latency histogram buckets: powers of two in microseconds, 1us .. ~67s
+BUCKETS_US = [2 ** i for i in range(27)]
+
+class OrderFlow:
+    """
+    Random order flow around a per-ticker mid price that drifts, so limit orders keep
+    crossing and some market orders trade against resting depth.
+    """
+
+    def __init__(self, seed: int, market_ratio: float, check_ratio: float):
+        self.rnd = random.Random(seed)
+        self.market_ratio = market_ratio
+        self.check_ratio = check_ratio
+        self.mids = {ticker: self.rnd.randint(50, 500) * 1.0 for ticker in TICKERS}
+
+    def next_message(self) -> Dict:
+        rnd = self.rnd
+        ticker = rnd.choice(TICKERS)
+        roll = rnd.random()
+        if roll < self.check_ratio:
+            return {"command": "check", "ticker": ticker, "depth": 10}
+        side = rnd.choice(["buy", "sell"])
+        order = {"ticker": ticker, "side": side, "quantity": rnd.randint(1, 100), "user_id": rnd.choice(USERS)}
+        if roll < self.check_ratio + self.market_ratio:
+            order["order_type"] = "market"
+        else:
+            self.mids[ticker] = max(1.0, self.mids[ticker] + rnd.choice([-0.01, 0, 0.01]))
+            # Buys mostly below mid and sells mostly above, with some overlap that trades
+            offset = rnd.randint(-20, 5) if side == "buy" else rnd.randint(-5, 20)
+            order["order_type"] = "limit"
+            order["price"] = round(max(0.01, self.mids[ticker] + offset * 0.01), 2)
+        return {"command": "add", "order": order}
+
+def message_type(message: Dict) -> str:
+    if message["command"] == "add":
+        return f"add_{message['order']['order_type']}"
+    return message["command"]
+
+class Stats:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.sent = 0
+        self.received = 0
+        self.errors = 0
+        self.unsolicited = 0  # Broadcasts and other messages without an id
+
+    def record(self, kind: str, latency: float):
+        self.latencies.setdefault(kind, []).append(latency)
+
+def parse_reply(raw):
+    """
+    Returns (request id or None, whether the reply is an error) for a text or binary reply.
+    """
+    if isinstance(raw, bytes):
+        message_type, correlation_id = wire.read_header(raw)
+        # Correlation id 0 is reserved for broadcasts; request ids start at 1
+        return correlation_id or None, message_type == wire.ERROR
+    if not raw.startswith('{'):
+        return None, False
+    reply = json.loads(raw)
+    return reply.get("id"), str(reply.get("message", "")).startswith("Error")
+
+async def run_connection(uri: str, flow: OrderFlow, rate: float, duration: float,
+                         drain_timeout: float, ids: itertools.count, stats: Stats, binary: bool):
+    # id -> (message type, scheduled send time)
+    pending: Dict[int, tuple] = {}
+    subprotocols = [wire.SUBPROTOCOL] if binary else None
+    async with websockets.connect(uri, max_size=None, subprotocols=subprotocols) as websocket:
+        async def receive():
+            async for raw in websocket:
+                request_id, error = parse_reply(raw)
+                request = pending.pop(request_id, None)
+                if request is None:
+                    stats.unsolicited += 1
+                    continue
+                kind, scheduled = request
+                stats.received += 1
+                stats.record(kind, time.perf_counter() - scheduled)
+                if error:
+                    stats.errors += 1
+                if not pending and sending_done.is_set():
+                    return
+
+        sending_done = asyncio.Event()
+        receiver = asyncio.create_task(receive())
+        interval = 1.0 / rate
+        start = time.perf_counter()
+        for sequence in itertools.count():
+            scheduled = start + sequence * interval
+            if scheduled - start >= duration:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            message = flow.next_message()
+            message["id"] = next(ids)
+            pending[message["id"]] = (message_type(message), scheduled)
+            if binary and message["command"] == "add":
+                await websocket.send(wire.encode_add(message["id"], message["order"]))
+            else:
+                await websocket.send(json.dumps(message))
+            stats.sent += 1
+        sending_done.set()
+        if pending:
+            try:
+                await asyncio.wait_for(receiver, drain_timeout)
+            except asyncio.TimeoutError:
+                pass
+        receiver.cancel()
+        return len(pending)
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def histogram(latencies: List[float]) -> List[tuple]:
+    counts = [0] * len(BUCKETS_US)
+    for latency in latencies:
+        micros = latency * 1e6
+        for index, bound in enumerate(BUCKETS_US):
+            if micros <= bound or index == len(BUCKETS_US) - 1:
+                counts[index] += 1
+                break
+    return [(bound, count) for bound, count in zip(BUCKETS_US, counts) if count]
+
+def report(rate: float, connections: int, duration: float, stats: Stats, lost: int, show_histogram: bool) -> Dict:
+    result = {
+        "target_rate": rate,
+        "connections": connections,
+        "sent_per_sec": round(stats.sent / duration, 1),
+        "replies_per_sec": round(stats.received / duration, 1),
+        "errors": stats.errors,
+        "lost": lost,
+        "unsolicited": stats.unsolicited,
+        "latency_ms": {},
+    }
+    print(f"\ntarget {rate:.0f} msg/s over {connections} connections: sent {result['sent_per_sec']:.0f}/s, "
+          f"replies {result['replies_per_sec']:.0f}/s, {stats.errors} errors, {lost} unanswered, "
+          f"{stats.unsolicited} broadcasts")
+    print(f"  {'type':<12} {'count':>8} {'p50':>9} {'p90':>9} {'p99':>9} {'p999':>9} {'max':>9}  (ms)")
+    for kind, latencies in sorted(stats.latencies.items()):
+        latencies.sort()
+        summary = {name: round(percentile(latencies, q) * 1e3, 3)
+                   for name, q in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("p999", 0.999))}
+        summary["max"] = round(latencies[-1] * 1e3, 3)
+        summary["count"] = len(latencies)
+        result["latency_ms"][kind] = summary
+        print(f"  {kind:<12} {len(latencies):>8} {summary['p50']:>9.3f} {summary['p90']:>9.3f} "
+              f"{summary['p99']:>9.3f} {summary['p999']:>9.3f} {summary['max']:>9.3f}")
+        if show_histogram:
+            buckets = histogram(latencies)
+            peak = max(count for _, count in buckets)
+            for bound, count in buckets:
+                print(f"    <= {bound:>9}us {count:>8} {'#' * max(1, round(40 * count / peak))}")
+        result["latency_ms"][kind]["histogram_us"] = histogram(latencies)
+    return result
+
+async def run_step(args, rate: float, seed: int) -> Dict:
+    stats = Stats()
+    ids = itertools.count(1)
+    per_connection = rate / args.connections
+    flows = [OrderFlow(seed + i, args.market_ratio, args.check_ratio) for i in range(args.connections)]
+    lost = await asyncio.gather(*[
+        run_connection(args.uri, flow, per_connection, args.duration, args.drain_timeout, ids, stats, args.binary)
+        for flow in flows
+    ])
+    return report(rate, args.connections, args.duration, stats, sum(lost), args.histogram)
+
+async def main():
+    parser = argparse.ArgumentParser(description="Pipelined open-loop load generator for the /ws endpoint")
+    parser.add_argument("--uri", default="ws://localhost:8000/ws")
+    parser.add_argument("--connections", type=int, default=8)
+    parser.add_argument("--rate", default="1000", help="total messages/s; a comma-separated list runs one step per rate")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per step")
+    parser.add_argument("--market-ratio", type=float, default=0.1, help="fraction of messages that are market orders")
+    parser.add_argument("--check-ratio", type=float, default=0.05, help="fraction of messages that are depth checks")
+    parser.add_argument("--drain-timeout", type=float, default=10.0, help="seconds to wait for outstanding replies")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--binary", action="store_true", help="send adds over the binary wire protocol")
+    parser.add_argument("--histogram", action="store_true", help="print a latency histogram per message type")
+    parser.add_argument("--output", help="write every step's results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    for rate in (float(rate) for rate in args.rate.split(",")):
+        results.append(await run_step(args, rate, args.seed))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    asyncio.run(main())
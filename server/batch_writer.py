@@ -0,0 +1,215 @@
+import time
+import logging
+import asyncio
+from typing import List, Optional, Sequence, Tuple
+
+import aiosqlite
+
+# Sentinel pushed onto the queue to stop the writer loop
+_STOP = object()
+
+# Pragmas for a dedicated writer connection. WAL lets readers run alongside the writer;
+# synchronous=NORMAL only fsyncs at checkpoints, so a commit survives a process crash but
+# the last transactions can be lost on power failure.
+WRITER_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-65536',  # 64 MiB page cache
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA wal_autocheckpoint=10000',  # Pages; fewer, larger checkpoints under sustained inserts
+)
+
+# Group-commit machinery shared by the writers: one long-lived connection, a queue that
+# never blocks submitters, and a background loop committing whatever has arrived together
+class GroupCommitWriter:
+    """
+    Subclasses queue items with _enqueue() and implement _write_batch(), which writes a
+    batch and resolves its futures. The loop collects items until `max_batch_size` rows
+    or `max_delay` seconds, whichever comes first.
+    """
+
+    name = "Group-commit writer"
+
+    def __init__(self, db_path: str, schema: Sequence[str] = (), max_batch_size: int = 5000,
+                 max_delay: float = 0.005, pragmas: Sequence[str] = WRITER_PRAGMAS):
+        self.db_path = db_path
+        self.schema = schema
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.pragmas = pragmas
+        self._db: Optional[aiosqlite.Connection] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._start_lock = asyncio.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        """
+        Opens the connection, applies the pragmas and schema and starts the writer loop.
+        Idempotent.
+        """
+        async with self._start_lock:
+            if self.running:
+                return
+            # Generous busy timeout: sharded matching workers each run a writer on the same file
+            self._db = await aiosqlite.connect(self.db_path, timeout=30)
+            for pragma in self.pragmas:
+                await self._db.execute(pragma)
+            for statement in self.schema:
+                await self._db.execute(statement)
+            await self._db.commit()
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+            logging.info(f"{self.name} started for {self.db_path}")
+
+    def _enqueue(self, item: Tuple) -> asyncio.Future:
+        """
+        Queues an item whose last element is its future, which is returned. Never blocks.
+        """
+        self._queue.put_nowait(item)
+        return item[-1]
+
+    def _item_rows(self, item: Tuple) -> int:
+        """
+        Rows an item adds to a batch, counted against `max_batch_size`.
+        """
+        return 1
+
+    async def flush(self):
+        """
+        Waits until everything submitted so far has been written.
+        """
+        if self.running:
+            await self._queue.join()
+
+    async def close(self):
+        if self.running:
+            self._queue.put_nowait(_STOP)
+            await self._task
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+        logging.info(f"{self.name} closed for {self.db_path}")
+
+    async def _next_batch(self) -> Tuple[List, bool]:
+        """
+        Blocks for the first item, then collects more until the batch holds
+        `max_batch_size` rows or `max_delay` has elapsed. Returns the batch and whether
+        a stop was requested.
+        """
+        item = await self._queue.get()
+        if item is _STOP:
+            self._queue.task_done()
+            return [], True
+        batch = [item]
+        rows = self._item_rows(item)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while rows < self.max_batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if item is _STOP:
+                self._queue.task_done()
+                return batch, True
+            batch.append(item)
+            rows += self._item_rows(item)
+        return batch, False
+
+    async def _run(self):
+        stop = False
+        while not stop:
+            batch, stop = await self._next_batch()
+            if batch:
+                try:
+                    await self._write_batch(batch)
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+
+    async def _write_batch(self, batch: List):
+        raise NotImplementedError
+
+    async def _rollback(self):
+        try:
+            await self._db.rollback()
+        except Exception:
+            pass
+
+# Group-commit writer for any set of tables
+class BatchWriter(GroupCommitWriter):
+    """
+    Writes rows for any statements. Callers submit (statement, rows) pairs without
+    blocking; each batch runs each statement once with executemany and commits the lot in
+    one transaction. Each submission gets a future that resolves once its rows are
+    committed.
+    """
+
+    name = "Batch writer"
+
+    def __init__(self, db_path: str, schema: Sequence[str] = (), max_batch_size: int = 5000,
+                 max_delay: float = 0.005, pragmas: Sequence[str] = WRITER_PRAGMAS):
+        super().__init__(db_path, schema, max_batch_size, max_delay, pragmas)
+        self.rows_written = 0
+
+    def submit(self, statement: str, rows: List[Tuple]) -> asyncio.Future:
+        """
+        Queues rows for the next group commit. Never blocks.
+        """
+        return self._enqueue((statement, rows, asyncio.get_running_loop().create_future()))
+
+    async def write(self, statement: str, rows: List[Tuple]):
+        """
+        Queues rows and waits until they are committed.
+        """
+        await self.submit(statement, rows)
+
+    def _item_rows(self, item: Tuple) -> int:
+        return len(item[1])
+
+    async def _write_batch(self, batch: List):
+        started = time.perf_counter()
+        # One executemany per statement, keeping submissions in order within each
+        statements = {}
+        for statement, rows, _ in batch:
+            statements.setdefault(statement, []).extend(rows)
+        try:
+            for statement, rows in statements.items():
+                await self._db.executemany(statement, rows)
+            await self._db.commit()
+        except Exception as e:
+            logging.error(f"Failed to write {len(batch)} submissions: {e}")
+            await self._rollback()
+            # Retried one by one so a single bad submission doesn't fail the others
+            for statement, rows, future in batch:
+                await self._write_one(statement, rows, future)
+            return
+        rows = sum(len(rows) for rows in statements.values())
+        self.rows_written += rows
+        for _, _, future in batch:
+            if not future.done():
+                future.set_result(None)
+        logging.debug("Committed %d rows in %.1fms", rows, (time.perf_counter() - started) * 1000)
+
+    async def _write_one(self, statement: str, rows: List[Tuple], future: asyncio.Future):
+        try:
+            await self._db.executemany(statement, rows)
+            await self._db.commit()
+        except Exception as e:
+            await self._rollback()
+            if not future.done():
+                future.set_exception(e)
+            return
+        self.rows_written += len(rows)
+        if not future.done():
+            future.set_result(None)
@@ -0,0 +1,119 @@
+import json
+import logging
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional
+
+from fastapi import WebSocket
+
+from log_config import hot_logger
+
+SnapshotGetter = Callable[[str], Awaitable[Dict]]
+
+# Queued in place of the backlog when a subscriber falls behind
+_RESYNC = (None, None)
+
+# One WebSocket's subscription to one ticker's depth feed
+class DepthSubscription:
+    def __init__(self, websocket: WebSocket, ticker: str, get_snapshot: SnapshotGetter, queue_size: int):
+        self.websocket = websocket
+        self.ticker = ticker
+        self.get_snapshot = get_snapshot
+        # (sequence, serialized update); filled from the moment of subscribing so nothing
+        # published while the snapshot is being taken is lost
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.task: Optional[asyncio.Task] = None
+
+    def push(self, item):
+        """
+        Queues an update. A subscriber that falls a full queue behind is conflated: its
+        backlog is discarded and replaced by a fresh snapshot of the current book.
+        """
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(_RESYNC)
+            hot_logger.debug("Conflating depth feed for %s to slow client %s", self.ticker, self.websocket.client)
+
+    async def run(self, snapshot: Dict, on_error: Callable[['DepthSubscription'], None]):
+        """
+        Sends the snapshot, then every update newer than it, in sequence order.
+        """
+        try:
+            await self.websocket.send_text(json.dumps(snapshot))
+            sequence_sent = snapshot['sequence']
+            while True:
+                sequence, message = await self.queue.get()
+                if sequence is None:
+                    snapshot = await self.get_snapshot(self.ticker)
+                    await self.websocket.send_text(json.dumps(snapshot))
+                    sequence_sent = snapshot['sequence']
+                    continue
+                if sequence <= sequence_sent:
+                    continue  # Already reflected in the snapshot
+                await self.websocket.send_text(message)
+                sequence_sent = sequence
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(f"Dropping depth subscription for {self.ticker} to {self.websocket.client}: {e}")
+            on_error(self)
+
+# Incremental depth feed: a snapshot on subscribe, then sequenced price-level deltas
+class DepthFeed:
+    def __init__(self, queue_size: int = 1024):
+        self.subscriptions: Dict[str, Dict[WebSocket, DepthSubscription]] = {}
+        self.queue_size = queue_size
+
+    def publish(self, update: Dict):
+        """
+        Queues a depth update for every subscriber of its ticker. Called synchronously by
+        the order book, so it only serializes once and enqueues.
+        """
+        subscribers = self.subscriptions.get(update['ticker'])
+        if not subscribers:
+            return
+        item = (update['sequence'], json.dumps(update))
+        for subscription in subscribers.values():
+            subscription.push(item)
+
+    async def subscribe(self, websocket: WebSocket, ticker: str, get_snapshot: SnapshotGetter, request_id=None):
+        """
+        Registers the subscription before taking the snapshot, so the feed has no gaps;
+        updates already covered by the snapshot are skipped by sequence number. The first
+        snapshot is the reply to the subscribe request and echoes its id, if it had one.
+        """
+        self.unsubscribe(websocket, ticker)
+        subscription = DepthSubscription(websocket, ticker, get_snapshot, self.queue_size)
+        self.subscriptions.setdefault(ticker, {})[websocket] = subscription
+        try:
+            snapshot = await get_snapshot(ticker)
+        except Exception:
+            self.unsubscribe(websocket, ticker)
+            raise
+        if request_id is not None:
+            snapshot = {"id": request_id, **snapshot}
+        subscription.task = asyncio.create_task(subscription.run(snapshot, self._remove))
+        logging.info(f"Client {websocket.client} subscribed to depth for {ticker} at sequence {snapshot['sequence']}")
+
+    def unsubscribe(self, websocket: WebSocket, ticker: str) -> bool:
+        subscribers = self.subscriptions.get(ticker)
+        subscription = subscribers.pop(websocket, None) if subscribers else None
+        if subscription is None:
+            return False
+        if not subscribers:
+            del self.subscriptions[ticker]
+        if subscription.task is not None:
+            subscription.task.cancel()
+        return True
+
+    def unsubscribe_all(self, websocket: WebSocket):
+        for ticker in list(self.subscriptions):
+            self.unsubscribe(websocket, ticker)
+
+    def _remove(self, subscription: DepthSubscription):
+        subscribers = self.subscriptions.get(subscription.ticker)
+        if subscribers and subscribers.get(subscription.websocket) is subscription:
+            subscription.task = None  # Called from inside the task; don't cancel it
+            self.unsubscribe(subscription.websocket, subscription.ticker)
@@ -0,0 +1,1013 @@
+import os
+import sys
+import math
+import time
+import logging
+import random
+import asyncio
+import bisect
+import itertools
+from enum import Enum
+from decimal import Decimal
+from typing import List, Dict, Optional, Iterator, Set, Callable, Tuple
+
+from pydantic import BaseModel, Field, TypeAdapter, model_validator, validator
+from trade_writer import TradeWriter
+from log_config import hot_logger
+from metrics import registry
+from journal import Journal, ORDER_ACCEPTED, FILL, CANCEL, ORDER_IDS, encode_accepted, encode_order_ids
+
+# The matching engine: order models and parsing, the price-level book and
+# OrderBookManager. server.py serves it over /ws, sharding.py runs it in worker
+# processes and matching_engine_service.py consumes orders into it from a queue.
+
+# Engine metrics, exposed on /metrics. With sharding these are recorded in the shard
+# processes, so /metrics shows the WebSocket and broadcast metrics only.
+orders_total = registry.counter('tinytrader_orders', 'Orders accepted by the order books', ('order_type',))
+fills_total = registry.counter('tinytrader_fills', 'Fills produced by matching')
+add_order_seconds = registry.histogram('tinytrader_add_order_seconds',
+                                       'OrderBook.add_orders latency, including waiting for the lock')
+lock_wait_seconds = registry.histogram('tinytrader_book_lock_wait_seconds', 'Time spent waiting for an order book lock')
+
+# Enums for order sides and types
+class OrderSide(str, Enum):
+    BUY = "buy"
+    SELL = "sell"
+
+class OrderType(str, Enum):
+    MARKET = "market"
+    LIMIT = "limit"
+
+# How thoroughly fills are verified against the database after matching
+class VerifyMode(str, Enum):
+    OFF = "off"
+    SAMPLED = "sampled"  # Verify the fills of a random fraction of orders
+    FULL = "full"  # Verify every fill by the row id returned from its insert
+
+# Longest ticker or user_id in UTF-8 bytes. They are sent as u8-length strings on the
+# binary protocol (wire.py) and journaled as u16-length ones, so anything longer has to be
+# rejected before it reaches a book.
+MAX_STRING_BYTES = 255
+# Quantities are journaled and sent as signed 64-bit integers
+MAX_QUANTITY = 2 ** 63 - 1
+
+# Order model with validation
+class Order(BaseModel):
+    ticker: str
+    side: OrderSide
+    quantity: int
+    user_id: str
+    order_type: OrderType
+    price: Optional[float] = None
+    timestamp: float = Field(default_factory=time.time)
+    order_id: Optional[int] = None  # Assigned by the order book when the order is added
+
+    @validator('quantity')
+    def quantity_must_be_positive(cls, v):
+        if v <= 0:
+            raise ValueError('Quantity must be positive.')
+        if v > MAX_QUANTITY:
+            raise ValueError(f'Quantity must be at most {MAX_QUANTITY}.')
+        return v
+
+    @validator('ticker', 'user_id')
+    def string_must_fit(cls, v):
+        if len(v.encode()) > MAX_STRING_BYTES:
+            raise ValueError(f'Must be at most {MAX_STRING_BYTES} bytes.')
+        return v
+
+    @model_validator(mode='after')
+    def check_price(self):
+        if self.order_type == OrderType.LIMIT and self.price is None:
+            raise ValueError("Price is required for limit orders.")
+        if self.order_type == OrderType.MARKET:
+            self.price = None  # Ensure price is None for market orders
+        return self
+
+# Validates a whole add_batch in one call; errors are located by (index, field)
+order_batch_adapter = TypeAdapter(List[Order])
+
+limit_orders_total = orders_total.labels(OrderType.LIMIT.value)
+market_orders_total = orders_total.labels(OrderType.MARKET.value)
+
+# Fields a client order may carry for the fast path; timestamp and order_id are server-set
+_FAST_ORDER_FIELDS = frozenset(('ticker', 'side', 'quantity', 'user_id', 'order_type', 'price'))
+_ORDER_SIDES = {side.value: side for side in OrderSide}
+_ORDER_TYPES = {order_type.value: order_type for order_type in OrderType}
+_ORDER_FIELDS = frozenset(Order.model_fields)
+# Strings this long fit MAX_STRING_BYTES whatever they contain; longer ones get the exact check
+_FAST_MAX_CHARS = MAX_STRING_BYTES // 4
+_new_order = Order.__new__
+_set_attribute = object.__setattr__
+
+def _construct_order(data) -> Optional[Order]:
+    """
+    Builds an Order without running validation when `data` is plainly valid as decoded
+    from JSON: exact types, known enum values, a positive quantity and a price on limit
+    orders, and short strings. Returns None for anything else, which must go through full
+    validation.
+    """
+    if type(data) is not dict or not data.keys() <= _FAST_ORDER_FIELDS:
+        return None
+    ticker, user_id, quantity, price = data.get('ticker'), data.get('user_id'), data.get('quantity'), data.get('price')
+    side, order_type = data.get('side'), data.get('order_type')
+    if (type(ticker) is not str or type(user_id) is not str or type(side) is not str or type(order_type) is not str
+            or len(ticker) > _FAST_MAX_CHARS or len(user_id) > _FAST_MAX_CHARS
+            or type(quantity) is not int or quantity <= 0 or quantity > MAX_QUANTITY
+            or price is not None and type(price) is not float and type(price) is not int):
+        return None
+    side, order_type = _ORDER_SIDES.get(side), _ORDER_TYPES.get(order_type)
+    if side is None or order_type is None:
+        return None
+    if price is not None:
+        try:
+            price = float(price)
+        except OverflowError:
+            # An integer too large for a float; pydantic reports it as a ValidationError
+            return None
+    if order_type is OrderType.LIMIT:
+        if price is None:
+            return None
+    else:
+        price = None  # As check_price does for market orders
+    # What Order.model_construct sets up, without its per-field default handling, which
+    # costs more than validating
+    order = _new_order(Order)
+    _set_attribute(order, '__dict__', {'ticker': ticker, 'side': side, 'quantity': quantity, 'user_id': user_id,
+                                       'order_type': order_type, 'price': price, 'timestamp': time.time(),
+                                       'order_id': None})
+    _set_attribute(order, '__pydantic_fields_set__', set(_ORDER_FIELDS))
+    _set_attribute(order, '__pydantic_extra__', None)
+    _set_attribute(order, '__pydantic_private__', None)
+    return order
+
+def parse_order(data) -> Order:
+    """
+    Same result as Order(**data), but well-formed orders skip pydantic validation.
+    Anything else falls back to Order(**data), so invalid orders raise the same
+    ValidationError.
+    """
+    order = _construct_order(data)
+    return Order(**data) if order is None else order
+
+def parse_orders(orders_data: List) -> List[Order]:
+    """
+    parse_order for an add_batch. If any order needs full validation the whole batch
+    gets it, so errors keep the (index, field) locations order_batch_adapter reports.
+    """
+    orders = []
+    for data in orders_data:
+        order = _construct_order(data)
+        if order is None:
+            return order_batch_adapter.validate_python(orders_data)
+        orders.append(order)
+    return orders
+
+# Ticks are journaled as signed 64-bit integers
+MAX_PRICE_TICKS = 2 ** 63 - 1
+
+def price_to_ticks(price: float, tick_size: float, ticker: str) -> int:
+    """
+    A price as a whole number of ticks of `tick_size`. Raises ValueError for a price that
+    isn't finite and positive or isn't a multiple of the tick size.
+    """
+    # Checked before round(), which raises OverflowError for inf rather than ValueError
+    if not math.isfinite(price):
+        raise ValueError(f"Price must be finite, got {price}")
+    scaled = price / tick_size
+    if scaled > MAX_PRICE_TICKS:
+        raise ValueError(f"Price {price} is too large")
+    ticks = round(scaled) if scaled > 0 else 0
+    if ticks <= 0:
+        raise ValueError(f"Price must be positive, got {price}")
+    if abs(ticks * tick_size - price) > tick_size * 1e-6:
+        raise ValueError(f"Price {price} is not a multiple of the {ticker} tick size {tick_size}")
+    return ticks
+
+# Lightweight record for an order resting in the book. Orders are validated as pydantic
+# models at the API edge; once in the book only these fields change or matter.
+# Ticker, side and order type are implied by the book, side and level holding the order.
+# Price is an integer number of ticks, see OrderBook.to_ticks. prev/next link the order
+# into its price level's queue, so it can be unlinked from the middle in O(1).
+class RestingOrder:
+    __slots__ = ('order_id', 'price', 'quantity', 'user_id', 'timestamp', 'prev', 'next')
+
+    def __init__(self, order_id: int, price: int, quantity: int, user_id: str, timestamp: float):
+        self.order_id = order_id
+        self.price = price
+        self.quantity = quantity
+        self.user_id = user_id
+        self.timestamp = timestamp
+        self.prev: Optional['RestingOrder'] = None
+        self.next: Optional['RestingOrder'] = None
+
+    def to_dict(self, ticker: str, side: OrderSide, price: float) -> Dict:
+        return {
+            'order_id': self.order_id,
+            'ticker': ticker,
+            'side': side.value,
+            'quantity': self.quantity,
+            'user_id': self.user_id,
+            'order_type': OrderType.LIMIT.value,
+            'price': price,
+            'timestamp': self.timestamp
+        }
+
+# A single price level holding resting orders in time priority (FIFO), as a doubly linked
+# list threaded through the orders themselves
+class PriceLevel:
+    __slots__ = ('price', 'head', 'tail', 'count', 'quantity')
+
+    def __init__(self, price: int):
+        self.price = price
+        self.head: Optional[RestingOrder] = None  # Oldest order, the next to trade
+        self.tail: Optional[RestingOrder] = None
+        self.count = 0
+        self.quantity = 0  # Total resting quantity, kept up to date for depth feeds
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[RestingOrder]:
+        order = self.head
+        while order is not None:
+            yield order
+            order = order.next
+
+    def append(self, order: RestingOrder):
+        order.prev, order.next = self.tail, None
+        if self.tail is None:
+            self.head = order
+        else:
+            self.tail.next = order
+        self.tail = order
+        self.count += 1
+        self.quantity += order.quantity
+
+    def remove(self, order: RestingOrder):
+        """
+        Unlinks an order from anywhere in the queue in O(1).
+        """
+        if order.prev is None:
+            self.head = order.next
+        else:
+            order.prev.next = order.next
+        if order.next is None:
+            self.tail = order.prev
+        else:
+            order.next.prev = order.prev
+        order.prev = order.next = None
+        self.count -= 1
+        self.quantity -= order.quantity
+
+# One side of the book: a sorted index of price levels plus a dict for O(1) level lookup,
+# and an order id index for O(1) cancels
+class BookSide:
+    def __init__(self, side: OrderSide):
+        self.side = side
+        self.levels: Dict[int, PriceLevel] = {}
+        # Sorted ascending so the best level is always at the end: bids are keyed by
+        # price, asks by negated price. Popping the best level is then O(1).
+        self._keys: List[int] = []
+        self._sign = 1 if side == OrderSide.BUY else -1
+        self.orders: Dict[int, RestingOrder] = {}  # Resting orders by order id
+        self._changed: Set[int] = set()  # Prices of levels touched since the last pop_changes()
+
+    def __len__(self) -> int:
+        return len(self.orders)
+
+    def __bool__(self) -> bool:
+        return bool(self.orders)
+
+    def __iter__(self) -> Iterator[PriceLevel]:
+        """
+        Yields price levels best price first; orders within a level are in arrival order.
+        """
+        for key in reversed(self._keys):
+            yield self.levels[key * self._sign]
+
+    def add(self, order_id: int, price: int, quantity: int, user_id: str, timestamp: float) -> RestingOrder:
+        level = self.levels.get(price)
+        if level is None:
+            level = PriceLevel(price)
+            self.levels[price] = level
+            bisect.insort(self._keys, price * self._sign)
+        # Share the level's price object and intern user ids so deep books stay compact
+        resting = RestingOrder(order_id, level.price, quantity, sys.intern(user_id), timestamp)
+        level.append(resting)
+        self.orders[order_id] = resting
+        self._changed.add(price)
+        return resting
+
+    def best_level(self) -> Optional[PriceLevel]:
+        if not self._keys:
+            return None
+        return self.levels[self._keys[-1] * self._sign]
+
+    def best_order(self) -> Optional[RestingOrder]:
+        level = self.best_level()
+        return level.head if level else None
+
+    def fill_best_order(self, quantity: int) -> RestingOrder:
+        """
+        Takes `quantity` off the order at the top of the book, removing it once fully filled.
+        """
+        level = self.best_level()
+        order = level.head
+        order.quantity -= quantity
+        level.quantity -= quantity
+        self._changed.add(level.price)
+        if order.quantity == 0:
+            self._remove(level, order)
+        return order
+
+    def pop_best_order(self) -> RestingOrder:
+        level = self.best_level()
+        order = level.head
+        self._remove(level, order)
+        return order
+
+    def reduce(self, order_id: int, quantity: int) -> Optional[RestingOrder]:
+        """
+        Takes `quantity` off a resting order without trading, keeping its time priority,
+        and removes it once nothing is left. Returns None for an unknown order id.
+        """
+        order = self.orders.get(order_id)
+        if order is None:
+            return None
+        level = self.levels[order.price]
+        order.quantity -= quantity
+        level.quantity -= quantity
+        self._changed.add(level.price)
+        if order.quantity == 0:
+            self._remove(level, order)
+        return order
+
+    def _remove(self, level: PriceLevel, order: RestingOrder):
+        level.remove(order)
+        del self.orders[order.order_id]
+        self._changed.add(level.price)
+        if not level.count:
+            key = level.price * self._sign
+            if self._keys[-1] == key:
+                self._keys.pop()
+            else:
+                del self._keys[bisect.bisect_left(self._keys, key)]
+            del self.levels[level.price]
+
+    def depth(self, limit: Optional[int] = None) -> List[Tuple[int, int, int]]:
+        """
+        Aggregated levels, best first, as (price, total quantity, order count).
+        Only the best `limit` levels are visited when a limit is given.
+        """
+        return [(level.price, level.quantity, level.count) for level in itertools.islice(self, limit)]
+
+    def pop_changes(self) -> List[Tuple[int, int, int]]:
+        """
+        Returns (price, total quantity, order count) for every level touched since the last
+        call; removed levels are reported with zero quantity and count.
+        """
+        changes = []
+        for price in self._changed:
+            level = self.levels.get(price)
+            changes.append((price, level.quantity, level.count) if level else (price, 0, 0))
+        self._changed.clear()
+        return changes
+
+# OrderBook class to manage orders for a ticker
+class OrderBook:
+    def __init__(self, ticker: str, db_path: str, trade_writer: Optional[TradeWriter] = None,
+                 verify_mode: VerifyMode = VerifyMode.FULL, verify_sample_rate: float = 0.01,
+                 tick_size: float = 0.01, active_tickers: Optional[Set[str]] = None,
+                 depth_listener: Optional[Callable[[Dict], None]] = None, journal: Optional[Journal] = None):
+        self.ticker = ticker
+        if tick_size <= 0:
+            raise ValueError(f"Tick size must be positive, got {tick_size}")
+        self.tick_size = float(tick_size)
+        self._tick_decimals = max(0, -Decimal(str(tick_size)).normalize().as_tuple().exponent)
+        self.buy_orders = BookSide(OrderSide.BUY)
+        self.sell_orders = BookSide(OrderSide.SELL)
+        self.lock = asyncio.Lock()  # Ensure thread-safe operations
+        self.db_path = db_path
+        self.trade_writer = trade_writer or TradeWriter(db_path)
+        self._pending_writes: List[asyncio.Future] = []
+        self.verify_mode = VerifyMode(verify_mode)
+        self.verify_sample_rate = verify_sample_rate
+        # Shared with the manager; this book keeps its own ticker in it while it has resting orders
+        self.active_tickers = active_tickers if active_tickers is not None else set()
+        # Incremented on every change to the book's depth; stamped on snapshots and updates.
+        # Any change to a resting order changes its level, so this is also the book's version.
+        self.sequence = 0
+        self.depth_listener = depth_listener
+        # Snapshots built at self._cache_sequence, keyed by view; dropped once the book changes
+        self._snapshot_cache: Dict = {}
+        self._cache_sequence = 0
+        # Every accepted order and fill is journaled so the book can be rebuilt after a crash
+        self.journal = journal
+        self.last_order_id = 0  # Order ids are unique per book
+
+    def to_ticks(self, price: float) -> int:
+        """
+        Converts an API price to an integer number of ticks. Prices inside the book are
+        always ticks, so comparisons and level lookups are exact integer operations.
+        """
+        return price_to_ticks(price, self.tick_size, self.ticker)
+
+    def from_ticks(self, ticks: int) -> float:
+        """
+        Converts ticks back to an API price, rounded to the tick size's decimals so the
+        same tick always maps to the same float (and the same sqlite REAL).
+        """
+        return round(ticks * self.tick_size, self._tick_decimals)
+
+    async def initialize_db(self):
+        """
+        Initialize the cleared_trades table if it doesn't exist and start the trade writer.
+        """
+        await self.trade_writer.start()
+        logging.info(f"Database initialized for ticker: {self.ticker}")
+
+    def _persist_cleared_trade(self, order_type: str, price: float, quantity: int, filler_user_id: str, filled_user_id: str) -> asyncio.Future:
+        """
+        Queues a cleared trade for the next group commit without waiting on disk.
+        Returns a future that resolves to the trade row id once it is durable.
+        """
+        future = self.trade_writer.submit(self.ticker, order_type, price, quantity, filler_user_id, filled_user_id)
+        self._pending_writes.append(future)
+        hot_logger.debug("Queued cleared trade: %s, %s, %s, %s, %s", order_type, price, quantity, filler_user_id, filled_user_id)
+        return future
+
+    def price_ticks(self, order: Order) -> Optional[int]:
+        return self.to_ticks(order.price) if order.order_type == OrderType.LIMIT else None
+
+    async def add_order(self, order: Order, durable: bool = False):
+        """
+        Adds an order and runs matching. Fills and journal records are persisted in the
+        background; pass durable=True to wait until they are on disk before returning.
+        """
+        results = await self.add_orders([order], durable=durable)
+        return results[0]
+
+    async def add_orders(self, orders: List[Order], durable: bool = False) -> List[List[Dict]]:
+        """
+        Adds orders in sequence under a single lock acquisition, returning each one's fills.
+        Every price is checked first, so an invalid order rejects the batch before any trades.
+        """
+        started = time.perf_counter()
+        prices = [self.price_ticks(order) for order in orders]
+        results, pending_writes = await self._add_orders_locked(orders, prices)
+        matched_orders = [fill for fills in results for fill in fills]
+        await self._settle(matched_orders, pending_writes, durable)
+        add_order_seconds.observe(time.perf_counter() - started)
+        return results
+
+    async def cancel_order(self, order_id: int, durable: bool = False) -> Optional[Dict]:
+        """
+        Removes a resting order in O(1). Returns it as it was when cancelled, or None if
+        there is no such resting order.
+        """
+        async with self.lock:
+            book_side, order = self._find_order(order_id)
+            if order is None:
+                return None
+            cancelled = order.to_dict(self.ticker, book_side.side, self.from_ticks(order.price))
+            self._reduce_order(book_side, order, order.quantity)
+            self._update_active()
+            self._publish_depth()
+        await self._settle([], [], durable)
+        hot_logger.info("Cancelled order %s for %s", order_id, self.ticker)
+        return cancelled
+
+    async def replace_order(self, order_id: int, price: Optional[float] = None, quantity: Optional[int] = None,
+                            durable: bool = False) -> Optional[Tuple[int, List[Dict]]]:
+        """
+        Changes a resting order's price and/or quantity. Reducing the quantity at the same
+        price happens in place and keeps time priority; anything else cancels the order and
+        adds a new one with a new id, which may trade. Returns (order id, fills), or None
+        if there is no such resting order.
+        """
+        if quantity is not None and quantity <= 0:
+            raise ValueError("Quantity must be positive.")
+        if quantity is not None and quantity > MAX_QUANTITY:
+            raise ValueError(f"Quantity must be at most {MAX_QUANTITY}.")
+        new_price = self.to_ticks(price) if price is not None else None
+        async with self.lock:
+            book_side, order = self._find_order(order_id)
+            if order is None:
+                return None
+            new_price = order.price if new_price is None else new_price
+            new_quantity = order.quantity if quantity is None else quantity
+            if new_price == order.price and new_quantity <= order.quantity:
+                self._reduce_order(book_side, order, order.quantity - new_quantity)
+                new_order_id, matched_orders = order_id, []
+            else:
+                self._reduce_order(book_side, order, order.quantity)
+                replacement = Order.model_construct(ticker=self.ticker, side=book_side.side, quantity=new_quantity,
+                                                    user_id=order.user_id, order_type=OrderType.LIMIT,
+                                                    price=self.from_ticks(new_price), timestamp=time.time())
+                matched_orders = await self._process_order(replacement, new_price)
+                new_order_id = replacement.order_id
+            self._update_active()
+            self._publish_depth()
+            pending_writes, self._pending_writes = self._pending_writes, []
+        await self._settle(matched_orders, pending_writes, durable)
+        hot_logger.info("Replaced order %s for %s with order %s", order_id, self.ticker, new_order_id)
+        return new_order_id, matched_orders
+
+    async def _settle(self, matched_orders: List[Dict], pending_writes: List[asyncio.Future], durable: bool):
+        """
+        Counts the fills of an add or replace and waits for their writes when asked to.
+        """
+        fills_total.inc(len(matched_orders))
+        verify = matched_orders and self._should_verify()
+        if durable and self.journal is not None:
+            await self.journal.sync()
+        if durable or verify:
+            # Wait outside the book lock so other orders keep matching and share the commit
+            trade_ids = await asyncio.gather(*pending_writes)
+            if verify:
+                await self._self_check(matched_orders, trade_ids)
+
+    def _find_order(self, order_id: int) -> Tuple[Optional[BookSide], Optional[RestingOrder]]:
+        for book_side in (self.buy_orders, self.sell_orders):
+            order = book_side.orders.get(order_id)
+            if order is not None:
+                return book_side, order
+        return None, None
+
+    def _reduce_order(self, book_side: BookSide, order: RestingOrder, quantity: int):
+        if quantity <= 0:
+            return
+        book_side.reduce(order.order_id, quantity)
+        if self.journal is not None:
+            self.journal.append_cancel(self.ticker, book_side.side.value, order.order_id, quantity)
+
+    def _should_verify(self) -> bool:
+        if self.verify_mode == VerifyMode.FULL:
+            return True
+        if self.verify_mode == VerifyMode.SAMPLED:
+            return random.random() < self.verify_sample_rate
+        return False
+
+    async def _add_orders_locked(self, orders: List[Order], prices: List[Optional[int]]):
+        waited = time.perf_counter()
+        async with self.lock:
+            lock_wait_seconds.observe(time.perf_counter() - waited)
+            results = []
+            for order, price in zip(orders, prices):
+                hot_logger.info("Adding order: %s", order)
+                results.append(await self._process_order(order, price))
+            self._update_active()
+            # One depth update for the whole batch, carrying the net change of every level
+            self._publish_depth()
+            pending_writes, self._pending_writes = self._pending_writes, []
+            return results, pending_writes
+
+    async def _process_order(self, order: Order, price: Optional[int]) -> List[Dict]:
+        """
+        Assigns the order its id, then matches it or rests it. Caller holds the lock.
+        """
+        self.last_order_id += 1
+        order.order_id = self.last_order_id
+        if order.order_type == OrderType.MARKET:
+            market_orders_total.inc()
+            if self.journal is not None:
+                # A market order never rests, so no ORDER_ACCEPTED record carries its id
+                self.journal.append_order_ids(self.ticker, order.order_id)
+            return await self.match_market_order(order)
+        if order.order_type == OrderType.LIMIT:
+            limit_orders_total.inc()
+            book_side = self.buy_orders if order.side == OrderSide.BUY else self.sell_orders
+            # Encoded before the book changes, so a record that can't be encoded leaves both untouched
+            record = None
+            if self.journal is not None:
+                record = encode_accepted(self.ticker, order.side.value, order.order_id, price, order.quantity,
+                                         order.user_id, order.timestamp)
+            book_side.add(order.order_id, price, order.quantity, order.user_id, order.timestamp)
+            if record is not None:
+                self.journal.append(record)
+            return await self.match_limit_orders()
+        raise ValueError("Invalid order type.")
+
+    def _publish_depth(self):
+        """
+        Emits the price levels changed by the last operation as one sequenced depth update.
+        """
+        bids = self.buy_orders.pop_changes()
+        asks = self.sell_orders.pop_changes()
+        if not bids and not asks:
+            return
+        self.sequence += 1
+        if self.depth_listener is not None:
+            self.depth_listener({
+                'type': 'depth_update',
+                'ticker': self.ticker,
+                'sequence': self.sequence,
+                'bids': self._levels_to_api(bids),
+                'asks': self._levels_to_api(asks)
+            })
+
+    def _levels_to_api(self, levels: List[Tuple[int, int, int]]) -> List[List]:
+        return [[self.from_ticks(price), quantity, count] for price, quantity, count in levels]
+
+    def _cached_snapshot(self, key, build: Callable[[], Dict]) -> Dict:
+        """
+        Returns the snapshot for `key` built at the current version, building it at most
+        once per version. Cached snapshots are shared and must not be mutated.
+        """
+        if self._cache_sequence != self.sequence:
+            self._snapshot_cache.clear()
+            self._cache_sequence = self.sequence
+        snapshot = self._snapshot_cache.get(key)
+        if snapshot is None:
+            snapshot = self._snapshot_cache[key] = build()
+        return snapshot
+
+    def get_depth_snapshot(self, depth: Optional[int] = None) -> Dict:
+        """
+        Price-aggregated (L2) depth, limited to the best `depth` levels per side if given.
+        Updates with a higher sequence apply on top of the full snapshot.
+        """
+        return self._cached_snapshot(('depth', depth), lambda: {
+            'type': 'depth_snapshot',
+            'ticker': self.ticker,
+            'sequence': self.sequence,
+            'bids': self._levels_to_api(self.buy_orders.depth(depth)),
+            'asks': self._levels_to_api(self.sell_orders.depth(depth))
+        })
+
+    def _update_active(self):
+        if self.buy_orders or self.sell_orders:
+            self.active_tickers.add(self.ticker)
+        else:
+            self.active_tickers.discard(self.ticker)
+
+    def _fill_best_order(self, book_side: BookSide, quantity: int):
+        book_side.fill_best_order(quantity)
+        if self.journal is not None:
+            self.journal.append_fill(self.ticker, book_side.side.value, quantity)
+
+    def replay(self, record: Tuple):
+        """
+        Applies a recovered journal record directly to the book, without matching,
+        persisting or journaling it again. Call finish_replay() once all are applied.
+        """
+        if record[0] == ORDER_ACCEPTED:
+            _, _, side, order_id, price, quantity, user_id, timestamp = record
+            book_side = self.buy_orders if side == OrderSide.BUY.value else self.sell_orders
+            book_side.add(order_id, price, quantity, user_id, timestamp)
+            self.last_order_id = max(self.last_order_id, order_id)
+        elif record[0] == FILL:
+            _, _, side, quantity = record
+            book_side = self.buy_orders if side == OrderSide.BUY.value else self.sell_orders
+            book_side.fill_best_order(quantity)
+        elif record[0] == CANCEL:
+            _, _, side, order_id, quantity = record
+            book_side = self.buy_orders if side == OrderSide.BUY.value else self.sell_orders
+            book_side.reduce(order_id, quantity)
+        elif record[0] == ORDER_IDS:
+            self.last_order_id = max(self.last_order_id, record[2])
+
+    def finish_replay(self):
+        # Recovered levels are part of the initial snapshot, not updates
+        self.buy_orders.pop_changes()
+        self.sell_orders.pop_changes()
+        self._update_active()
+
+    def snapshot_records(self) -> Iterator[bytes]:
+        """
+        Yields the journal records that rebuild this book: its last order id, then every
+        resting order in priority order.
+        """
+        yield encode_order_ids(self.ticker, self.last_order_id)
+        for book_side in (self.buy_orders, self.sell_orders):
+            for level in book_side:
+                for order in level:
+                    yield encode_accepted(self.ticker, book_side.side.value, order.order_id, level.price,
+                                          order.quantity, order.user_id, order.timestamp)
+
+    async def match_market_order(self, order: Order):
+        matched_orders = []
+        quantity_to_match = order.quantity
+
+        book_side = self.sell_orders if order.side == OrderSide.BUY else self.buy_orders
+
+        while quantity_to_match > 0 and book_side:
+            best_order = book_side.best_order()
+            matched_quantity = min(quantity_to_match, best_order.quantity)
+            matched_price = self.from_ticks(best_order.price)
+            matched_orders.append({
+                'price': matched_price,
+                'quantity': matched_quantity,
+                'maker_user_id': best_order.user_id,
+                'taker_user_id': order.user_id,
+                'maker_order_id': best_order.order_id,
+                'taker_order_id': order.order_id,
+                'timestamp': time.time()
+            })
+
+            # Persist the matched trade
+            self._persist_cleared_trade(
+                order_type=order.side.value, 
+                price=matched_price, 
+                quantity=matched_quantity, 
+                filler_user_id=order.user_id, 
+                filled_user_id=best_order.user_id
+            )
+
+            hot_logger.info("Matched %s units at %s between %s and %s", matched_quantity, matched_price, order.user_id, best_order.user_id)
+
+            self._fill_best_order(book_side, matched_quantity)
+            quantity_to_match -= matched_quantity
+
+            if best_order.quantity == 0:
+                hot_logger.debug("Removed fully matched order %s", best_order.order_id)
+
+        if quantity_to_match > 0:
+            hot_logger.info("Order partially filled. Unmatched quantity: %s", quantity_to_match)
+
+        return matched_orders
+
+    async def match_limit_orders(self):
+        matched_orders = []
+        while self.buy_orders and self.sell_orders:
+            best_buy = self.buy_orders.best_order()
+            best_sell = self.sell_orders.best_order()
+
+            if best_buy.price >= best_sell.price:
+                matched_quantity = min(best_buy.quantity, best_sell.quantity)
+                matched_price = self.from_ticks(best_sell.price)
+                matched_orders.append({
+                    'price': matched_price,
+                    'quantity': matched_quantity,
+                    'buy_user_id': best_buy.user_id,
+                    'sell_user_id': best_sell.user_id,
+                    'buy_order_id': best_buy.order_id,
+                    'sell_order_id': best_sell.order_id,
+                    'timestamp': time.time()
+                })
+
+                # Persist the matched trade
+                self._persist_cleared_trade(
+                    order_type="buy", 
+                    price=matched_price, 
+                    quantity=matched_quantity, 
+                    filler_user_id=best_buy.user_id, 
+                    filled_user_id=best_sell.user_id
+                )
+
+                hot_logger.info("Matched %s units at %s between %s and %s", matched_quantity, matched_price, best_buy.user_id, best_sell.user_id)
+
+                self._fill_best_order(self.buy_orders, matched_quantity)
+                self._fill_best_order(self.sell_orders, matched_quantity)
+
+                if best_buy.quantity == 0:
+                    hot_logger.debug("Removed fully matched buy order %s", best_buy.order_id)
+                if best_sell.quantity == 0:
+                    hot_logger.debug("Removed fully matched sell order %s", best_sell.order_id)
+            else:
+                break
+        return matched_orders
+
+    async def _self_check(self, matched_orders: List[Dict], trade_ids: List[int]):
+        """
+        Self-checking method to verify that matched orders were persisted correctly.
+        Each fill is looked up by the row id its insert returned, so a check costs one
+        primary-key lookup rather than a scan of the trade history.
+        """
+        persisted = await self.trade_writer.fetch_trades(list(trade_ids))
+        for matched_order, trade_id in zip(matched_orders, trade_ids):
+            # Limit fills carry buy/sell user ids, market fills carry taker/maker ones
+            expected = (
+                self.ticker,
+                matched_order['price'],
+                matched_order['quantity'],
+                matched_order.get('buy_user_id', matched_order.get('taker_user_id')),
+                matched_order.get('sell_user_id', matched_order.get('maker_user_id'))
+            )
+            if persisted.get(trade_id) != expected:
+                logging.error(f"Self-check failed: Matched order not persisted as trade {trade_id}: {matched_order}")
+
+    def get_order_book(self):
+        return self._cached_snapshot('orders', lambda: {
+            'buy': self._side_to_dicts(self.buy_orders),
+            'sell': self._side_to_dicts(self.sell_orders)
+        })
+
+    def _side_to_dicts(self, book_side: BookSide) -> List[Dict]:
+        orders = []
+        for level in book_side:
+            price = self.from_ticks(level.price)
+            orders.extend(order.to_dict(self.ticker, book_side.side, price) for order in level)
+        return orders
+
+# Manager to handle multiple order books
+class OrderBookManager:
+    def __init__(self, db_name: str = 'data.db', trade_batch_size: int = 500, trade_batch_delay: float = 0.002,
+                 verify_mode: VerifyMode = VerifyMode.FULL, verify_sample_rate: float = 0.01,
+                 default_tick_size: float = 0.01, tick_sizes: Optional[Dict[str, float]] = None,
+                 journal_dir: Optional[str] = None, journal_sync_interval: float = 0.002,
+                 checkpoint_every: int = 100_000):
+        self.order_books: Dict[str, OrderBook] = {}
+        self.lock = asyncio.Lock()  # Serializes creation of new order books
+        self.active_tickers: Set[str] = set()  # Tickers with resting orders, maintained by the books
+        self.on_depth_update: Optional[Callable[[Dict], None]] = None  # Receives every book's depth updates
+        self.db_name = db_name
+        self.db_path = self._get_db_path()
+        # One long-lived writer connection shared by every book on this database
+        self.trade_writer = TradeWriter(self.db_path, max_batch_size=trade_batch_size, max_delay=trade_batch_delay)
+        self.verify_mode = VerifyMode(verify_mode)
+        self.verify_sample_rate = verify_sample_rate
+        self.default_tick_size = default_tick_size
+        self.tick_sizes = tick_sizes or {}
+        # Optional write-ahead journal; the books are rebuilt from it by start()
+        self.journal = Journal(journal_dir, journal_sync_interval, checkpoint_every) if journal_dir else None
+        self._checkpoint_task: Optional[asyncio.Task] = None
+        self._start_lock = asyncio.Lock()
+        self._started = False
+
+    def _get_db_path(self) -> str:
+        """
+        Determines the path to the SQLite database.
+        """
+        return resolve_db_path(self.db_name)
+
+    async def start(self):
+        """
+        Starts the trade writer and, with a journal, rebuilds the books from it before any
+        new order is accepted. Called lazily on first use; idempotent.
+        """
+        async with self._start_lock:
+            if self._started:
+                return
+            await self.trade_writer.start()
+            if self.journal is not None:
+                self._recover()
+                await self.journal.open()
+            self._started = True
+
+    def _recover(self):
+        start = time.perf_counter()
+        records = 0
+        for record in self.journal.recover():
+            ticker = record[1]
+            order_book = self.order_books.get(ticker)
+            if order_book is None:
+                order_book = self.order_books[ticker] = self._new_order_book(ticker)
+            order_book.replay(record)
+            records += 1
+        for order_book in self.order_books.values():
+            order_book.finish_replay()
+        logging.info(f"Recovered {len(self.order_books)} order books from {records} journal records "
+                     f"in {time.perf_counter() - start:.3f}s")
+
+    def _new_order_book(self, ticker: str) -> OrderBook:
+        return OrderBook(ticker, self.db_path, self.trade_writer,
+                         verify_mode=self.verify_mode, verify_sample_rate=self.verify_sample_rate,
+                         tick_size=self.tick_sizes.get(ticker, self.default_tick_size),
+                         active_tickers=self.active_tickers,
+                         depth_listener=self._dispatch_depth_update,
+                         journal=self.journal)
+
+    async def initialize_order_book(self, ticker: str) -> OrderBook:
+        if not self._started:
+            await self.start()
+        async with self.lock:
+            order_book = self.order_books.get(ticker)
+            if order_book is None:
+                order_book = self._new_order_book(ticker)
+                await order_book.initialize_db()
+                # Only published once fully initialized, so the lock-free read below is safe
+                self.order_books[ticker] = order_book
+                logging.info(f"Initialized order book for ticker: {ticker}")
+            return order_book
+
+    async def get_order_book(self, ticker: str) -> OrderBook:
+        # Fast path: existing books are a plain dict lookup, the lock is only taken to create one
+        order_book = self.order_books.get(ticker)
+        if order_book is None:
+            order_book = await self.initialize_order_book(ticker)
+        return order_book
+
+    async def add_order(self, order: Order, durable: bool = False):
+        order_book = await self.get_order_book(order.ticker)
+        matched_orders = await order_book.add_order(order, durable=durable)
+        if self.journal is not None:
+            self._maybe_checkpoint()
+        return matched_orders
+
+    async def add_orders(self, orders: List[Order], durable: bool = False) -> List[List[Dict]]:
+        """
+        Adds a batch of orders, returning each one's fills in batch order. Orders are grouped
+        by ticker, keeping their relative order, so each book's lock is taken once.
+        Every price is checked before anything trades, so an invalid order rejects the batch.
+        """
+        by_ticker: Dict[str, List[int]] = {}
+        for index, order in enumerate(orders):
+            by_ticker.setdefault(order.ticker, []).append(index)
+        order_books = {ticker: await self.get_order_book(ticker) for ticker in by_ticker}
+        for order in orders:
+            order_books[order.ticker].price_ticks(order)
+        results: List[List[Dict]] = [[] for _ in orders]
+
+        async def add_to_book(ticker: str, indexes: List[int]):
+            fills = await order_books[ticker].add_orders([orders[index] for index in indexes], durable=durable)
+            for index, matched_orders in zip(indexes, fills):
+                results[index] = matched_orders
+
+        await asyncio.gather(*[add_to_book(ticker, indexes) for ticker, indexes in by_ticker.items()])
+        if self.journal is not None:
+            self._maybe_checkpoint()
+        return results
+
+    async def cancel_order(self, ticker: str, order_id: int, durable: bool = False) -> Optional[Dict]:
+        order_book = await self.get_order_book(ticker)
+        cancelled = await order_book.cancel_order(order_id, durable=durable)
+        if self.journal is not None:
+            self._maybe_checkpoint()
+        return cancelled
+
+    async def replace_order(self, ticker: str, order_id: int, price: Optional[float] = None,
+                            quantity: Optional[int] = None, durable: bool = False) -> Optional[Tuple[int, List[Dict]]]:
+        order_book = await self.get_order_book(ticker)
+        replaced = await order_book.replace_order(order_id, price=price, quantity=quantity, durable=durable)
+        if self.journal is not None:
+            self._maybe_checkpoint()
+        return replaced
+
+    def _maybe_checkpoint(self):
+        if not self.journal.checkpoint_due():
+            return
+        if self._checkpoint_task is None or self._checkpoint_task.done():
+            self._checkpoint_task = asyncio.create_task(self.journal.checkpoint(self._snapshot_records()))
+
+    def _snapshot_records(self) -> Iterator[bytes]:
+        # Lazy on purpose: the journal consumes it at the segment boundary
+        for order_book in list(self.order_books.values()):
+            yield from order_book.snapshot_records()
+
+    async def list_tickers(self):
+        active_tickers = list(self.active_tickers)
+        hot_logger.debug("Listing tickers: %s", active_tickers)
+        return active_tickers
+
+    # Snapshots are read without the book lock: matching never awaits while it mutates a
+    # book, so on the event loop a reader always sees a book between two operations.
+
+    async def get_order_book_snapshot(self, ticker: str):
+        order_book = await self.get_order_book(ticker)
+        snapshot = order_book.get_order_book()
+        hot_logger.debug("Order book snapshot for %s: %s", ticker, snapshot)
+        return snapshot
+
+    async def get_depth_snapshot(self, ticker: str, depth: Optional[int] = None):
+        order_book = await self.get_order_book(ticker)
+        return order_book.get_depth_snapshot(depth)
+
+    def _dispatch_depth_update(self, update: Dict):
+        if self.on_depth_update is not None:
+            self.on_depth_update(update)
+
+    async def close(self):
+        """
+        Flushes outstanding trades and journal records and closes the writer connection.
+        """
+        if self._checkpoint_task is not None:
+            await self._checkpoint_task
+        if self.journal is not None:
+            await self.journal.close()
+        await self.trade_writer.close()
+
+def resolve_db_path(db_name: str) -> str:
+    """
+    Database names are relative to this directory (absolute paths are kept as they are).
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(script_dir, db_name)
+
+def parse_tick_sizes(spec: str) -> Dict[str, float]:
+    """
+    Parses per-ticker tick sizes from a string like "AAPL=0.01,BRK.A=1".
+    """
+    tick_sizes = {}
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        ticker, tick_size = entry.split('=')
+        tick_sizes[ticker.strip()] = float(tick_size)
+    return tick_sizes
+
+def manager_settings_from_env() -> Dict:
+    """
+    OrderBookManager keyword arguments from the TINYTRADER_* environment variables.
+    """
+    return dict(
+        trade_batch_size=int(os.environ.get('TINYTRADER_TRADE_BATCH_SIZE', 500)),
+        trade_batch_delay=float(os.environ.get('TINYTRADER_TRADE_BATCH_DELAY', 0.002)),
+        verify_mode=os.environ.get('TINYTRADER_VERIFY_MODE', VerifyMode.FULL.value),
+        verify_sample_rate=float(os.environ.get('TINYTRADER_VERIFY_SAMPLE_RATE', 0.01)),
+        default_tick_size=float(os.environ.get('TINYTRADER_DEFAULT_TICK_SIZE', 0.01)),
+        tick_sizes=parse_tick_sizes(os.environ.get('TINYTRADER_TICK_SIZES', '')),
+        # Unset keeps the books in memory only
+        journal_dir=os.environ.get('TINYTRADER_JOURNAL_DIR') or None,
+        journal_sync_interval=float(os.environ.get('TINYTRADER_JOURNAL_SYNC_INTERVAL', 0.002)),
+        checkpoint_every=int(os.environ.get('TINYTRADER_CHECKPOINT_EVERY', 100_000)),
+    )
@@ -0,0 +1,148 @@
+import json
+import base64
+import binascii
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+import aiosqlite
+
+# Read side of the trade and order history tables (cleared_trades in server.py, trades
+# and orders in persistence_service.py).
+#
+# Queries filter by ticker, user and time range and page with keyset (cursor)
+# pagination: each page continues strictly after the (time, id) of the previous page's
+# last row, so fetching page N costs the same as page 1. Every filter combination maps to
+# a composite index whose trailing columns are the page order, so a page is an index
+# range scan with no sort. A user matches either of two columns (buyer or seller), which
+# is answered as one indexed branch per column merged with UNION.
+
+MAX_PAGE_SIZE = 1000
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(key: Sequence) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str, size: int) -> List:
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, binascii.Error):
+        raise InvalidCursor(f"Invalid cursor {cursor!r}")
+    if not isinstance(key, list) or len(key) != size:
+        raise InvalidCursor(f"Invalid cursor {cursor!r}")
+    return key
+
+# One queryable table. Rows come back ordered by (time_column, id), or by id alone for
+# tables without a time column.
+class HistoryTable:
+    def __init__(self, table: str, columns: Sequence[str], time_column: Optional[str] = None,
+                 ticker_column: str = 'ticker', user_columns: Sequence[str] = ()):
+        self.table = table
+        self.columns = tuple(columns)
+        self.time_column = time_column
+        self.ticker_column = ticker_column
+        self.user_columns = tuple(user_columns)
+        self.order_columns = (time_column, 'id') if time_column else ('id',)
+
+    def index_statements(self) -> List[str]:
+        """
+        CREATE INDEX statements backing every filter combination. SQLite appends the rowid
+        to each index, so (column, time) indexes are already ordered by (column, time, id).
+        """
+        time = [self.time_column] if self.time_column else []
+        indexed = [(self.ticker_column,)] + [(column,) for column in self.user_columns]
+        if self.time_column:
+            indexed.append(())  # Time range alone
+        statements = []
+        for columns in indexed:
+            columns = list(columns) + time
+            name = f"idx_{self.table}_{'_'.join(columns)}"
+            statements.append(f"CREATE INDEX IF NOT EXISTS {name} ON {self.table} ({', '.join(columns)})")
+        return statements
+
+    def _query(self, ticker: Optional[str], user_id: Optional[str], start: Optional[str], end: Optional[str],
+               after: Optional[List], limit: int) -> Tuple[str, List]:
+        conditions, params = [], []
+        if ticker is not None:
+            conditions.append(f"{self.ticker_column} = ?")
+            params.append(ticker)
+        if start is not None and self.time_column:
+            conditions.append(f"{self.time_column} >= ?")
+            params.append(start)
+        if end is not None and self.time_column:
+            conditions.append(f"{self.time_column} < ?")
+            params.append(end)
+        if after is not None:
+            conditions.append(f"({', '.join(self.order_columns)}) > ({', '.join('?' * len(after))})")
+            params.extend(after)
+        order_by = ', '.join(self.order_columns)
+        select = f"SELECT id, {', '.join(self.columns)} FROM {self.table}"
+        if user_id is None or not self.user_columns:
+            where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+            return f"{select}{where} ORDER BY {order_by} LIMIT ?", params + [limit]
+        # One index range scan per user column, each limited, then merged
+        branches, branch_params = [], []
+        for column in self.user_columns:
+            where = ' AND '.join([f"{column} = ?"] + conditions)
+            branches.append(f"SELECT * FROM ({select} WHERE {where} ORDER BY {order_by} LIMIT ?)")
+            branch_params.extend([user_id] + params + [limit])
+        return f"{' UNION '.join(branches)} ORDER BY {order_by} LIMIT ?", branch_params + [limit]
+
+    def decode_cursor(self, cursor: Optional[str]) -> Optional[List]:
+        """
+        The sort key a cursor continues after; raises InvalidCursor for a malformed one.
+        """
+        return decode_cursor(cursor, len(self.order_columns)) if cursor else None
+
+    def _key(self, row: Dict) -> List:
+        return [row[column] for column in self.order_columns]
+
+    async def page(self, db: aiosqlite.Connection, ticker: Optional[str] = None, user_id: Optional[str] = None,
+                   start: Optional[str] = None, end: Optional[str] = None, cursor: Optional[str] = None,
+                   limit: int = 100) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Returns up to `limit` rows after `cursor` and the cursor for the next page, which
+        is None once there are no more rows.
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        after = self.decode_cursor(cursor)
+        rows = await self._fetch(db, ticker, user_id, start, end, after, limit + 1)
+        if len(rows) > limit:
+            return rows[:limit], encode_cursor(self._key(rows[limit - 1]))
+        return rows, None
+
+    async def stream_ndjson(self, db: aiosqlite.Connection, ticker: Optional[str] = None,
+                            user_id: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None,
+                            cursor: Optional[str] = None, page_size: int = MAX_PAGE_SIZE) -> AsyncIterator[str]:
+        """
+        Yields every matching row after `cursor` as NDJSON, one keyset page at a time, so
+        memory stays flat and no read transaction is held between pages.
+        """
+        after = self.decode_cursor(cursor)
+        while True:
+            rows = await self._fetch(db, ticker, user_id, start, end, after, page_size)
+            if not rows:
+                return
+            yield ''.join(json.dumps(row) + '\n' for row in rows)
+            if len(rows) < page_size:
+                return
+            after = self._key(rows[-1])
+
+    async def _fetch(self, db: aiosqlite.Connection, ticker, user_id, start, end, after, limit) -> List[Dict]:
+        query, params = self._query(ticker, user_id, start, end, after, limit)
+        names = ('id',) + self.columns
+        async with db.execute(query, params) as cursor:
+            return [dict(zip(names, row)) for row in await cursor.fetchall()]
+
+async def open_reader(db_path: str, schema: Sequence[str] = ()) -> aiosqlite.Connection:
+    """
+    Opens a read-only connection for history queries. With WAL it reads alongside the
+    writer connection without blocking it. `schema` (CREATE ... IF NOT EXISTS statements)
+    is run first, so queries work even if no writer has created the tables yet.
+    """
+    db = await aiosqlite.connect(db_path, timeout=30)
+    for statement in schema:
+        await db.execute(statement)
+    await db.commit()
+    await db.execute('PRAGMA query_only=1')
+    return db
@@ -0,0 +1,281 @@
+import os
+import glob
+import zlib
+import struct
+import logging
+import asyncio
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+# Append-only binary event journal for the order books.
+#
+# Every change to a book is appended as a record, and records are fsynced in groups by a
+# background flusher. On startup the books are rebuilt by replaying the latest snapshot
+# and then the journal segments written after it. Layout of the journal directory:
+#
+#   journal-00000003.log    segments, replayed in order
+#   snapshot-00000003.snap  every resting order just before segment 3 started
+#
+# Record framing: <payload length u32><crc32 of type+payload u32><type u8><payload>
+
+ORDER_ACCEPTED = 1  # A limit order was added to the book
+FILL = 2  # The best order on a side was filled by some quantity
+CANCEL = 3  # Quantity was taken off a resting order without trading (all of it for a cancel)
+ORDER_IDS = 4  # The last order id a book assigned: in snapshots and for market orders, so ids are never reused
+
+_HEADER = struct.Struct('<IIB')
+_ACCEPTED = struct.Struct('<Bqqqd')  # side, order id, price ticks, quantity, timestamp; then ticker, user_id
+_FILL = struct.Struct('<Bq')  # side, quantity; then ticker
+_CANCEL = struct.Struct('<Bqq')  # side, order id, quantity; then ticker
+_ORDER_IDS = struct.Struct('<q')  # last order id; then ticker
+_STR_LEN = struct.Struct('<H')
+
+SIDE_CODES = {'buy': 0, 'sell': 1}
+SIDE_NAMES = {code: name for name, code in SIDE_CODES.items()}
+
+def _pack_str(value: str) -> bytes:
+    data = value.encode()
+    return _STR_LEN.pack(len(data)) + data
+
+def _unpack_str(payload: bytes, offset: int) -> Tuple[str, int]:
+    (length,) = _STR_LEN.unpack_from(payload, offset)
+    offset += _STR_LEN.size
+    return payload[offset:offset + length].decode(), offset + length
+
+def _frame(record_type: int, payload: bytes) -> bytes:
+    crc = zlib.crc32(bytes((record_type,)) + payload)
+    return _HEADER.pack(len(payload), crc, record_type) + payload
+
+def encode_accepted(ticker: str, side: str, order_id: int, price: int, quantity: int, user_id: str,
+                    timestamp: float) -> bytes:
+    payload = _ACCEPTED.pack(SIDE_CODES[side], order_id, price, quantity, timestamp) + _pack_str(ticker) + _pack_str(user_id)
+    return _frame(ORDER_ACCEPTED, payload)
+
+def encode_fill(ticker: str, side: str, quantity: int) -> bytes:
+    return _frame(FILL, _FILL.pack(SIDE_CODES[side], quantity) + _pack_str(ticker))
+
+def encode_cancel(ticker: str, side: str, order_id: int, quantity: int) -> bytes:
+    return _frame(CANCEL, _CANCEL.pack(SIDE_CODES[side], order_id, quantity) + _pack_str(ticker))
+
+def encode_order_ids(ticker: str, last_order_id: int) -> bytes:
+    return _frame(ORDER_IDS, _ORDER_IDS.pack(last_order_id) + _pack_str(ticker))
+
+def decode(record_type: int, payload: bytes) -> Tuple:
+    """
+    Decodes a record payload into (type, ticker, side, ...fields).
+    """
+    if record_type == ORDER_ACCEPTED:
+        side, order_id, price, quantity, timestamp = _ACCEPTED.unpack_from(payload)
+        ticker, offset = _unpack_str(payload, _ACCEPTED.size)
+        user_id, _ = _unpack_str(payload, offset)
+        return ORDER_ACCEPTED, ticker, SIDE_NAMES[side], order_id, price, quantity, user_id, timestamp
+    if record_type == FILL:
+        side, quantity = _FILL.unpack_from(payload)
+        ticker, _ = _unpack_str(payload, _FILL.size)
+        return FILL, ticker, SIDE_NAMES[side], quantity
+    if record_type == CANCEL:
+        side, order_id, quantity = _CANCEL.unpack_from(payload)
+        ticker, _ = _unpack_str(payload, _CANCEL.size)
+        return CANCEL, ticker, SIDE_NAMES[side], order_id, quantity
+    if record_type == ORDER_IDS:
+        (last_order_id,) = _ORDER_IDS.unpack_from(payload)
+        ticker, _ = _unpack_str(payload, _ORDER_IDS.size)
+        return ORDER_IDS, ticker, last_order_id
+    raise ValueError(f"Unknown journal record type: {record_type}")
+
+def read_records(path: str) -> Iterator[Tuple]:
+    """
+    Yields decoded records from a segment or snapshot file. Stops at the first torn or
+    corrupt record, which can only be the tail of a write interrupted by a crash.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    offset = 0
+    while offset + _HEADER.size <= len(data):
+        length, crc, record_type = _HEADER.unpack_from(data, offset)
+        start = offset + _HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(bytes((record_type,)) + payload) != crc:
+            logging.warning(f"Ignoring torn journal tail in {path} at offset {offset}")
+            return
+        yield decode(record_type, payload)
+        offset = start + length
+    if offset != len(data):
+        logging.warning(f"Ignoring torn journal tail in {path} at offset {offset}")
+
+def _file_number(path: str) -> int:
+    return int(os.path.basename(path).split('-')[1].split('.')[0])
+
+# Group-commit journal writer
+class Journal:
+    def __init__(self, directory: str, sync_interval: float = 0.002, checkpoint_every: int = 100_000):
+        self.directory = directory
+        self.sync_interval = sync_interval
+        self.checkpoint_every = checkpoint_every
+        self.records_since_checkpoint = 0
+        self._segment = 0
+        self._file = None
+        self._buffer = bytearray()
+        self._waiters: List[asyncio.Future] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._io_lock: Optional[asyncio.Lock] = None
+        self._closing = False
+
+    def _path(self, prefix: str, number: int, suffix: str) -> str:
+        return os.path.join(self.directory, f"{prefix}-{number:08d}.{suffix}")
+
+    def _segments(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.directory, 'journal-*.log')), key=_file_number)
+
+    def _snapshots(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.directory, 'snapshot-*.snap')), key=_file_number)
+
+    def recover(self) -> Iterator[Tuple]:
+        """
+        Yields every record needed to rebuild the books: the latest snapshot, then each
+        segment written since. Call before open().
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        snapshots = self._snapshots()
+        first_segment = 0
+        if snapshots:
+            first_segment = _file_number(snapshots[-1])
+            yield from read_records(snapshots[-1])
+        for path in self._segments():
+            if _file_number(path) >= first_segment:
+                yield from read_records(path)
+
+    async def open(self):
+        """
+        Starts a fresh segment after the existing ones and the background flusher.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        numbers = [_file_number(path) for path in self._segments() + self._snapshots()]
+        self._segment = max(numbers, default=0) + 1
+        self._file = open(self._path('journal', self._segment, 'log'), 'ab')
+        self._wakeup = asyncio.Event()
+        self._io_lock = asyncio.Lock()
+        self._flusher = asyncio.create_task(self._run())
+        logging.info(f"Journal opened at segment {self._segment} in {self.directory}")
+
+    def append(self, record: bytes):
+        """
+        Buffers an encoded record. Never blocks; the flusher writes and fsyncs it shortly.
+        """
+        self._buffer += record
+        self.records_since_checkpoint += 1
+        self._wakeup.set()
+
+    def append_accepted(self, ticker: str, side: str, order_id: int, price: int, quantity: int, user_id: str,
+                        timestamp: float):
+        self.append(encode_accepted(ticker, side, order_id, price, quantity, user_id, timestamp))
+
+    def append_fill(self, ticker: str, side: str, quantity: int):
+        self.append(encode_fill(ticker, side, quantity))
+
+    def append_cancel(self, ticker: str, side: str, order_id: int, quantity: int):
+        self.append(encode_cancel(ticker, side, order_id, quantity))
+
+    def append_order_ids(self, ticker: str, last_order_id: int):
+        self.append(encode_order_ids(ticker, last_order_id))
+
+    def checkpoint_due(self) -> bool:
+        return self.records_since_checkpoint >= self.checkpoint_every
+
+    async def sync(self):
+        """
+        Waits until every record appended so far is on disk.
+        """
+        if not self._buffer:
+            # Nothing buffered; a flush still in flight holds the lock until it is fsynced
+            async with self._io_lock:
+                return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self._wakeup.set()
+        await future
+
+    async def _run(self):
+        while not self._closing:
+            await self._wakeup.wait()
+            # Let more records accumulate so one fsync covers all of them
+            await asyncio.sleep(self.sync_interval)
+            self._wakeup.clear()
+            await self._flush()
+
+    async def _flush(self):
+        async with self._io_lock:
+            data, self._buffer = bytes(self._buffer), bytearray()
+            waiters, self._waiters = self._waiters, []
+            try:
+                if data:
+                    await asyncio.get_running_loop().run_in_executor(None, self._write, self._file, data)
+            except Exception as e:
+                logging.error(f"Failed to write {len(data)} journal bytes: {e}")
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+                return
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    @staticmethod
+    def _write(file, data: bytes):
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+
+    async def checkpoint(self, snapshot_records: Iterable[bytes]):
+        """
+        Rotates to a new segment and writes a snapshot of the books as of the rotation, then
+        deletes the segments and snapshots it supersedes.
+
+        `snapshot_records` yields encoded records that rebuild the books: each book's
+        ORDER_IDS and its resting orders in priority order. It is consumed at the rotation, so
+        pass a generator over the live books: it then sees them exactly at the segment boundary.
+        """
+        loop = asyncio.get_running_loop()
+        async with self._io_lock:
+            # No awaits until the rotation is done, so the snapshot and the segment
+            # boundary describe the same instant
+            records = b''.join(snapshot_records)
+            old_data, self._buffer = bytes(self._buffer), bytearray()
+            waiters, self._waiters = self._waiters, []
+            old_file = self._file
+            self._segment += 1
+            self._file = open(self._path('journal', self._segment, 'log'), 'ab')
+            self.records_since_checkpoint = 0
+            snapshot_number = self._segment
+            await loop.run_in_executor(None, self._write, old_file, old_data)
+            old_file.close()
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+        await loop.run_in_executor(None, self._write_snapshot, snapshot_number, records)
+        logging.info(f"Journal checkpoint written at segment {snapshot_number}")
+
+    def _write_snapshot(self, number: int, records: bytes):
+        path = self._path('snapshot', number, 'snap')
+        with open(path + '.tmp', 'wb') as f:
+            self._write(f, records)
+        os.replace(path + '.tmp', path)
+        # The snapshot now covers everything before this segment
+        for old in self._segments() + self._snapshots():
+            if _file_number(old) < number:
+                os.remove(old)
+
+    async def close(self):
+        """
+        Stops the flusher once it has written what is buffered, so a flush is never cut
+        off halfway, then writes anything appended meanwhile and resolves its waiters.
+        """
+        if self._flusher is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        await self._flusher
+        self._flusher = None
+        await self._flush()
+        self._file.close()
+        logging.info(f"Journal closed at segment {self._segment}")
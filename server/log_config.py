@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import logging.handlers
+from typing import Dict, List, Optional
+
+# Logging setup for server.py and its matching shards.
+#
+# Records are handed to a QueueHandler and written by a QueueListener thread, so a slow
+# terminal or pipe never blocks the event loop. Per-order and per-fill messages go
+# through `hot_logger`, which rate limits each message template before a LogRecord is
+# even built, so logging can't set the engine's throughput ceiling.
+#
+# Settings come from the environment:
+#   TINYTRADER_LOG_LEVEL     root level (default INFO)
+#   TINYTRADER_LOG_FORMAT    'text' or 'json', one JSON object per line (default text)
+#   TINYTRADER_LOG_QUEUE     0 writes from the calling thread instead (default 1)
+#   TINYTRADER_HOT_LOG_RATE  per-order/per-fill messages per second, per template; 0 for
+#                            no limit (default 100)
+
+TEXT_FORMAT = '%(asctime)s [%(levelname)s] %(message)s'
+
+# LogRecord attributes that aren't `extra` fields
+_RECORD_ATTRIBUTES = frozenset(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+# One JSON object per record, with any `extra` fields as top-level keys
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+# Wraps a logger for messages logged per order or per fill. Each message template gets a
+# token bucket of `rate` messages per second; messages over the limit are dropped before
+# any formatting, and the next one let through reports how many were dropped.
+class RateLimitedLogger:
+    def __init__(self, logger: logging.Logger, rate: float):
+        self.logger = logger
+        self.rate = rate
+        self._buckets: Dict[str, List[float]] = {}  # template -> [tokens, last refill, suppressed]
+
+    def debug(self, msg: str, *args):
+        self._log(logging.DEBUG, msg, args)
+
+    def info(self, msg: str, *args):
+        self._log(logging.INFO, msg, args)
+
+    def warning(self, msg: str, *args):
+        self._log(logging.WARNING, msg, args)
+
+    def _log(self, level: int, msg: str, args: tuple):
+        if not self.logger.isEnabledFor(level):
+            return
+        if self.rate > 0:
+            now = time.monotonic()
+            bucket = self._buckets.get(msg)
+            if bucket is None:
+                bucket = self._buckets[msg] = [self.rate, now, 0]
+            else:
+                bucket[0] = min(self.rate, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return
+            bucket[0] -= 1
+            if bucket[2]:
+                msg, args = msg + ' (%d similar messages suppressed)', args + (int(bucket[2]),)
+                bucket[2] = 0
+        self.logger.log(level, msg, *args)
+
+def configure_logging(level: Optional[str] = None, log_format: Optional[str] = None,
+                      use_queue: Optional[bool] = None):
+    """
+    Replaces the root logger's handlers with a stderr handler, behind a queue unless
+    disabled. Arguments override the environment settings.
+    """
+    global _listener
+    level = level or os.environ.get('TINYTRADER_LOG_LEVEL', 'INFO')
+    log_format = log_format or os.environ.get('TINYTRADER_LOG_FORMAT', 'text')
+    if use_queue is None:
+        use_queue = os.environ.get('TINYTRADER_LOG_QUEUE', '1') != '0'
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    root.setLevel(level.upper())
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if use_queue:
+        records: queue.SimpleQueue = queue.SimpleQueue()
+        root.addHandler(logging.handlers.QueueHandler(records))
+        _listener = logging.handlers.QueueListener(records, stream_handler, respect_handler_level=True)
+        _listener.start()
+    else:
+        root.addHandler(stream_handler)
+
+    hot_logger.rate = float(os.environ.get('TINYTRADER_HOT_LOG_RATE', 100))
+
+def stop_logging():
+    """
+    Flushes queued records and stops the listener thread.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(stop_logging)
+
+# Per-order and per-fill messages
+hot_logger = RateLimitedLogger(logging.getLogger('tinytrader.orders'), rate=100)
@@ -1,47 +1,60 @@
-import pika
-import json
+import os
+import asyncio
 import logging
-from fastapi import FastAPI, HTTPException
+from typing import Dict, List
+
+from fastapi import FastAPI
+from pydantic import ValidationError
+
+from engine import OrderBookManager, parse_order, manager_settings_from_env
+from transport import create_transport
 
 app = FastAPI()
 
 # Setup basic logging
 logging.basicConfig(level=logging.INFO)
 
-# Function to get RabbitMQ connection
-def get_rabbitmq_connection():
-    try:
-        connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
-        channel = connection.channel()
-        channel.queue_declare(queue='matching_engine', durable=True)
-        return connection, channel
-    except pika.exceptions.AMQPConnectionError as e:
-        logging.error(f"Failed to connect to RabbitMQ: {e}")
-        raise HTTPException(status_code=500, detail="Could not connect to message broker")
+# Backend picked by TINYTRADER_TRANSPORT, see transport.py
+transport = create_transport()
+
+# The same engine server.py runs, configured from the same TINYTRADER_* variables
+order_book_manager = OrderBookManager(**manager_settings_from_env())
+
+# Orders delivered ahead of matching, and the most matched per batch (and per ack)
+PREFETCH = int(os.environ.get('TINYTRADER_MATCH_PREFETCH', 1000))
+MAX_BATCH = int(os.environ.get('TINYTRADER_MATCH_BATCH', 500))
 
 # Function to process orders for matching
-def match_order(ch, method, properties, body):
-    order = json.loads(body)
-    print(f" [x] Matching order: {order}")
-    # Add logic to match orders here
-    # If matched, send trade execution message
-    ch.basic_ack(delivery_tag=method.delivery_tag)
-
-# Start the matching engine service
-def start_matching_engine_service():
-    try:
-        connection, channel = get_rabbitmq_connection()
-        channel.basic_consume(queue='matching_engine', on_message_callback=match_order)
-        print(' [*] Waiting to match orders. To exit press CTRL+C')
-        channel.start_consuming()
-    except Exception as e:
-        logging.error(f"Error in matching engine service: {e}")
-    finally:
+async def match_orders(messages: List[Dict]):
+    """
+    Matches a batch of orders from the matching_engine queue and sends every fill to
+    trade_execution. Orders go to add_orders together, so each book's lock is taken once
+    per batch. Invalid orders are logged and skipped instead of rejecting the batch.
+    """
+    orders = []
+    for message in messages:
         try:
-            channel.close()
-            connection.close()
-        except Exception as close_err:
-            logging.error(f"Error closing RabbitMQ connection: {close_err}")
+            order = parse_order(message)
+            order_book = await order_book_manager.get_order_book(order.ticker)
+            order_book.price_ticks(order)  # Rejects prices off the tick size before anything trades
+        except (ValidationError, ValueError, TypeError) as e:
+            logging.error(f"Rejected order {message}: {e}")
+            continue
+        orders.append(order)
+    if not orders:
+        return
+    results = await order_book_manager.add_orders(orders)
+    trades = [dict(fill, ticker=order.ticker) for order, fills in zip(orders, results) for fill in fills]
+    # Published together so they share publisher batches and confirms; the orders are only
+    # acknowledged once their fills have been handed on
+    await asyncio.gather(*[transport.publish('trade_execution', trade) for trade in trades])
+
+@app.on_event("startup")
+async def startup_event():
+    await order_book_manager.start()
+    await transport.start()
+    await transport.consume_batches('matching_engine', match_orders, prefetch=PREFETCH, max_batch=MAX_BATCH)
+    logging.info("Waiting to match orders")
 
 @app.get("/")
 def read_root():
@@ -51,7 +64,9 @@ def read_root():
 @app.on_event("shutdown")
 async def shutdown_event():
     logging.info("Shutting down Matching Engine Service...")
-    # Add any necessary cleanup logic here
+    await transport.close()
+    await order_book_manager.close()
 
 if __name__ == "__main__":
-    start_matching_engine_service()
\ No newline at end of file
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=8002)
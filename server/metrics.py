@@ -0,0 +1,201 @@
+import math
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# In-process metrics in the Prometheus text exposition format, for the /metrics route.
+#
+# Everything is updated from the event loop thread, so metrics are plain attributes with
+# no locking. Labelled metrics hand out one child per label set; resolve the children
+# once (e.g. per command) and keep them, so the hot path is a single attribute update.
+#
+# Histograms use HDR-style log-linear buckets over integer microseconds: 8 sub-buckets
+# per power of two (~12% worst-case relative error), and a value's bucket comes from its
+# bit length, so recording is O(1) at any range. The exposition reports the
+# power-of-two boundaries, which line up with sub-bucket edges, so they are exact.
+# Values past the last finite bucket are only counted under le="+Inf" (and in
+# count and sum), never folded into a finite bucket.
+
+SUB_BUCKET_BITS = 3
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+MAX_OCTAVE = 28  # The last octave is [2**30, 2**31) us; finite buckets end at ~36 minutes
+BUCKET_COUNT = (MAX_OCTAVE + 1) * SUB_BUCKETS
+
+LabelValues = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def bucket_index(micros: int) -> int:
+    """
+    Index of the log-linear bucket holding `micros`: values below SUB_BUCKETS get a
+    bucket each, then every power of two is split into SUB_BUCKETS equal parts.
+    Values past the last finite bucket give BUCKET_COUNT or more.
+    """
+    if micros < SUB_BUCKETS:
+        return max(micros, 0)
+    shift = micros.bit_length() - SUB_BUCKET_BITS - 1
+    return (shift << SUB_BUCKET_BITS) + (micros >> shift)
+
+def bucket_upper_bound(index: int) -> int:
+    """
+    Exclusive upper bound, in microseconds, of bucket `index`.
+    """
+    if index < SUB_BUCKETS:
+        return index + 1
+    shift = (index >> SUB_BUCKET_BITS) - 1
+    return ((index & (SUB_BUCKETS - 1)) + SUB_BUCKETS + 1) << shift
+
+class Counter:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+    def samples(self, name: str) -> Iterable[Tuple[str, str, float]]:
+        yield f'{name}_total', '', self.value
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'sum')
+
+    def __init__(self):
+        self.counts = [0] * BUCKET_COUNT
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        # bucket_index, inlined: this runs several times per order
+        micros = int(seconds * 1e6)
+        if micros < SUB_BUCKETS:
+            index = micros if micros > 0 else 0
+        else:
+            shift = micros.bit_length() - SUB_BUCKET_BITS - 1
+            index = (shift << SUB_BUCKET_BITS) + (micros >> shift)
+        if index < BUCKET_COUNT:
+            self.counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def percentile(self, fraction: float) -> float:
+        """
+        Upper bound, in seconds, of the bucket holding the given fraction of observations;
+        infinite if that falls past the last finite bucket.
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(fraction * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return bucket_upper_bound(index) / 1e6
+        return math.inf
+
+    def samples(self, name: str) -> Iterable[Tuple[str, str, float]]:
+        cumulative = 0
+        for octave in range(MAX_OCTAVE + 1):
+            # Buckets [octave * SUB_BUCKETS, (octave + 1) * SUB_BUCKETS) end at 2**(octave + SUB_BUCKET_BITS) us
+            start = octave * SUB_BUCKETS
+            cumulative += sum(self.counts[start:start + SUB_BUCKETS])
+            bound = (1 << (octave + SUB_BUCKET_BITS)) / 1e6
+            yield f'{name}_bucket', f'le="{bound:g}"', cumulative
+        yield f'{name}_bucket', 'le="+Inf"', self.count
+        yield f'{name}_sum', '', self.sum
+        yield f'{name}_count', '', self.count
+
+# A metric family: one child per label set, or a single unlabelled child
+class Metric:
+    def __init__(self, kind: str, name: str, documentation: str, labelnames: Tuple[str, ...], factory: Callable):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._factory = factory
+        self._children: Dict[LabelValues, object] = {}
+        if not labelnames:
+            # Unlabelled metrics are used directly: inc/observe are the child's own methods
+            child = self._children[()] = factory()
+            for method in ('inc', 'observe'):
+                if hasattr(child, method):
+                    setattr(self, method, getattr(child, method))
+
+    def labels(self, *values: str):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}")
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._factory()
+        return child
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for values, child in self._children.items():
+            for sample_name, extra, value in child.samples(self.name):
+                lines.append(f'{sample_name}{_format_labels(self.labelnames, values, extra)} {_format_value(value)}')
+        return lines
+
+# A gauge read at scrape time: the function returns {label values: value}
+class GaugeFunction:
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...],
+                 function: Callable[[], Dict[LabelValues, float]]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.function = function
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} gauge']
+        for values, value in self.function().items():
+            lines.append(f'{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}')
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Metric:
+        return self._register(Metric('counter', name, documentation, labelnames, Counter))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Metric:
+        return self._register(Metric('histogram', name, documentation, labelnames, Histogram))
+
+    def gauge(self, name: str, documentation: str, function: Callable[[], Dict[LabelValues, float]],
+              labelnames: Tuple[str, ...] = ()) -> GaugeFunction:
+        return self._register(GaugeFunction(name, documentation, labelnames, function))
+
+    def get(self, name: str) -> Optional[object]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # A failing gauge function shouldn't take the whole scrape down
+                lines.append(f'# {metric.name} unavailable: {e}')
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
@@ -1,6 +1,10 @@
 import os
-import subprocess
+import sys
 import time
+import argparse
+import asyncio
+import importlib
+import subprocess
 
 # Define the virtual environment's Python executable
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -17,29 +21,65 @@ services = [
     {"name": "Persistence Service", "script": "persistence_service.py", "port": 8005},
 ]
 
-processes = []
+def run_processes():
+    processes = []
+    try:
+        for service in services:
+            service_name = service['name']
+            script_path = os.path.join(current_dir, service['script'])
+            port = service['port']
 
-try:
-    for service in services:
-        service_name = service['name']
-        script_path = os.path.join(current_dir, service['script'])
-        port = service['port']
+            command = f"{venv_python} {script_path}"
+            print(f"Starting {service_name} on port {port} with command: {command}...")
+
+            proc = subprocess.Popen([venv_python, script_path])
+            processes.append(proc)
+
+            # Give each service a moment to start up to avoid race conditions
+            time.sleep(1)
 
-        command = f"{venv_python} {script_path}"
-        print(f"Starting {service_name} on port {port} with command: {command}...")
+        # Wait for all processes to complete (infinite wait to keep the orchestrator running)
+        for proc in processes:
+            proc.wait()
 
-        proc = subprocess.Popen([venv_python, script_path])
-        processes.append(proc)
-        
-        # Give each service a moment to start up to avoid race conditions
-        time.sleep(1)
+    except KeyboardInterrupt:
+        print("Shutting down services...")
+        for proc in processes:
+            proc.terminate()
+            proc.wait()
 
-    # Wait for all processes to complete (infinite wait to keep the orchestrator running)
-    for proc in processes:
-        proc.wait()
+async def run_single_process(host: str):
+    """
+    Imports every service into this interpreter and serves each app on its usual port
+    from one event loop, with the services talking over the local transport.
+    """
+    import uvicorn
 
-except KeyboardInterrupt:
+    # Must be set before the service modules create their transports
+    os.environ['TINYTRADER_TRANSPORT'] = 'local'
+    sys.path.insert(0, current_dir)
+    servers = []
+    for service in services:
+        module = importlib.import_module(os.path.splitext(service['script'])[0])
+        print(f"Starting {service['name']} on port {service['port']} in-process...")
+        servers.append(uvicorn.Server(uvicorn.Config(module.app, host=host, port=service['port'])))
+
+    tasks = [asyncio.create_task(server.serve()) for server in servers]
+    # Ctrl+C reaches one of the servers; once any stops, stop them all
+    await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
     print("Shutting down services...")
-    for proc in processes:
-        proc.terminate()
-        proc.wait()
\ No newline at end of file
+    for server in servers:
+        server.should_exit = True
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Start the tinytrader microservices")
+    parser.add_argument('--single-process', action='store_true',
+                        help="run every service in this process over in-memory queues instead of RabbitMQ")
+    parser.add_argument('--host', default='127.0.0.1', help="interface for --single-process (default 127.0.0.1)")
+    args = parser.parse_args()
+
+    if args.single_process:
+        asyncio.run(run_single_process(args.host))
+    else:
+        run_processes()
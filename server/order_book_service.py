@@ -1,35 +1,40 @@
 # order_book_service.py
 
-import pika
-import json
+import logging
+from fastapi import FastAPI
 
-# Function to get RabbitMQ connection
-def get_rabbitmq_connection():
-    connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
-    channel = connection.channel()
-    channel.queue_declare(queue='order_book', durable=True)
-    return channel
+from transport import create_transport
+
+app = FastAPI()
+
+# Setup basic logging
+logging.basicConfig(level=logging.INFO)
+
+# Backend picked by TINYTRADER_TRANSPORT, see transport.py
+transport = create_transport()
 
 # Function to process incoming orders
-def process_order(ch, method, properties, body):
-    order = json.loads(body)
-    print(f" [x] Received order: {order}")
+async def process_order(order: dict):
+    logging.debug("Received order: %s", order)
     # Here, add logic to update the order book
     # This could involve adding orders to an in-memory data structure
-    ch.basic_ack(delivery_tag=method.delivery_tag)
 
-# Start consuming from the RabbitMQ queue
-def start_order_book_service():
-    channel = get_rabbitmq_connection()
-    channel.basic_consume(queue='order_book', on_message_callback=process_order)
-    print(' [*] Waiting for orders. To exit press CTRL+C')
-    channel.start_consuming()
+@app.on_event("startup")
+async def startup_event():
+    await transport.start()
+    await transport.consume('order_book', process_order)
+    logging.info("Waiting for orders")
 
 @app.get("/")
 def read_root():
     return {"message": "Hello from Order Book Engine Service"}
 
-
+# Graceful shutdown to handle cleanup
+@app.on_event("shutdown")
+async def shutdown_event():
+    logging.info("Shutting down Order Book Engine Service...")
+    await transport.close()
 
 if __name__ == "__main__":
-    start_order_book_service()
\ No newline at end of file
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=8001)
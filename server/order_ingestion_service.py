@@ -1,10 +1,10 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Body
-from pydantic import BaseModel, Field, ValidationError
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel, Field
 from enum import Enum
-import pika
-import json
 import logging
 
+from transport import create_transport, TransportError
+
 app = FastAPI()
 
 # Setup basic logging
@@ -28,45 +28,25 @@ class Order(BaseModel):
     order_type: OrderType = Field(..., example="limit")
     price: float = Field(None, example=150.0, gt=0)  # Only required for limit orders
 
-# Function to get a connection to RabbitMQ
-def get_rabbitmq_connection():
-    try:
-        connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
-        channel = connection.channel()
-        channel.exchange_declare(exchange='orders', exchange_type='direct')
-        return connection, channel
-    except pika.exceptions.AMQPConnectionError as e:
-        logging.error(f"Failed to connect to RabbitMQ: {e}")
-        raise HTTPException(status_code=500, detail="Could not connect to message broker")
+# One long-lived transport per process instead of a broker connection per request.
+# The backend is picked by TINYTRADER_TRANSPORT, see transport.py
+transport = create_transport()
 
-# Function to publish order to RabbitMQ
-def publish_order(connection, channel, order):
-    try:
-        channel.basic_publish(
-            exchange='orders',
-            routing_key='new_order',
-            body=json.dumps(order.dict()),
-            properties=pika.BasicProperties(
-                delivery_mode=2,  # make message persistent
-            ))
-        logging.info(f" [x] Sent {order.dict()}")
-    except Exception as e:
-        logging.error(f"Failed to publish order: {e}")
-    finally:
-        channel.close()
-        connection.close()
+@app.on_event("startup")
+async def startup_event():
+    await transport.start()
 
 # API endpoint to submit orders
 @app.post("/submit-order/")
-async def submit_order(order: Order, background_tasks: BackgroundTasks):
+async def submit_order(order: Order):
     try:
-        connection, channel = get_rabbitmq_connection()
-        background_tasks.add_task(publish_order, connection, channel, order)
-        return {"status": "Order submitted"}
-    except ValidationError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        # Returns once the transport has taken the order (with AMQP, once the broker has confirmed it)
+        await transport.publish('matching_engine', order.model_dump(mode='json'))
+    except TransportError as e:
+        logging.error(f"Failed to publish order: {e}")
+        raise HTTPException(status_code=503, detail="Could not publish order to message broker")
+    logging.debug("Sent %s", order)
+    return {"status": "Order submitted"}
 
 # Root endpoint for health check
 @app.get("/")
@@ -77,7 +57,7 @@ def read_root():
 @app.on_event("shutdown")
 async def shutdown_event():
     logging.info("Shutting down service...")
-    # Here you could close other resources if necessary
+    await transport.close()
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,80 +1,116 @@
+import os
 import sqlite3
 import logging
+from typing import Dict, List, Optional, Tuple
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+
+from batch_writer import BatchWriter
+from history import HistoryTable, InvalidCursor, open_reader
 
 app = FastAPI()
 
 # Setup basic logging
 logging.basicConfig(level=logging.INFO)
 
-# Function to initialize the database
-def init_db():
-    try:
-        conn = sqlite3.connect('trading_system.db')
-        c = conn.cursor()
-        # Create tables
-        c.execute('''CREATE TABLE IF NOT EXISTS orders (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                        ticker TEXT, 
-                        user_id TEXT, 
-                        price REAL, 
-                        quantity INTEGER, 
-                        side TEXT, 
+DB_PATH = os.environ.get('TINYTRADER_PERSISTENCE_DB', 'trading_system.db')
+
+CREATE_ORDERS = '''CREATE TABLE IF NOT EXISTS orders (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        ticker TEXT,
+                        user_id TEXT,
+                        price REAL,
+                        quantity INTEGER,
+                        side TEXT,
                         status TEXT
-                    )''')
-        c.execute('''CREATE TABLE IF NOT EXISTS trades (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                        ticker TEXT, 
-                        buyer_id TEXT, 
-                        seller_id TEXT, 
-                        price REAL, 
-                        quantity INTEGER, 
+                    )'''
+
+CREATE_TRADES = '''CREATE TABLE IF NOT EXISTS trades (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        ticker TEXT,
+                        buyer_id TEXT,
+                        seller_id TEXT,
+                        price REAL,
+                        quantity INTEGER,
                         timestamp TEXT
-                    )''')
-        conn.commit()
-        logging.info("Database initialized successfully.")
-    except sqlite3.Error as e:
-        logging.error(f"Error initializing database: {e}")
-        raise HTTPException(status_code=500, detail="Database initialization failed.")
-    finally:
-        conn.close()
+                    )'''
+
+INSERT_ORDER = '''INSERT INTO orders (ticker, user_id, price, quantity, side, status)
+                  VALUES (?, ?, ?, ?, ?, ?)'''
 
-# Function to save an order to the database
-def save_order(order):
+INSERT_TRADE = '''INSERT INTO trades (ticker, buyer_id, seller_id, price, quantity, timestamp)
+                  VALUES (?, ?, ?, ?, ?, ?)'''
+
+# Queryable views of the tables; their indexes are created with the schema
+TRADES = HistoryTable('trades', ('ticker', 'buyer_id', 'seller_id', 'price', 'quantity', 'timestamp'),
+                      time_column='timestamp', user_columns=('buyer_id', 'seller_id'))
+ORDERS = HistoryTable('orders', ('ticker', 'user_id', 'price', 'quantity', 'side', 'status'),
+                      user_columns=('user_id',))
+
+# One dedicated writer connection for the whole service. Concurrent saves share group
+# commits instead of each opening a connection and committing on its own.
+writer = BatchWriter(
+    DB_PATH,
+    schema=(CREATE_ORDERS, CREATE_TRADES, *TRADES.index_statements(), *ORDERS.index_statements()),
+    max_batch_size=int(os.environ.get('TINYTRADER_PERSISTENCE_BATCH_SIZE', 5000)),
+    max_delay=float(os.environ.get('TINYTRADER_PERSISTENCE_BATCH_DELAY', 0.005)),
+)
+
+def order_row(order: Dict) -> Tuple:
+    return (order['ticker'], order['user_id'], order['price'], order['quantity'], order['side'], 'open')
+
+def trade_row(trade: Dict) -> Tuple:
+    return (trade['ticker'], trade['buyer_id'], trade['seller_id'], trade['price'], trade['quantity'], trade['timestamp'])
+
+def build_rows(kind: str, build, items: List[Dict]) -> List[Tuple]:
     try:
-        conn = sqlite3.connect('trading_system.db')
-        c = conn.cursor()
-        c.execute('''INSERT INTO orders (ticker, user_id, price, quantity, side, status) 
-                     VALUES (?, ?, ?, ?, ?, ?)''', 
-                  (order['ticker'], order['user_id'], order['price'], order['quantity'], order['side'], 'open'))
-        conn.commit()
-        logging.info(f"Order saved: {order}")
-    except sqlite3.Error as e:
-        logging.error(f"Error saving order: {e}")
-        raise HTTPException(status_code=500, detail="Failed to save order.")
-    finally:
-        conn.close()
+        return [build(item) for item in items]
+    except (KeyError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid {kind}: missing or malformed field {e}")
 
-# Function to save a trade to the database
-def save_trade(trade):
+async def save_rows(kind: str, statement: str, rows: List[Tuple]):
+    """
+    Writes rows through the group-commit writer and returns once they are committed.
+    """
     try:
-        conn = sqlite3.connect('trading_system.db')
-        c = conn.cursor()
-        c.execute('''INSERT INTO trades (ticker, buyer_id, seller_id, price, quantity, timestamp) 
-                     VALUES (?, ?, ?, ?, ?, ?)''', 
-                  (trade['ticker'], trade['buyer_id'], trade['seller_id'], trade['price'], trade['quantity'], trade['timestamp']))
-        conn.commit()
-        logging.info(f"Trade saved: {trade}")
+        await writer.write(statement, rows)
     except sqlite3.Error as e:
-        logging.error(f"Error saving trade: {e}")
-        raise HTTPException(status_code=500, detail="Failed to save trade.")
-    finally:
-        conn.close()
+        logging.error(f"Error saving {len(rows)} {kind}s: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to save {kind}.")
+    logging.debug("Saved %d %ss", len(rows), kind)
 
-# Initialize the database on startup
+# Separate read-only connection for the query endpoints, so reads never queue behind writes
+reader = None
+
+# Start the writer (and create the tables and indexes) on startup
 @app.on_event("startup")
-def on_startup():
-    init_db()
+async def on_startup():
+    global reader
+    await writer.start()
+    reader = await open_reader(DB_PATH)
+    logging.info("Database initialized successfully.")
+
+# Commit anything still queued before exiting
+@app.on_event("shutdown")
+async def on_shutdown():
+    await writer.close()
+    if reader is not None:
+        await reader.close()
+
+async def query_page(table: HistoryTable, key: str, limit: int, cursor: Optional[str], **filters) -> Dict:
+    try:
+        rows, next_cursor = await table.page(reader, cursor=cursor, limit=limit, **filters)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {key: rows, "next_cursor": next_cursor}
+
+def query_stream(table: HistoryTable, cursor: Optional[str], **filters) -> StreamingResponse:
+    try:
+        # Checked up front: once streaming has started the status can't change
+        table.decode_cursor(cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(table.stream_ndjson(reader, cursor=cursor, **filters), media_type="application/x-ndjson")
 
 # Root endpoint for health check
 @app.get("/")
@@ -83,16 +119,49 @@ def read_root():
 
 # Example endpoint to save an order (for testing purposes)
 @app.post("/save-order/")
-def api_save_order(order: dict):
-    save_order(order)
+async def api_save_order(order: dict):
+    await save_rows('order', INSERT_ORDER, build_rows('order', order_row, [order]))
     return {"status": "Order saved successfully"}
 
 # Example endpoint to save a trade (for testing purposes)
 @app.post("/save-trade/")
-def api_save_trade(trade: dict):
-    save_trade(trade)
+async def api_save_trade(trade: dict):
+    await save_rows('trade', INSERT_TRADE, build_rows('trade', trade_row, [trade]))
     return {"status": "Trade saved successfully"}
 
+# Bulk endpoints: a list of orders or trades, inserted with one executemany and committed together
+@app.post("/save-orders/")
+async def api_save_orders(orders: List[dict]):
+    await save_rows('order', INSERT_ORDER, build_rows('order', order_row, orders))
+    return {"status": "Orders saved successfully", "saved": len(orders)}
+
+@app.post("/save-trades/")
+async def api_save_trades(trades: List[dict]):
+    await save_rows('trade', INSERT_TRADE, build_rows('trade', trade_row, trades))
+    return {"status": "Trades saved successfully", "saved": len(trades)}
+
+# Trade history by ticker, by user (as buyer or seller) and/or by time range [start, end),
+# oldest first. Pass next_cursor back as cursor for the following page.
+@app.get("/trades/")
+async def api_get_trades(ticker: Optional[str] = None, user_id: Optional[str] = None, start: Optional[str] = None,
+                         end: Optional[str] = None, cursor: Optional[str] = None, limit: int = 100):
+    return await query_page(TRADES, "trades", limit, cursor, ticker=ticker, user_id=user_id, start=start, end=end)
+
+# Every matching trade as newline-delimited JSON, streamed
+@app.get("/trades/ndjson")
+async def api_stream_trades(ticker: Optional[str] = None, user_id: Optional[str] = None, start: Optional[str] = None,
+                            end: Optional[str] = None, cursor: Optional[str] = None):
+    return query_stream(TRADES, cursor, ticker=ticker, user_id=user_id, start=start, end=end)
+
+@app.get("/orders/")
+async def api_get_orders(ticker: Optional[str] = None, user_id: Optional[str] = None,
+                         cursor: Optional[str] = None, limit: int = 100):
+    return await query_page(ORDERS, "orders", limit, cursor, ticker=ticker, user_id=user_id)
+
+@app.get("/orders/ndjson")
+async def api_stream_orders(ticker: Optional[str] = None, user_id: Optional[str] = None, cursor: Optional[str] = None):
+    return query_stream(ORDERS, cursor, ticker=ticker, user_id=user_id)
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8005)
\ No newline at end of file
+    uvicorn.run(app, host="127.0.0.1", port=8005)
@@ -1,91 +1,218 @@
+import os
 import asyncio
+import itertools
 import websockets
 import json
-from fastapi import FastAPI, BackgroundTasks
-from fastapi.responses import HTMLResponse
+from typing import Dict, List, Set
+from fastapi import FastAPI
+from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from starlette.requests import Request
-from websockets.exceptions import InvalidStatusCode
+from websockets.exceptions import WebSocketException
+
+# Dashboard for the engine. It keeps one WebSocket open to server.py and subscribes to
+# the depth feed of every ticker that list_tickers reports. Book changes are pushed to
+# browsers over Server-Sent Events on /events. /order_books serves the same views for
+# plain HTTP clients.
 
 app = FastAPI()
 
-# Global variable to store the order book data
-order_books = {}
+ENGINE_URI = os.environ.get('TINYTRADER_ENGINE_URI', 'ws://localhost:8000/ws')
+# Seconds between list_tickers requests on the open connection, to pick up new tickers
+TICKER_REFRESH_INTERVAL = float(os.environ.get('TINYTRADER_TICKER_REFRESH_INTERVAL', 2))
+# Minimum seconds between pushes to one browser; changes in between are conflated
+PUSH_INTERVAL = float(os.environ.get('TINYTRADER_PUSH_INTERVAL', 0.1))
+# Price levels per side sent to browsers
+DISPLAY_LEVELS = int(os.environ.get('TINYTRADER_DISPLAY_LEVELS', 20))
+KEEPALIVE_INTERVAL = 15
+
+# ticker -> {'sequence': int, 'bids': {price: [quantity, order count]}, 'asks': {...}}
+# A sequence of None means a fresh snapshot has been requested and updates are skipped.
+order_books: Dict[str, Dict] = {}
 
 # Setup static files and templates
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
-# Function to calculate the initial market price based on the order book
-def calculate_initial_price(buy_orders, sell_orders):
-    if not buy_orders and not sell_orders:
+# Function to calculate the initial market price from the best bid and ask levels
+def calculate_initial_price(bids: List[List], asks: List[List]):
+    if not bids and not asks:
         return 0  # Return 0 if the order book is empty
 
-    if buy_orders and not sell_orders:
-        return max(buy_orders, key=lambda x: x['price'])['price']  # Use the highest bid as an estimate
+    if bids and not asks:
+        return bids[0][0]  # Use the highest bid as an estimate
 
-    if sell_orders and not buy_orders:
-        return min(sell_orders, key=lambda x: x['price'])['price']  # Use the lowest ask as an estimate
+    if asks and not bids:
+        return asks[0][0]  # Use the lowest ask as an estimate
 
     # Calculate the midpoint price if both buy and sell orders exist
-    best_bid = max(buy_orders, key=lambda x: x['price'])['price']
-    best_ask = min(sell_orders, key=lambda x: x['price'])['price']
-    
+    best_bid = bids[0][0]
+    best_ask = asks[0][0]
+
     if best_bid < best_ask:
         return (best_bid + best_ask) / 2  # Midpoint between best bid and best ask
     else:
         return 0  # If there's a logical error, fallback to 0 (shouldn't happen if correctly managed)
 
-# Function to poll the WebSocket server for a specific ticker
-async def poll_order_book(uri: str, ticker: str):
-    try:
-        async with websockets.connect(uri) as websocket:
-            # Send a command to check the order book for the given ticker
-            check_message = {
-                "command": "check",
-                "ticker": ticker
-            }
-            await websocket.send(json.dumps(check_message))
-            response = await websocket.recv()
-            order_book = json.loads(response)
-
-            # Store the order book data
-            order_books[ticker] = order_book
-
-            # Calculate the initial price
-            initial_price = calculate_initial_price(order_book['buy'], order_book['sell'])
-            print(f"Updated order book for {ticker} with initial price {initial_price}: {order_book}")
-
-            # You can choose to store this initial price or use it as needed
-            order_books[ticker]['initial_price'] = initial_price
-
-    except InvalidStatusCode as e:
-        print(f"Failed to connect to WebSocket server: {e}")
-
-# Background task to periodically poll the WebSocket server
-async def poll_websocket_server():
-    uri = "ws://localhost:8000/ws"  # The WebSocket server URI
-    tickers = ['AAPL', 'MSFT', 'NVDA', 'AMZN', 'GOOGL', 'META', 'BRK.A', 'BRK.B', 'LLY', 'TSM', 'TSLA']
+def book_view(ticker: str) -> Dict:
+    """
+    The browser-facing view of a book: the best DISPLAY_LEVELS levels per side as
+    [price, quantity, order count], best first.
+    """
+    book = order_books[ticker]
+    bids = [[price, *level] for price, level in sorted(book['bids'].items(), reverse=True)[:DISPLAY_LEVELS]]
+    asks = [[price, *level] for price, level in sorted(book['asks'].items())[:DISPLAY_LEVELS]]
+    return {
+        'ticker': ticker,
+        'sequence': book['sequence'],
+        'bids': bids,
+        'asks': asks,
+        'initial_price': calculate_initial_price(bids, asks),
+    }
+
+# One browser's event stream. Changes are conflated per ticker: the stream remembers which
+# tickers changed since its last push and sends their latest views, so a slow browser
+# never builds up a backlog.
+class BrowserStream:
+    def __init__(self):
+        self.dirty: Set[str] = set()
+        self.changed = asyncio.Event()
+
+    def mark(self, ticker: str):
+        self.dirty.add(ticker)
+        self.changed.set()
+
+    async def events(self):
+        yield sse_event('snapshot', {ticker: book_view(ticker) for ticker in order_books})
+        while True:
+            try:
+                await asyncio.wait_for(self.changed.wait(), KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            self.changed.clear()
+            dirty, self.dirty = self.dirty, set()
+            yield sse_event('books', {ticker: book_view(ticker) for ticker in dirty if ticker in order_books})
+            await asyncio.sleep(PUSH_INTERVAL)
+
+browser_streams: Set[BrowserStream] = set()
+
+def sse_event(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def notify_browsers(ticker: str):
+    for stream in browser_streams:
+        stream.mark(ticker)
+
+def apply_levels(side: Dict, levels: List[List]):
+    for price, quantity, count in levels:
+        if quantity:
+            side[price] = [quantity, count]
+        else:
+            side.pop(price, None)
+
+async def subscribe(websocket, ticker: str):
+    order_books.setdefault(ticker, {'bids': {}, 'asks': {}})['sequence'] = None
+    await websocket.send(json.dumps({"command": "subscribe", "ticker": ticker}))
+
+async def handle_engine_message(websocket, raw: str):
+    """
+    Applies one message from the engine: a list_tickers reply, or a depth snapshot or
+    update. Fill broadcasts and other replies are ignored.
+    """
+    if not raw.startswith('{'):
+        if raw.startswith('Error'):
+            print(f"Engine replied: {raw}")
+        return
+    message = json.loads(raw)
+    if 'tickers' in message:
+        for ticker in message['tickers']:
+            if ticker not in order_books:
+                await subscribe(websocket, ticker)
+        return
+    message_type = message.get('type')
+    if message_type == 'depth_snapshot':
+        order_books[message['ticker']] = book = {'sequence': message['sequence'], 'bids': {}, 'asks': {}}
+        apply_levels(book['bids'], message['bids'])
+        apply_levels(book['asks'], message['asks'])
+        notify_browsers(message['ticker'])
+    elif message_type == 'depth_update':
+        book = order_books.get(message['ticker'])
+        if book is None or book['sequence'] is None:
+            return  # Waiting for a snapshot
+        if message['sequence'] <= book['sequence']:
+            return
+        if message['sequence'] != book['sequence'] + 1:
+            print(f"Missed depth updates for {message['ticker']}, resubscribing")
+            await subscribe(websocket, message['ticker'])
+            return
+        book['sequence'] = message['sequence']
+        apply_levels(book['bids'], message['bids'])
+        apply_levels(book['asks'], message['asks'])
+        notify_browsers(message['ticker'])
+
+async def refresh_tickers(websocket):
+    request_ids = itertools.count(1)
+    while True:
+        await websocket.send(json.dumps({"command": "list_tickers", "id": f"tickers-{next(request_ids)}"}))
+        await asyncio.sleep(TICKER_REFRESH_INTERVAL)
 
+# Background task keeping one connection to the engine, reconnecting with backoff
+async def follow_engine(uri: str):
+    backoff = 0.5
     while True:
-        for ticker in tickers:
-            await poll_order_book(uri, ticker)
-        await asyncio.sleep(10)  # Poll every 10 seconds
+        try:
+            async with websockets.connect(uri, max_size=None) as websocket:
+                print(f"Connected to {uri}")
+                backoff = 0.5
+                # Books are rebuilt from fresh snapshots on every connection
+                for ticker in list(order_books):
+                    await subscribe(websocket, ticker)
+                refresher = asyncio.create_task(refresh_tickers(websocket))
+                try:
+                    async for raw in websocket:
+                        await handle_engine_message(websocket, raw)
+                finally:
+                    refresher.cancel()
+        except (OSError, WebSocketException) as e:
+            print(f"Connection to {uri} failed: {e}")
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, 10)
 
 @app.on_event("startup")
 async def startup_event():
-    # Start the background polling task when the server starts
-    asyncio.create_task(poll_websocket_server())
+    # Start the background task following the engine when the server starts
+    asyncio.create_task(follow_engine(ENGINE_URI))
 
 @app.get("/", response_class=HTMLResponse)
 async def get_order_book_page(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
+@app.get("/events")
+async def order_book_events():
+    """
+    Server-Sent Events: a 'snapshot' of every book, then 'books' events with the latest
+    view of each book that changed.
+    """
+    stream = BrowserStream()
+    browser_streams.add(stream)
+
+    async def events():
+        try:
+            async for event in stream.events():
+                yield event
+        finally:
+            browser_streams.discard(stream)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @app.get("/order_books")
 async def get_order_books():
-    return order_books
+    return {ticker: book_view(ticker) for ticker in order_books}
 
 @app.get("/order_books/{ticker}")
 async def get_order_book_for_ticker(ticker: str):
-    return order_books.get(ticker, {"error": "Ticker not found"})
\ No newline at end of file
+    if ticker not in order_books:
+        return {"error": "Ticker not found"}
+    return book_view(ticker)
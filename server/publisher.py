@@ -0,0 +1,347 @@
+import asyncio
+import logging
+import itertools
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
+
+# Long-lived, confirmed publisher for the broker-based services.
+#
+# One pika AsyncioConnection per process, running on the asyncio event loop, with a pool
+# of channels in publisher-confirm mode. publish() queues a message and returns once the
+# broker has confirmed it. Everything queued during one pass of the event loop is sent as
+# a batch, round-robin over the channels, and the broker acknowledges it with a few
+# multiple-tag acks rather than one round trip per message.
+#
+# If the connection drops it is reopened with exponential backoff, and every message
+# that wasn't confirmed yet is published again (at-least-once delivery).
+#
+# The connection factory is pluggable: 'memory://' URLs use InMemoryBroker, an
+# in-process stand-in with the same callback surface, for running and testing without
+# RabbitMQ.
+
+# A message waiting to be sent or confirmed
+Message = Tuple[str, bytes, asyncio.Future]
+
+class PublishError(Exception):
+    pass
+
+# Publishing side of one pooled channel: delivery tag -> (send sequence, message), in
+# publish order. The sequence runs across all channels, so a reconnect can requeue them
+# in the order they were sent.
+class _ConfirmChannel:
+    def __init__(self, channel):
+        self.channel = channel
+        self.next_tag = 1
+        self.unconfirmed: Dict[int, Tuple[int, Message]] = {}
+
+class Publisher:
+    def __init__(self, url: str, exchange: str, exchange_type: str = 'direct', channels: int = 4,
+                 batch_size: int = 500, max_pending: int = 10000, publish_timeout: float = 5.0,
+                 reconnect_delay: float = 0.5, max_reconnect_delay: float = 10.0,
+                 properties: Optional[pika.BasicProperties] = None, queues: Tuple[str, ...] = ()):
+        self.url = url
+        self.exchange = exchange  # '' is the broker's default exchange, routing straight to queues
+        self.exchange_type = exchange_type
+        self.queues = queues  # Durable queues to declare (and bind by name to a named exchange)
+        self.channel_count = channels
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.publish_timeout = publish_timeout
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.properties = properties or pika.BasicProperties(delivery_mode=2)  # Persistent
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._connection = None
+        self._channels: List[_ConfirmChannel] = []
+        self._next_channel = itertools.count()
+        self._send_sequence = itertools.count()
+        self._pending: Deque[Message] = deque()
+        self._flush_scheduled = False
+        self._ready = asyncio.Event()
+        self._closing = False
+        self._backoff = reconnect_delay
+
+    @property
+    def connected(self) -> bool:
+        return self._ready.is_set()
+
+    async def start(self, timeout: float = 5.0):
+        """
+        Opens the connection and its channels. Returns once ready, or after `timeout`
+        with reconnection continuing in the background; publish() waits for it either way.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._connect()
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Broker at {self.url} not ready after {timeout}s; retrying in the background")
+
+    async def publish(self, routing_key: str, body: bytes):
+        """
+        Publishes a message and waits for the broker to confirm it.
+        Raises PublishError if it is nacked, the backlog is full, or no confirm arrives
+        within publish_timeout.
+        """
+        if self._closing:
+            raise PublishError("Publisher is closed")
+        if len(self._pending) + self._unconfirmed_count() >= self.max_pending:
+            raise PublishError(f"Publish backlog of {self.max_pending} messages is full")
+        future = self._loop.create_future()
+        self._pending.append((routing_key, body, future))
+        self._schedule_flush()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.publish_timeout)
+        except asyncio.TimeoutError:
+            future.cancel()  # Skipped by _flush if it hasn't been sent yet
+            raise PublishError(f"No confirm from the broker within {self.publish_timeout}s")
+
+    async def close(self):
+        self._closing = True
+        self._ready.clear()
+        for _, _, future in self._pending:
+            if not future.done():
+                future.set_exception(PublishError("Publisher closed"))
+        self._pending.clear()
+        if self._connection is not None and self._connection.is_open:
+            self._connection.close()
+
+    def _unconfirmed_count(self) -> int:
+        return sum(len(channel.unconfirmed) for channel in self._channels)
+
+    def _connect(self):
+        if self._closing:
+            return
+        url = urlparse(self.url)
+        callbacks = dict(on_open_callback=self._on_connection_open, on_open_error_callback=self._on_connection_error,
+                         on_close_callback=self._on_connection_closed)
+        if url.scheme == 'memory':
+            self._connection = InMemoryBroker.get(url.netloc or 'default').connect(loop=self._loop, **callbacks)
+        else:
+            self._connection = AsyncioConnection(pika.URLParameters(self.url), custom_ioloop=self._loop, **callbacks)
+
+    def _on_connection_open(self, connection):
+        self._channels = []
+        for _ in range(self.channel_count):
+            connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_channel_open(self, channel):
+        channel.add_on_close_callback(self._on_channel_closed)
+        # Declarations run one after another, each from the previous one's callback
+        steps = []
+        if self.exchange:
+            steps.append(lambda callback: channel.exchange_declare(
+                exchange=self.exchange, exchange_type=self.exchange_type, callback=callback))
+        for queue in self.queues:
+            steps.append(lambda callback, queue=queue: channel.queue_declare(queue, durable=True, callback=callback))
+            if self.exchange:
+                steps.append(lambda callback, queue=queue: channel.queue_bind(
+                    queue, self.exchange, routing_key=queue, callback=callback))
+        self._declare(channel, steps)
+
+    def _declare(self, channel, steps: List[Callable]):
+        if steps:
+            steps[0](lambda _frame: self._declare(channel, steps[1:]))
+            return
+        confirm_channel = _ConfirmChannel(channel)
+        channel.confirm_delivery(lambda frame: self._on_confirm(confirm_channel, frame),
+                                 callback=lambda _frame: self._on_confirm_mode(confirm_channel))
+
+    def _on_confirm_mode(self, confirm_channel: _ConfirmChannel):
+        self._channels.append(confirm_channel)
+        if len(self._channels) == self.channel_count:
+            logging.info(f"Publisher connected to {self.url} with {self.channel_count} channels")
+            self._backoff = self.reconnect_delay
+            self._ready.set()
+            self._schedule_flush()
+
+    def _on_connection_error(self, _connection, error: BaseException):
+        logging.error(f"Could not connect to the broker at {self.url}: {error!r}")
+        self._reconnect()
+
+    def _on_connection_closed(self, _connection, error: BaseException):
+        if not self._closing:
+            logging.warning(f"Broker connection to {self.url} closed: {error}")
+        self._reconnect()
+
+    def _on_channel_closed(self, channel, error: BaseException):
+        # A channel-level error (e.g. a conflicting exchange declaration) resets the whole
+        # connection, so the pool is rebuilt from scratch
+        if self._closing or self._connection is None or not self._connection.is_open:
+            return
+        logging.warning(f"Broker channel {channel} closed: {error}; reconnecting")
+        self._connection.close()
+
+    def _reconnect(self):
+        self._ready.clear()
+        # Unconfirmed messages go back to the front of the queue, in their original order
+        unconfirmed = sorted((entry for channel in self._channels for entry in channel.unconfirmed.values()),
+                             key=lambda entry: entry[0])
+        self._channels = []
+        for _, message in reversed(unconfirmed):
+            self._pending.appendleft(message)
+        if self._closing:
+            for _, _, future in self._pending:
+                if not future.done():
+                    future.set_exception(PublishError("Publisher closed"))
+            self._pending.clear()
+            return
+        delay, self._backoff = self._backoff, min(self._backoff * 2, self.max_reconnect_delay)
+        self._loop.call_later(delay, self._connect)
+
+    def _schedule_flush(self):
+        if not self._flush_scheduled and self._ready.is_set():
+            self._flush_scheduled = True
+            self._loop.call_soon(self._flush)
+
+    def _flush(self):
+        """
+        Sends up to batch_size queued messages, round-robin over the channels; the rest
+        go in the next pass so other callbacks (confirms among them) get to run.
+        """
+        self._flush_scheduled = False
+        sent = 0
+        while self._pending and self._ready.is_set() and sent < self.batch_size:
+            routing_key, body, future = message = self._pending.popleft()
+            if future.done():
+                continue  # Timed out before it was sent
+            channel = self._channels[next(self._next_channel) % len(self._channels)]
+            try:
+                channel.channel.basic_publish(self.exchange, routing_key, body, self.properties)
+            except Exception as e:
+                # The connection is going away; _reconnect will requeue what's unconfirmed
+                self._pending.appendleft(message)
+                logging.warning(f"Publish failed, waiting for reconnect: {e}")
+                return
+            channel.unconfirmed[channel.next_tag] = (next(self._send_sequence), message)
+            channel.next_tag += 1
+            sent += 1
+        if self._pending:
+            self._schedule_flush()
+
+    def _on_confirm(self, channel: _ConfirmChannel, frame):
+        method = frame.method
+        if method.multiple:
+            # Tags are inserted in increasing order, so this stops at the first later one
+            tags = list(itertools.takewhile(lambda tag: tag <= method.delivery_tag, channel.unconfirmed))
+        else:
+            tags = [method.delivery_tag] if method.delivery_tag in channel.unconfirmed else []
+        acked = isinstance(method, pika.spec.Basic.Ack)
+        for tag in tags:
+            _, (_, _, future) = channel.unconfirmed.pop(tag)
+            if future.done():
+                continue
+            if acked:
+                future.set_result(None)
+            else:
+                future.set_exception(PublishError("Message was nacked by the broker"))
+
+# In-process stand-in for RabbitMQ, covering the part of pika's connection and channel
+# API that Publisher uses. Published messages are kept per (exchange, routing key) and
+# confirmed on the next loop pass with one multiple-tag ack per channel, like a broker
+# acking a batch. drop_connections() and refuse_connections simulate outages, and
+# hold_confirms leaves published messages unconfirmed (e.g. across a dropped connection).
+class InMemoryBroker:
+    _brokers: Dict[str, 'InMemoryBroker'] = {}
+
+    def __init__(self):
+        self.exchanges: Dict[str, str] = {}
+        self.queues: Set[str] = set()
+        self.messages: Dict[Tuple[str, str], List[bytes]] = {}
+        self.connections: List['_MemoryConnection'] = []
+        self.refuse_connections = 0  # Number of upcoming connection attempts to refuse
+        self.hold_confirms = False  # Store messages without acking them
+
+    @classmethod
+    def get(cls, name: str = 'default') -> 'InMemoryBroker':
+        broker = cls._brokers.get(name)
+        if broker is None:
+            broker = cls._brokers[name] = cls()
+        return broker
+
+    def connect(self, loop, on_open_callback, on_open_error_callback, on_close_callback) -> '_MemoryConnection':
+        connection = _MemoryConnection(self, loop, on_close_callback)
+        if self.refuse_connections:
+            self.refuse_connections -= 1
+            loop.call_soon(on_open_error_callback, connection, ConnectionRefusedError("Refused by InMemoryBroker"))
+        else:
+            self.connections.append(connection)
+            connection.is_open = True
+            loop.call_soon(on_open_callback, connection)
+        return connection
+
+    def drop_connections(self):
+        for connection in list(self.connections):
+            connection.close(ConnectionResetError("Dropped by InMemoryBroker"))
+
+class _MemoryConnection:
+    def __init__(self, broker: InMemoryBroker, loop, on_close_callback):
+        self.broker = broker
+        self.loop = loop
+        self.on_close_callback = on_close_callback
+        self.is_open = False
+        self._channel_numbers = itertools.count(1)
+
+    def channel(self, on_open_callback):
+        channel = _MemoryChannel(self, next(self._channel_numbers))
+        self.loop.call_soon(on_open_callback, channel)
+
+    def close(self, error: Optional[BaseException] = None):
+        if not self.is_open:
+            return
+        self.is_open = False
+        self.broker.connections.remove(self)
+        self.loop.call_soon(self.on_close_callback, self, error or ConnectionResetError("Closed"))
+
+class _MemoryChannel:
+    def __init__(self, connection: _MemoryConnection, number: int):
+        self.connection = connection
+        self.channel_number = number
+        self._on_confirm: Optional[Callable] = None
+        self._next_tag = 1
+        self._ack_scheduled = False
+
+    def __repr__(self):
+        return f"<InMemoryBroker channel {self.channel_number}>"
+
+    def add_on_close_callback(self, callback: Callable):
+        pass  # Channels here only close with their connection
+
+    def exchange_declare(self, exchange: str, exchange_type: str = 'direct', callback: Optional[Callable] = None):
+        self.connection.broker.exchanges.setdefault(exchange, exchange_type)
+        if callback is not None:
+            self.connection.loop.call_soon(callback, pika.frame.Method(self.channel_number, pika.spec.Exchange.DeclareOk()))
+
+    def queue_declare(self, queue: str, durable: bool = False, callback: Optional[Callable] = None):
+        self.connection.broker.queues.add(queue)
+        if callback is not None:
+            self.connection.loop.call_soon(callback, pika.frame.Method(self.channel_number, pika.spec.Queue.DeclareOk(queue)))
+
+    def queue_bind(self, queue: str, exchange: str, routing_key: Optional[str] = None, callback: Optional[Callable] = None):
+        if callback is not None:
+            self.connection.loop.call_soon(callback, pika.frame.Method(self.channel_number, pika.spec.Queue.BindOk()))
+
+    def confirm_delivery(self, ack_nack_callback: Callable, callback: Optional[Callable] = None):
+        self._on_confirm = ack_nack_callback
+        if callback is not None:
+            self.connection.loop.call_soon(callback, pika.frame.Method(self.channel_number, pika.spec.Confirm.SelectOk()))
+
+    def basic_publish(self, exchange: str, routing_key: str, body, properties=None, mandatory: bool = False):
+        if not self.connection.is_open:
+            raise pika.exceptions.ChannelWrongStateError("Channel is closed.")
+        body = body.encode() if isinstance(body, str) else body
+        self.connection.broker.messages.setdefault((exchange, routing_key), []).append(body)
+        self._next_tag += 1
+        if self._on_confirm is not None and not self._ack_scheduled and not self.connection.broker.hold_confirms:
+            self._ack_scheduled = True
+            self.connection.loop.call_soon(self._ack)
+
+    def _ack(self):
+        self._ack_scheduled = False
+        if self.connection.is_open:
+            ack = pika.spec.Basic.Ack(delivery_tag=self._next_tag - 1, multiple=True)
+            self._on_confirm(pika.frame.Method(self.channel_number, ack))
@@ -4,332 +4,272 @@ import time
 import logging
 import asyncio
 from enum import Enum
-from typing import List, Dict, Optional
-
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from pydantic import BaseModel, Field, ValidationError, model_validator, validator
-import aiosqlite
+from typing import List, Dict, Optional, Union
+
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.websockets import WebSocketState
+from pydantic import ValidationError
+from engine import Order, OrderBookManager, parse_order, parse_orders, manager_settings_from_env
+from sharding import ShardedOrderBookManager
+from depth_feed import DepthFeed
+import wire
+from log_config import configure_logging, hot_logger
+from metrics import registry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from history import InvalidCursor, open_reader
+from trade_writer import CLEARED_TRADES, CLEARED_TRADES_SCHEMA
+
+# orjson is optional; it decodes /ws messages several times faster than the json module.
+# Its JSONDecodeError subclasses json.JSONDecodeError, so error handling is the same.
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
 app = FastAPI()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    handlers=[
-        logging.StreamHandler()
-    ]
-)
-
-# Enums for order sides and types
-class OrderSide(str, Enum):
-    BUY = "buy"
-    SELL = "sell"
-
-class OrderType(str, Enum):
-    MARKET = "market"
-    LIMIT = "limit"
-
-# Order model with validation
-class Order(BaseModel):
-    ticker: str
-    side: OrderSide
-    quantity: int
-    user_id: str
-    order_type: OrderType
-    price: Optional[float] = None
-    timestamp: float = Field(default_factory=time.time)
-
-    @validator('quantity')
-    def quantity_must_be_positive(cls, v):
-        if v <= 0:
-            raise ValueError('Quantity must be positive.')
-        return v
-
-    @model_validator(mode='after')
-    def check_price(self):
-        if self.order_type == OrderType.LIMIT and self.price is None:
-            raise ValueError("Price is required for limit orders.")
-        if self.order_type == OrderType.MARKET:
-            self.price = None  # Ensure price is None for market orders
-        return self
-
-# OrderBook class to manage orders for a ticker
-class OrderBook:
-    def __init__(self, ticker: str, db_path: str):
-        self.ticker = ticker
-        self.buy_orders: List[Order] = []
-        self.sell_orders: List[Order] = []
-        self.lock = asyncio.Lock()  # Ensure thread-safe operations
-        self.db_path = db_path
-
-    async def initialize_db(self):
-        """
-        Initialize the cleared_trades table if it doesn't exist.
-        """
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS cleared_trades (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    ticker TEXT NOT NULL,
-                    order_type TEXT NOT NULL,
-                    price REAL NOT NULL,
-                    quantity INTEGER NOT NULL,
-                    cleared_at TEXT NOT NULL,
-                    filler_user_id TEXT NOT NULL,
-                    filled_user_id TEXT NOT NULL
-                )
-            ''')
-            await db.commit()
-        logging.info(f"Database initialized for ticker: {self.ticker}")
-
-    async def _persist_cleared_trade(self, order_type: str, price: float, quantity: int, filler_user_id: str, filled_user_id: str):
-        """
-        Persists a cleared trade to the SQLite database.
-        """
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute('''
-                INSERT INTO cleared_trades (ticker, order_type, price, quantity, cleared_at, filler_user_id, filled_user_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                self.ticker,
-                order_type,
-                price,
-                quantity,
-                time.strftime('%Y-%m-%d %H:%M:%S'),
-                filler_user_id,
-                filled_user_id
-            ))
-            await db.commit()
-        logging.debug(f"Persisted cleared trade: {order_type}, {price}, {quantity}, {filler_user_id}, {filled_user_id}")
-
-    async def add_order(self, order: Order):
-        async with self.lock:
-            logging.info(f"Adding order: {order}")
-            if order.order_type == OrderType.MARKET:
-                matched_orders = await self.match_market_order(order)
-            elif order.order_type == OrderType.LIMIT:
-                if order.side == OrderSide.BUY:
-                    self.buy_orders.append(order)
-                else:
-                    self.sell_orders.append(order)
-                self.sort_order_book()
-                matched_orders = await self.match_limit_orders()
-            else:
-                raise ValueError("Invalid order type.")
-            await self._self_check(matched_orders)
-            return matched_orders
-
-    def sort_order_book(self):
-        self.buy_orders.sort(key=lambda x: (-x.price if x.price else float('-inf'), x.timestamp))
-        self.sell_orders.sort(key=lambda x: (x.price if x.price else float('inf'), x.timestamp))
-        logging.debug(f"Sorted order book for {self.ticker}")
-
-    async def match_market_order(self, order: Order):
-        matched_orders = []
-        quantity_to_match = order.quantity
-
-        order_list = self.sell_orders if order.side == OrderSide.BUY else self.buy_orders
-
-        while quantity_to_match > 0 and order_list:
-            best_order = order_list[0]
-            matched_quantity = min(quantity_to_match, best_order.quantity)
-            matched_price = best_order.price
-            matched_orders.append({
-                'price': matched_price,
-                'quantity': matched_quantity,
-                'maker_user_id': best_order.user_id,
-                'taker_user_id': order.user_id,
-                'timestamp': time.time()
-            })
-
-            # Persist the matched trade
-            await self._persist_cleared_trade(
-                order_type=order.side.value, 
-                price=matched_price, 
-                quantity=matched_quantity, 
-                filler_user_id=order.user_id, 
-                filled_user_id=best_order.user_id
-            )
-
-            logging.info(f"Matched {matched_quantity} units at {matched_price} between {order.user_id} and {best_order.user_id}")
-
-            best_order.quantity -= matched_quantity
-            quantity_to_match -= matched_quantity
-
-            if best_order.quantity == 0:
-                order_list.pop(0)
-                logging.debug(f"Removed fully matched order: {best_order}")
-
-        if quantity_to_match > 0:
-            logging.info(f"Order partially filled. Unmatched quantity: {quantity_to_match}")
-
-        return matched_orders
-
-    async def match_limit_orders(self):
-        matched_orders = []
-        while self.buy_orders and self.sell_orders:
-            best_buy = self.buy_orders[0]
-            best_sell = self.sell_orders[0]
-
-            if best_buy.price >= best_sell.price:
-                matched_quantity = min(best_buy.quantity, best_sell.quantity)
-                matched_price = best_sell.price
-                matched_orders.append({
-                    'price': matched_price,
-                    'quantity': matched_quantity,
-                    'buy_user_id': best_buy.user_id,
-                    'sell_user_id': best_sell.user_id,
-                    'timestamp': time.time()
-                })
-
-                # Persist the matched trade
-                await self._persist_cleared_trade(
-                    order_type="buy", 
-                    price=matched_price, 
-                    quantity=matched_quantity, 
-                    filler_user_id=best_buy.user_id, 
-                    filled_user_id=best_sell.user_id
-                )
-
-                logging.info(f"Matched {matched_quantity} units at {matched_price} between {best_buy.user_id} and {best_sell.user_id}")
-
-                best_buy.quantity -= matched_quantity
-                best_sell.quantity -= matched_quantity
-
-                if best_buy.quantity == 0:
-                    self.buy_orders.pop(0)
-                    logging.debug(f"Removed fully matched buy order: {best_buy}")
-                if best_sell.quantity == 0:
-                    self.sell_orders.pop(0)
-                    logging.debug(f"Removed fully matched sell order: {best_sell}")
-            else:
-                break
-        return matched_orders
-
-    async def _self_check(self, matched_orders: List[Dict]):
-        """
-        Self-checking method to verify that matched orders were persisted correctly.
-        """
-        async with aiosqlite.connect(self.db_path) as db:
-            for matched_order in matched_orders:
-                query = '''
-                    SELECT * FROM cleared_trades 
-                    WHERE ticker=? AND price=? AND quantity=? 
-                    AND filler_user_id=? AND filled_user_id=?
-                '''
-                params = (
-                    self.ticker,
-                    matched_order['price'],
-                    matched_order['quantity'],
-                    matched_order.get('buy_user_id', matched_order.get('filler_user_id')),
-                    matched_order.get('sell_user_id', matched_order.get('filled_user_id'))
-                )
-                async with db.execute(query, params) as cursor:
-                    result = await cursor.fetchone()
-                    if not result:
-                        logging.error(f"Self-check failed: Matched order not persisted: {matched_order}")
-
-    def get_order_book(self):
-        return {
-            'buy': [order.dict() for order in self.buy_orders],
-            'sell': [order.dict() for order in self.sell_orders]
-        }
-
-# Manager to handle multiple order books
-class OrderBookManager:
-    def __init__(self, db_name: str = 'data.db'):
-        self.order_books: Dict[str, OrderBook] = {}
-        self.lock = asyncio.Lock()  # Protect the order_books dictionary
-        self.db_name = db_name
-        self.db_path = self._get_db_path()
-
-    def _get_db_path(self) -> str:
-        """
-        Determines the path to the SQLite database.
-        """
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        db_path = os.path.join(script_dir, self.db_name)
-        return db_path
-
-    async def initialize_order_book(self, ticker: str):
-        async with self.lock:
-            if ticker not in self.order_books:
-                order_book = OrderBook(ticker, self.db_path)
-                await order_book.initialize_db()
-                self.order_books[ticker] = order_book
-                logging.info(f"Initialized order book for ticker: {ticker}")
-
-    async def get_order_book(self, ticker: str) -> OrderBook:
-        await self.initialize_order_book(ticker)
-        return self.order_books[ticker]
-
-    async def add_order(self, order: Order):
-        order_book = await self.get_order_book(order.ticker)
-        matched_orders = await order_book.add_order(order)
-        return matched_orders
-
-    async def list_tickers(self):
-        async with self.lock:
-            active_tickers = [ticker for ticker, ob in self.order_books.items() if ob.buy_orders or ob.sell_orders]
-            logging.debug(f"Listing tickers: {active_tickers}")
-            return active_tickers
-
-    async def get_order_book_snapshot(self, ticker: str):
-        order_book = await self.get_order_book(ticker)
-        async with order_book.lock:
-            snapshot = order_book.get_order_book()
-            logging.debug(f"Order book snapshot for {ticker}: {snapshot}")
-            return snapshot
-
-order_book_manager = OrderBookManager()
+# Configure logging: queued, with per-order messages rate limited (see log_config.py)
+configure_logging()
+
+# The engine itself lives in engine.py; its settings come from TINYTRADER_* variables
+manager_settings = manager_settings_from_env()
+
+# TINYTRADER_SHARDS > 0 runs matching in that many worker processes, partitioned by ticker
+matching_shards = int(os.environ.get('TINYTRADER_SHARDS', 0))
+if matching_shards > 0:
+    order_book_manager = ShardedOrderBookManager(matching_shards, **manager_settings)
+else:
+    order_book_manager = OrderBookManager(**manager_settings)
+
+@app.on_event("startup")
+async def startup_event():
+    global history_reader
+    # Recover journaled books before the first connection, not on the first order
+    await order_book_manager.start()
+    # Sharded, the trade writers run in the shards and may not have created the table yet
+    history_reader = await open_reader(order_book_manager.db_path, CLEARED_TRADES_SCHEMA)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    logging.info("Shutting down order books...")
+    await order_book_manager.close()
+    if history_reader is not None:
+        await history_reader.close()
+
+# Read-only connection for the cleared trade history, separate from the trade writer
+history_reader = None
+
+# Cleared trades by ticker, by user (filler or filled) and/or by cleared_at range
+# [start, end), oldest first, a page at a time. Pass next_cursor back as cursor.
+@app.get("/cleared_trades")
+async def cleared_trades_endpoint(ticker: Optional[str] = None, user_id: Optional[str] = None,
+                                  start: Optional[str] = None, end: Optional[str] = None,
+                                  cursor: Optional[str] = None, limit: int = 100):
+    try:
+        trades, next_cursor = await CLEARED_TRADES.page(history_reader, ticker=ticker, user_id=user_id, start=start,
+                                                        end=end, cursor=cursor, limit=limit)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"cleared_trades": trades, "next_cursor": next_cursor}
+
+# Every matching cleared trade as newline-delimited JSON, streamed
+@app.get("/cleared_trades/ndjson")
+async def cleared_trades_ndjson_endpoint(ticker: Optional[str] = None, user_id: Optional[str] = None,
+                                         start: Optional[str] = None, end: Optional[str] = None,
+                                         cursor: Optional[str] = None):
+    try:
+        CLEARED_TRADES.decode_cursor(cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    rows = CLEARED_TRADES.stream_ndjson(history_reader, ticker=ticker, user_id=user_id, start=start, end=end,
+                                        cursor=cursor)
+    return StreamingResponse(rows, media_type="application/x-ndjson")
+
+# Prometheus text exposition of the metrics registry
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+# What to do when a client's outbound queue is full
+class OverflowPolicy(str, Enum):
+    DROP_OLDEST = "drop_oldest"  # Discard the oldest queued message; disconnect after max_dropped drops
+    DISCONNECT = "disconnect"  # Disconnect the client as a slow consumer straight away
+
+broadcast_seconds = registry.histogram('tinytrader_broadcast_seconds', 'Time to queue a broadcast for every client')
+broadcast_delivery_seconds = registry.histogram('tinytrader_broadcast_delivery_seconds',
+                                                'Time from queueing a broadcast to sending it to one client')
+broadcast_dropped_total = registry.counter('tinytrader_broadcast_dropped',
+                                           'Queued broadcasts dropped for slow clients')
+slow_consumer_disconnects_total = registry.counter('tinytrader_slow_consumer_disconnects',
+                                                   'Clients disconnected for falling behind')
+
+# Outbound side of one WebSocket: a bounded queue drained by its own sender task.
+# Queue items are (message, time queued).
+class ClientConnection:
+    def __init__(self, websocket: WebSocket, queue_size: int, binary: bool = False):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.task: Optional[asyncio.Task] = None
+        self.binary = binary  # Negotiated the binary wire protocol, see wire.py
 
 # Connection manager to handle multiple WebSocket connections
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-        self.lock = asyncio.Lock()  # Protect the active_connections list
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        async with self.lock:
-            self.active_connections.append(websocket)
-            logging.info(f"New client connected: {websocket.client}")
+    """
+    Fans broadcasts out without blocking the caller: each message is serialized once by
+    the caller, and the same string is queued for every connection. A per-connection
+    sender task does the actual send, so one slow client can't hold up matching or others.
+    """
+
+    def __init__(self, queue_size: int = 1024, overflow_policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+                 max_dropped: int = 1024):
+        self.active_connections: Dict[WebSocket, ClientConnection] = {}
+        self.queue_size = queue_size
+        self.overflow_policy = OverflowPolicy(overflow_policy)
+        self.max_dropped = max_dropped
+
+    async def connect(self, websocket: WebSocket) -> ClientConnection:
+        # Clients opt into binary frames by asking for the wire subprotocol
+        binary = wire.SUBPROTOCOL in websocket.scope.get('subprotocols', [])
+        await websocket.accept(subprotocol=wire.SUBPROTOCOL if binary else None)
+        connection = ClientConnection(websocket, self.queue_size, binary)
+        connection.task = asyncio.create_task(self._sender(connection))
+        self.active_connections[websocket] = connection
+        logging.info(f"New client connected: {websocket.client}")
+        return connection
 
     async def disconnect(self, websocket: WebSocket):
-        async with self.lock:
-            if websocket in self.active_connections:
-                self.active_connections.remove(websocket)
-                logging.info(f"Client disconnected: {websocket.client}")
-
-    async def broadcast(self, message: str):
-        async with self.lock:
-            if not self.active_connections:
-                logging.debug("No active connections to broadcast.")
-                return
-            logging.info(f"Broadcasting message to {len(self.active_connections)} clients.")
-            await asyncio.gather(*[self._safe_send(connection, message) for connection in self.active_connections])
+        connection = self.active_connections.pop(websocket, None)
+        if connection is not None:
+            if connection.task is not asyncio.current_task():
+                connection.task.cancel()
+            logging.info(f"Client disconnected: {websocket.client}")
 
-    async def _safe_send(self, connection: WebSocket, message: str):
+    def broadcast(self, message: str, binary_message: Optional[bytes] = None):
+        """
+        Queues an already-serialized message for every connection. Never awaits.
+        Binary connections get `binary_message` instead, when one is given.
+        """
+        if not self.active_connections:
+            logging.debug("No active connections to broadcast.")
+            return
+        hot_logger.info("Broadcasting message to %d clients.", len(self.active_connections))
+        started = time.perf_counter()
+        for connection in list(self.active_connections.values()):
+            self._enqueue(connection, binary_message if connection.binary and binary_message is not None else message,
+                          started)
+        broadcast_seconds.observe(time.perf_counter() - started)
+
+    def has_binary_connections(self) -> bool:
+        return any(connection.binary for connection in self.active_connections.values())
+
+    def _enqueue(self, connection: ClientConnection, message, queued: float):
+        try:
+            connection.queue.put_nowait((message, queued))
+            return
+        except asyncio.QueueFull:
+            pass
+        if self.overflow_policy == OverflowPolicy.DROP_OLDEST and connection.dropped < self.max_dropped:
+            connection.queue.get_nowait()
+            connection.queue.put_nowait((message, queued))
+            connection.dropped += 1
+            broadcast_dropped_total.inc()
+            hot_logger.debug("Dropped a queued message for slow client %s", connection.websocket.client)
+        else:
+            self._disconnect_slow_consumer(connection)
+
+    def _disconnect_slow_consumer(self, connection: ClientConnection):
+        logging.warning(f"Disconnecting slow client {connection.websocket.client} "
+                        f"({connection.queue.qsize()} queued, {connection.dropped} dropped)")
+        slow_consumer_disconnects_total.inc()
+        self.active_connections.pop(connection.websocket, None)
+        connection.task.cancel()
+        asyncio.create_task(self._close(connection.websocket))
+
+    async def _close(self, websocket: WebSocket):
         try:
-            await connection.send_text(message)
+            await websocket.close(code=1008, reason="Slow consumer")
         except Exception as e:
-            logging.error(f"Failed to send message to {connection.client}: {e}")
-            await self.disconnect(connection)
+            logging.debug(f"Error closing slow client {websocket.client}: {e}")
+
+    async def _sender(self, connection: ClientConnection):
+        while True:
+            message, queued = await connection.queue.get()
+            try:
+                if isinstance(message, bytes):
+                    await connection.websocket.send_bytes(message)
+                else:
+                    await connection.websocket.send_text(message)
+                broadcast_delivery_seconds.observe(time.perf_counter() - queued)
+            except Exception as e:
+                logging.error(f"Failed to send message to {connection.websocket.client}: {e}")
+                await self.disconnect(connection.websocket)
+                return
 
-manager = ConnectionManager()
+manager = ConnectionManager(
+    queue_size=int(os.environ.get('TINYTRADER_CLIENT_QUEUE_SIZE', 1024)),
+    overflow_policy=os.environ.get('TINYTRADER_OVERFLOW_POLICY', OverflowPolicy.DROP_OLDEST.value),
+)
+
+# Largest number of orders accepted in one add_batch
+max_batch_orders = int(os.environ.get('TINYTRADER_MAX_BATCH_ORDERS', 1000))
+
+# Incremental depth feed for 'subscribe'; fed by every order book's depth updates
+depth_feed = DepthFeed(queue_size=int(os.environ.get('TINYTRADER_CLIENT_QUEUE_SIZE', 1024)))
+order_book_manager.on_depth_update = depth_feed.publish
+
+registry.gauge('tinytrader_ws_connections', 'Connected WebSocket clients',
+               lambda: {(): len(manager.active_connections)})
+registry.gauge('tinytrader_book_resting_orders', 'Resting orders per ticker and side',
+               lambda: {(ticker, side.side.value): len(side)
+                        for ticker, book in getattr(order_book_manager, 'order_books', {}).items()
+                        for side in (book.buy_orders, book.sell_orders)},
+               ('ticker', 'side'))
+ws_messages_total = registry.counter('tinytrader_ws_messages', 'WebSocket requests by command', ('command',))
+ws_request_seconds = registry.histogram('tinytrader_ws_request_seconds',
+                                        'WebSocket request handling time by command, receipt to reply', ('command',))
+# Resolved once per command; anything unrecognised is counted as 'invalid'
+_ws_command_metrics = {
+    command: (ws_messages_total.labels(command), ws_request_seconds.labels(command))
+    for command in ('add', 'add_binary', 'add_batch', 'cancel', 'replace', 'check', 'subscribe', 'unsubscribe',
+                    'list_tickers', 'invalid')
+}
+
+def observe_ws_request(command, received: float):
+    metrics = _ws_command_metrics.get(command) if isinstance(command, str) else None
+    counter, histogram = metrics or _ws_command_metrics['invalid']
+    counter.inc()
+    histogram.observe(time.perf_counter() - received)
+
+def broadcast_fills(matched_orders: List[Dict]):
+    """
+    Broadcasts fills as JSON, and as a FILLS frame to clients on the binary protocol.
+    The binary frame is only encoded when such a client is connected.
+    """
+    binary_message = None
+    if manager.has_binary_connections():
+        try:
+            binary_message = wire.encode_fills(0, 0, matched_orders)
+        except wire.WireError as e:
+            # Binary clients get the JSON broadcast instead; the fills have already happened
+            logging.error(f"Could not encode fills for binary clients: {e}")
+    manager.broadcast(json.dumps({"matched_orders": matched_orders}), binary_message)
 
 # WebSocket endpoint to handle client connections and messages
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+    connection = await manager.connect(websocket)
     
-    async def safe_send_text(websocket: WebSocket, message: str):
+    async def safe_send(websocket: WebSocket, message: Union[str, bytes]):
         try:
-            if websocket.client_state.value != "connected":
+            if websocket.client_state != WebSocketState.CONNECTED:
                 logging.warning(f"Attempt to send message on closed connection to {websocket.client}")
                 return
-            await websocket.send_text(message)
+            if isinstance(message, bytes):
+                await websocket.send_bytes(message)
+            else:
+                await websocket.send_text(message)
         except WebSocketDisconnect:
             logging.warning(f"WebSocket disconnected unexpectedly: {websocket.client}")
             await manager.disconnect(websocket)
@@ -337,15 +277,77 @@ async def websocket_endpoint(websocket: WebSocket):
             logging.error(f"Failed to send message to {websocket.client}: {e}")
             await manager.disconnect(websocket)
 
+    async def reply(payload):
+        """
+        Replies to the current message. If it carried an "id", the reply is a JSON object
+        echoing it (text replies go under "message"), so clients can pipeline requests.
+        """
+        if request_id is not None:
+            payload = {"id": request_id, **payload} if isinstance(payload, dict) else {"id": request_id, "message": payload}
+        await safe_send(websocket, payload if isinstance(payload, str) else json.dumps(payload))
+
+    async def handle_frame(frame: bytes):
+        """
+        Handles a binary frame (see wire.py). Only adds are carried this way; they get the
+        same validation, processing and error text as a JSON 'add', replied as an ACK,
+        FILLS or ERROR frame with the request's correlation id.
+        """
+        correlation_id = 0
+        try:
+            message_type, correlation_id = wire.read_header(frame)
+            if message_type != wire.ADD:
+                raise wire.WireError(f"Unsupported message type {message_type}")
+            order_data = wire.decode_add(frame)
+        except wire.WireError as e:
+            await safe_send(websocket, wire.encode_error(correlation_id, f"Error: {e}"))
+            logging.warning(f"Malformed binary frame from {websocket.client}: {e}")
+            return
+        try:
+            order = parse_order(order_data)
+        except ValidationError as e:
+            error_details = e.errors()
+            await safe_send(websocket, wire.encode_error(correlation_id, f"Error: Invalid order data. {error_details}"))
+            logging.warning(f"Validation error for order data from {websocket.client}: {error_details}")
+            return
+        try:
+            matched_orders = await order_book_manager.add_order(order)
+        except Exception as e:
+            await safe_send(websocket, wire.encode_error(correlation_id, f"Error processing order: {str(e)}"))
+            logging.error(f"Error processing order from {websocket.client}: {e}")
+            return
+        if matched_orders:
+            broadcast_fills(matched_orders)
+            try:
+                reply_frame = wire.encode_fills(correlation_id, order.order_id, matched_orders)
+            except wire.WireError as e:
+                logging.error(f"Could not encode fills of order {order.order_id} for {websocket.client}: {e}")
+                reply_frame = wire.encode_error(correlation_id, f"Order {order.order_id} was added, "
+                                                                f"but its fills could not be encoded: {e}")
+            await safe_send(websocket, reply_frame)
+        else:
+            await safe_send(websocket, wire.encode_ack(correlation_id, order.order_id))
+
     try:
         while True:
+            request_id = None
             try:
-                data = await websocket.receive_text()
-                message = json.loads(data)
-                logging.debug(f"Received message: {message}")
+                frame = await websocket.receive()
+                received = time.perf_counter()
+                if frame["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(frame.get("code", 1000))
+                if frame.get("bytes") is not None:
+                    if connection.binary:
+                        await handle_frame(frame["bytes"])
+                        observe_ws_request("add_binary", received)
+                    else:
+                        await reply(f"Error: Binary frames need the {wire.SUBPROTOCOL} subprotocol.")
+                    continue
+                message = json_loads(frame["text"])
+                hot_logger.debug("Received message: %s", message)
+                request_id = message.get("id")
             except json.JSONDecodeError:
                 error_msg = "Error: Invalid JSON format."
-                await safe_send_text(websocket, error_msg)
+                await reply(error_msg)
                 logging.warning(f"Invalid JSON received from {websocket.client}")
                 continue
             except WebSocketDisconnect:
@@ -353,87 +355,204 @@ async def websocket_endpoint(websocket: WebSocket):
                 break  # Exit the loop if the client disconnects
             except Exception as e:
                 error_msg = f"Error receiving data: {str(e)}"
-                await safe_send_text(websocket, error_msg)
+                await reply(error_msg)
                 logging.error(f"Error receiving data from {websocket.client}: {e}")
                 continue
 
-            command = message.get("command")
-            if not command:
-                error_msg = "Error: Missing command."
-                await safe_send_text(websocket, error_msg)
-                logging.warning(f"Missing command in message from {websocket.client}")
-                continue
-
-            if command == "add":
-                order_data = message.get("order")
-                if not order_data:
-                    error_msg = "Error: Missing order data."
-                    await safe_send_text(websocket, error_msg)
-                    logging.warning(f"Missing order data in 'add' command from {websocket.client}")
-                    continue
-                try:
-                    order = Order(**order_data)
-                    logging.info(f"Adding order: {order}")
-                except ValidationError as e:
-                    error_details = e.errors()
-                    error_msg = f"Error: Invalid order data. {error_details}"
-                    await safe_send_text(websocket, error_msg)
-                    logging.warning(f"Validation error for order data from {websocket.client}: {error_details}")
+            try:
+                command = message.get("command")
+                if not command:
+                    error_msg = "Error: Missing command."
+                    await reply(error_msg)
+                    logging.warning(f"Missing command in message from {websocket.client}")
                     continue
 
-                try:
-                    matched_orders = await order_book_manager.add_order(order)
-                    if matched_orders:
-                        broadcast_msg = json.dumps({"matched_orders": matched_orders})
-                        await manager.broadcast(broadcast_msg)
-                        logging.info(f"Broadcasted matched orders for ticker {order.ticker}")
+                if command == "add":
+                    order_data = message.get("order")
+                    if not order_data:
+                        error_msg = "Error: Missing order data."
+                        await reply(error_msg)
+                        logging.warning(f"Missing order data in 'add' command from {websocket.client}")
+                        continue
+                    try:
+                        order = parse_order(order_data)
+                    except ValidationError as e:
+                        error_details = e.errors()
+                        error_msg = f"Error: Invalid order data. {error_details}"
+                        await reply(error_msg)
+                        logging.warning(f"Validation error for order data from {websocket.client}: {error_details}")
+                        continue
+
+                    try:
+                        matched_orders = await order_book_manager.add_order(order)
+                        if matched_orders:
+                            broadcast_fills(matched_orders)
+                            hot_logger.info("Broadcasted matched orders for ticker %s", order.ticker)
+                            if request_id is not None:
+                                # The broadcast carries no id, so tagged requests also get a direct reply
+                                await reply({"order_id": order.order_id, "matched_orders": matched_orders})
+                        else:
+                            success_msg = "Order added to the order book."
+                            if request_id is not None:
+                                await reply({"message": success_msg, "order_id": order.order_id})
+                            else:
+                                # Untagged clients get the plain-text ack they always have
+                                await reply(success_msg)
+                            hot_logger.info("Order added to the book without matches for ticker %s", order.ticker)
+                    except Exception as e:
+                        error_msg = f"Error processing order: {str(e)}"
+                        await reply(error_msg)
+                        logging.error(f"Error processing order from {websocket.client}: {e}")
+
+                elif command == "add_batch":
+                    orders_data = message.get("orders")
+                    if not orders_data or not isinstance(orders_data, list):
+                        error_msg = "Error: Missing orders."
+                        await reply(error_msg)
+                        logging.warning(f"Missing orders in 'add_batch' command from {websocket.client}")
+                        continue
+                    if len(orders_data) > max_batch_orders:
+                        error_msg = f"Error: Batch of {len(orders_data)} orders exceeds the limit of {max_batch_orders}."
+                        await reply(error_msg)
+                        logging.warning(f"Oversized batch of {len(orders_data)} orders from {websocket.client}")
+                        continue
+                    try:
+                        # All or nothing: one invalid order rejects the whole batch
+                        orders = parse_orders(orders_data)
+                    except ValidationError as e:
+                        error_details = e.errors()
+                        error_msg = f"Error: Invalid order data. {error_details}"
+                        await reply(error_msg)
+                        logging.warning(f"Validation error for batch from {websocket.client}: {error_details}")
+                        continue
+
+                    try:
+                        results = await order_book_manager.add_orders(orders)
+                        matched_orders = [fill for fills in results for fill in fills]
+                        if matched_orders:
+                            # One fill report for the whole batch
+                            broadcast_fills(matched_orders)
+                            hot_logger.info("Broadcasted %d matched orders for a batch of %d", len(matched_orders), len(orders))
+                        await reply({"accepted": len(orders), "order_ids": [order.order_id for order in orders],
+                                     "fills": [len(fills) for fills in results]})
+                    except Exception as e:
+                        error_msg = f"Error processing batch: {str(e)}"
+                        await reply(error_msg)
+                        logging.error(f"Error processing batch from {websocket.client}: {e}")
+
+                elif command in ("cancel", "replace"):
+                    ticker = message.get("ticker")
+                    order_id = message.get("order_id")
+                    if not ticker or not isinstance(order_id, int) or isinstance(order_id, bool):
+                        error_msg = "Error: Missing ticker symbol or order id."
+                        await reply(error_msg)
+                        logging.warning(f"Missing ticker or order id in '{command}' command from {websocket.client}")
+                        continue
+                    try:
+                        if command == "cancel":
+                            cancelled = await order_book_manager.cancel_order(ticker, order_id)
+                            if cancelled is None:
+                                await reply(f"Error: No resting order {order_id} for {ticker}.")
+                            else:
+                                await reply({"cancelled": cancelled})
+                            continue
+                        price, quantity = message.get("price"), message.get("quantity")
+                        if (price is None and quantity is None
+                                or price is not None and (not isinstance(price, (int, float)) or isinstance(price, bool))
+                                or quantity is not None and (not isinstance(quantity, int) or isinstance(quantity, bool))):
+                            await reply("Error: Replace needs a numeric price and/or an integer quantity.")
+                            continue
+                        replaced = await order_book_manager.replace_order(ticker, order_id, price=price, quantity=quantity)
+                        if replaced is None:
+                            await reply(f"Error: No resting order {order_id} for {ticker}.")
+                            continue
+                        new_order_id, matched_orders = replaced
+                        if matched_orders:
+                            broadcast_fills(matched_orders)
+                        await reply({"order_id": new_order_id, "matched_orders": matched_orders})
+                    except Exception as e:
+                        error_msg = f"Error processing {command}: {str(e)}"
+                        await reply(error_msg)
+                        logging.error(f"Error processing {command} from {websocket.client}: {e}")
+
+                elif command == "check":
+                    ticker = message.get("ticker")
+                    if not ticker:
+                        error_msg = "Error: Missing ticker symbol."
+                        await reply(error_msg)
+                        logging.warning(f"Missing ticker symbol in 'check' command from {websocket.client}")
+                        continue
+                    depth = message.get("depth")
+                    if depth is not None and (not isinstance(depth, int) or isinstance(depth, bool) or depth <= 0):
+                        error_msg = "Error: Depth must be a positive integer."
+                        await reply(error_msg)
+                        logging.warning(f"Invalid depth {depth!r} in 'check' command from {websocket.client}")
+                        continue
+                    try:
+                        if depth is None:
+                            order_book_snapshot = await order_book_manager.get_order_book_snapshot(ticker)
+                        else:
+                            # Price-aggregated top-of-book view instead of every resting order
+                            order_book_snapshot = await order_book_manager.get_depth_snapshot(ticker, depth)
+                        await reply(order_book_snapshot)
+                        hot_logger.info("Sent order book snapshot for ticker %s to %s", ticker, websocket.client)
+                    except Exception as e:
+                        error_msg = f"Error retrieving order book: {str(e)}"
+                        await reply(error_msg)
+                        logging.error(f"Error retrieving order book for {ticker}: {e}")
+
+                elif command == "subscribe":
+                    ticker = message.get("ticker")
+                    if not ticker:
+                        error_msg = "Error: Missing ticker symbol."
+                        await reply(error_msg)
+                        logging.warning(f"Missing ticker symbol in 'subscribe' command from {websocket.client}")
+                        continue
+                    try:
+                        # Replies with a depth snapshot, followed by depth updates as the book changes
+                        await depth_feed.subscribe(websocket, ticker, order_book_manager.get_depth_snapshot, request_id)
+                    except Exception as e:
+                        error_msg = f"Error subscribing to order book: {str(e)}"
+                        await reply(error_msg)
+                        logging.error(f"Error subscribing to {ticker}: {e}")
+
+                elif command == "unsubscribe":
+                    ticker = message.get("ticker")
+                    if not ticker:
+                        error_msg = "Error: Missing ticker symbol."
+                        await reply(error_msg)
+                        logging.warning(f"Missing ticker symbol in 'unsubscribe' command from {websocket.client}")
+                        continue
+                    if depth_feed.unsubscribe(websocket, ticker):
+                        await reply(f"Unsubscribed from {ticker}.")
                     else:
-                        success_msg = "Order added to the order book."
-                        await safe_send_text(websocket, success_msg)
-                        logging.info(f"Order added to the book without matches for ticker {order.ticker}")
-                except Exception as e:
-                    error_msg = f"Error processing order: {str(e)}"
-                    await safe_send_text(websocket, error_msg)
-                    logging.error(f"Error processing order from {websocket.client}: {e}")
-
-            elif command == "check":
-                ticker = message.get("ticker")
-                if not ticker:
-                    error_msg = "Error: Missing ticker symbol."
-                    await safe_send_text(websocket, error_msg)
-                    logging.warning(f"Missing ticker symbol in 'check' command from {websocket.client}")
-                    continue
-                try:
-                    order_book_snapshot = await order_book_manager.get_order_book_snapshot(ticker)
-                    await safe_send_text(websocket, json.dumps(order_book_snapshot))
-                    logging.info(f"Sent order book snapshot for ticker {ticker} to {websocket.client}")
-                except Exception as e:
-                    error_msg = f"Error retrieving order book: {str(e)}"
-                    await safe_send_text(websocket, error_msg)
-                    logging.error(f"Error retrieving order book for {ticker}: {e}")
-
-            elif command == "list_tickers":
-                try:
-                    tickers = await order_book_manager.list_tickers()
-                    await safe_send_text(websocket, json.dumps({"tickers": tickers}))
-                    logging.info(f"Sent list of tickers to {websocket.client}")
-                except Exception as e:
-                    error_msg = f"Error listing tickers: {str(e)}"
-                    await safe_send_text(websocket, error_msg)
-                    logging.error(f"Error listing tickers: {e}")
+                        await reply(f"Error: Not subscribed to {ticker}.")
+
+                elif command == "list_tickers":
+                    try:
+                        tickers = await order_book_manager.list_tickers()
+                        await reply({"tickers": tickers})
+                        hot_logger.info("Sent list of tickers to %s", websocket.client)
+                    except Exception as e:
+                        error_msg = f"Error listing tickers: {str(e)}"
+                        await reply(error_msg)
+                        logging.error(f"Error listing tickers: {e}")
 
-            else:
-                error_msg = "Error: Invalid command."
-                await safe_send_text(websocket, error_msg)
-                logging.warning(f"Invalid command received from {websocket.client}: {command}")
+                else:
+                    error_msg = "Error: Invalid command."
+                    await reply(error_msg)
+                    logging.warning(f"Invalid command received from {websocket.client}: {command}")
+            finally:
+                observe_ws_request(command, received)
 
     except WebSocketDisconnect:
         logging.info(f"Client {websocket.client} disconnected.")
     except Exception as e:
         logging.error(f"Unexpected error with {websocket.client}: {e}")
-        await safe_send_text(websocket, f"Error: {str(e)}")
+        await safe_send(websocket, f"Error: {str(e)}")
     finally:
+        depth_feed.unsubscribe_all(websocket)
         await manager.disconnect(websocket)
         # Ensure the WebSocket is closed only if it's still open
-        if websocket.client_state.value == "connected":
+        if websocket.client_state == WebSocketState.CONNECTED:
             await websocket.close()
\ No newline at end of file
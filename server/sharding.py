@@ -0,0 +1,366 @@
+import os
+import zlib
+import queue
+import logging
+import asyncio
+import functools
+import itertools
+import threading
+import multiprocessing
+from multiprocessing.reduction import ForkingPickler
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from engine import Order, OrderBookManager, OrderType, price_to_ticks, resolve_db_path
+from log_config import configure_logging
+
+# Sharded matching: tickers are hash-partitioned across worker processes, each running its
+# own OrderBookManager on its own event loop (and core). The front end talks to the workers
+# over duplex pipes, so one ticker always lands on the same worker and its orders are
+# handled strictly in the order they were sent.
+
+def shard_for_ticker(ticker: str, num_shards: int) -> int:
+    """
+    Stable ticker -> shard mapping (unlike hash(), crc32 is not randomized per process).
+    """
+    return zlib.crc32(ticker.encode()) % num_shards
+
+# Sentinel queued to stop a pipe writer
+_STOP = object()
+
+# Sends messages on one end of a pipe from a dedicated thread, in the order they were
+# sent. Connection.send blocks while the pipe is full; on an event loop that would stop it
+# reading the other direction, and two loops doing it at once would deadlock.
+class _PipeWriter:
+    def __init__(self, conn, name: str):
+        self._conn = conn
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def send(self, message):
+        """
+        Queues a message without blocking. It is pickled here, so a message that can't be
+        pickled raises to the caller as with Connection.send.
+        """
+        self._queue.put(ForkingPickler.dumps(message))
+
+    def close(self):
+        """
+        Waits for every queued message to be written.
+        """
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is _STOP:
+                return
+            try:
+                self._conn.send_bytes(data)
+            except OSError as e:
+                # The other end is gone; its reader sees EOF and fails whatever is pending
+                logging.error(f"Failed to write to shard pipe: {e}")
+                return
+
+def _shard_worker(shard_id: int, conn, manager_kwargs: Dict):
+    """
+    Entry point of a matching worker process.
+    """
+    asyncio.run(_serve_shard(shard_id, conn, manager_kwargs))
+
+async def _serve_shard(shard_id: int, conn, manager_kwargs: Dict):
+    # A spawned worker starts with default logging
+    configure_logging()
+
+    if manager_kwargs.get('journal_dir'):
+        # Each shard journals only its own tickers, so the shard count must stay the same across restarts
+        manager_kwargs = dict(manager_kwargs, journal_dir=os.path.join(manager_kwargs['journal_dir'], f"shard-{shard_id}"))
+    manager = OrderBookManager(**manager_kwargs)
+    writer = _PipeWriter(conn, f"shard-{shard_id}-writer")
+    # Depth updates are pushed to the front end unsolicited, without a request id
+    manager.on_depth_update = lambda update: writer.send((None, True, update))
+    await manager.start()
+    loop = asyncio.get_running_loop()
+    stopped = loop.create_future()
+    # One queue and consumer per ticker keeps each ticker strictly ordered while letting
+    # different tickers on this shard make progress concurrently
+    ticker_queues: Dict[str, asyncio.Queue] = {}
+    consumers: List[asyncio.Task] = []
+
+    def reply(request_id: int, ok: bool, result):
+        try:
+            writer.send((request_id, ok, result))
+        except Exception as e:
+            # Results or exceptions that can't be pickled are reported by message instead
+            error = RuntimeError(str(result) if not ok else f"Could not return shard result: {e}")
+            writer.send((request_id, False, error))
+
+    async def run(request_id: int, coro):
+        try:
+            reply(request_id, True, await coro)
+        except Exception as e:
+            reply(request_id, False, e)
+
+    async def consume(queue: asyncio.Queue):
+        while True:
+            future, operation = await queue.get()
+            try:
+                future.set_result(await operation())
+            except Exception as e:
+                future.set_exception(e)
+            queue.task_done()
+
+    def enqueue(ticker: str, operation: Callable[[], Awaitable]) -> asyncio.Future:
+        """
+        Queues an operation on one ticker behind everything already queued for it.
+        """
+        queue = ticker_queues.get(ticker)
+        if queue is None:
+            queue = ticker_queues[ticker] = asyncio.Queue()
+            consumers.append(loop.create_task(consume(queue)))
+        future = loop.create_future()
+        queue.put_nowait((future, operation))
+        return future
+
+    async def add_orders(orders_data: List[Dict], durable: bool) -> List[Tuple[int, List[Dict]]]:
+        # Already validated by the front end, so skip pydantic validation here
+        orders = [Order.model_construct(**order_data) for order_data in orders_data]
+        results = await manager.add_orders(orders, durable=durable)
+        # The front end's copies of the orders need the ids assigned here
+        return [(order.order_id, matched_orders) for order, matched_orders in zip(orders, results)]
+
+    def add_batch(orders_data: List[Dict], durable: bool):
+        """
+        Queues a batch split by ticker right away, so every order keeps its arrival order
+        within its ticker. Returns a coroutine collecting (order id, fills) in batch order.
+        """
+        by_ticker: Dict[str, List[int]] = {}
+        for index, order_data in enumerate(orders_data):
+            by_ticker.setdefault(order_data['ticker'], []).append(index)
+        futures = []
+        for ticker, indexes in by_ticker.items():
+            operation = functools.partial(add_orders, [orders_data[index] for index in indexes], durable)
+            futures.append((indexes, enqueue(ticker, operation)))
+
+        async def collect():
+            results = [None] * len(orders_data)
+            fills = await asyncio.gather(*[future for _, future in futures])
+            for (indexes, _), ticker_fills in zip(futures, fills):
+                for index, matched_orders in zip(indexes, ticker_fills):
+                    results[index] = matched_orders
+            return results
+        return collect()
+
+    def on_readable():
+        while conn.poll():
+            try:
+                request_id, op, args = conn.recv()
+            except EOFError:
+                if not stopped.done():
+                    stopped.set_result(None)
+                return
+            if op == 'add_batch':
+                orders_data, durable = args
+                loop.create_task(run(request_id, add_batch(orders_data, durable)))
+            elif op == 'cancel':
+                ticker, order_id, durable = args
+                operation = functools.partial(manager.cancel_order, ticker, order_id, durable=durable)
+                loop.create_task(run(request_id, enqueue(ticker, operation)))
+            elif op == 'replace':
+                ticker, order_id, price, quantity, durable = args
+                operation = functools.partial(manager.replace_order, ticker, order_id, price=price,
+                                              quantity=quantity, durable=durable)
+                loop.create_task(run(request_id, enqueue(ticker, operation)))
+            elif op == 'snapshot':
+                loop.create_task(run(request_id, manager.get_order_book_snapshot(*args)))
+            elif op == 'depth':
+                loop.create_task(run(request_id, manager.get_depth_snapshot(*args)))
+            elif op == 'list_tickers':
+                loop.create_task(run(request_id, manager.list_tickers()))
+            elif op == 'close':
+                if not stopped.done():
+                    stopped.set_result(request_id)
+            else:
+                reply(request_id, False, ValueError(f"Unknown shard operation: {op}"))
+
+    loop.add_reader(conn.fileno(), on_readable)
+    logging.info(f"Matching shard {shard_id} started")
+    request_id = await stopped
+    loop.remove_reader(conn.fileno())
+    for queue in ticker_queues.values():
+        await queue.join()
+    for consumer in consumers:
+        consumer.cancel()
+    await manager.close()
+    if request_id is not None:
+        reply(request_id, True, None)
+    await loop.run_in_executor(None, writer.close)
+    conn.close()
+
+# Front-end manager exposing the OrderBookManager interface over a pool of shard workers
+class ShardedOrderBookManager:
+    def __init__(self, num_shards: int, **manager_kwargs):
+        if num_shards < 1:
+            raise ValueError(f"Number of shards must be at least 1, got {num_shards}")
+        self.num_shards = num_shards
+        self.manager_kwargs = manager_kwargs
+        # Every shard's trade writer shares this database
+        self.db_path = resolve_db_path(manager_kwargs.get('db_name', 'data.db'))
+        self._processes: List[multiprocessing.Process] = []
+        self._connections = []
+        self._writers: List[_PipeWriter] = []
+        # Request id -> (shard, future) for every request awaiting its reply
+        self._pending: Dict[int, Tuple[int, asyncio.Future]] = {}
+        self._dead_shards: Set[int] = set()
+        self._request_ids = itertools.count()
+        self._start_lock = asyncio.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._closing = False
+        self.on_depth_update: Optional[Callable[[Dict], None]] = None
+
+    async def start(self):
+        """
+        Spawns the worker processes. Called lazily on first use; idempotent.
+        """
+        async with self._start_lock:
+            if self._processes:
+                return
+            self._loop = asyncio.get_running_loop()
+            context = multiprocessing.get_context('spawn')
+            for shard_id in range(self.num_shards):
+                parent_conn, child_conn = context.Pipe(duplex=True)
+                process = context.Process(
+                    target=_shard_worker,
+                    args=(shard_id, child_conn, self.manager_kwargs),
+                    name=f"matching-shard-{shard_id}",
+                    daemon=True
+                )
+                process.start()
+                child_conn.close()
+                self._loop.add_reader(parent_conn.fileno(), self._on_readable, shard_id, parent_conn)
+                self._processes.append(process)
+                self._connections.append(parent_conn)
+                self._writers.append(_PipeWriter(parent_conn, f"shard-{shard_id}-sender"))
+            logging.info(f"Started {self.num_shards} matching shards")
+
+    def _on_readable(self, shard: int, conn):
+        while conn.poll():
+            try:
+                request_id, ok, result = conn.recv()
+            except (EOFError, OSError):
+                self._loop.remove_reader(conn.fileno())
+                self._shard_exited(shard)
+                return
+            if request_id is None:
+                if self.on_depth_update is not None:
+                    self.on_depth_update(result)
+                continue
+            _, future = self._pending.pop(request_id, (None, None))
+            if future is None or future.done():
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+
+    def _shard_exited(self, shard: int):
+        """
+        Fails every request still waiting on a shard whose pipe has closed; no reply can
+        come for them. Later requests to it fail straight away.
+        """
+        self._dead_shards.add(shard)
+        if not self._closing:
+            logging.error(f"Matching shard {shard} exited unexpectedly")
+        error = ConnectionError(f"Matching shard {shard} exited")
+        for request_id, (request_shard, future) in list(self._pending.items()):
+            if request_shard == shard:
+                del self._pending[request_id]
+                if not future.done():
+                    future.set_exception(error)
+
+    async def _call(self, shard: int, op: str, *args):
+        if not self._processes:
+            await self.start()
+        if shard in self._dead_shards:
+            raise ConnectionError(f"Matching shard {shard} exited")
+        request_id = next(self._request_ids)
+        future = self._loop.create_future()
+        self._pending[request_id] = (shard, future)
+        try:
+            self._writers[shard].send((request_id, op, args))
+        except Exception:
+            del self._pending[request_id]
+            raise
+        return await future
+
+    def shard_for(self, ticker: str) -> int:
+        return shard_for_ticker(ticker, self.num_shards)
+
+    async def add_order(self, order, durable: bool = False):
+        results = await self.add_orders([order], durable=durable)
+        return results[0]
+
+    async def add_orders(self, orders: List, durable: bool = False) -> List[List[Dict]]:
+        """
+        Sends each shard its part of the batch as one message. Every price is checked here
+        first, as OrderBookManager.add_orders does, so an invalid order rejects the whole
+        batch before any shard changes.
+        """
+        tick_sizes = self.manager_kwargs.get('tick_sizes') or {}
+        default_tick_size = self.manager_kwargs.get('default_tick_size', 0.01)
+        for order in orders:
+            if order.order_type == OrderType.LIMIT:
+                price_to_ticks(order.price, tick_sizes.get(order.ticker, default_tick_size), order.ticker)
+        by_shard: Dict[int, List[int]] = {}
+        for index, order in enumerate(orders):
+            by_shard.setdefault(self.shard_for(order.ticker), []).append(index)
+        replies = await asyncio.gather(*[
+            self._call(shard, 'add_batch', [orders[index].model_dump() for index in indexes], durable)
+            for shard, indexes in by_shard.items()
+        ])
+        results: List[List[Dict]] = [[] for _ in orders]
+        for indexes, fills in zip(by_shard.values(), replies):
+            for index, (order_id, matched_orders) in zip(indexes, fills):
+                orders[index].order_id = order_id
+                results[index] = matched_orders
+        return results
+
+    async def cancel_order(self, ticker: str, order_id: int, durable: bool = False) -> Optional[Dict]:
+        return await self._call(self.shard_for(ticker), 'cancel', ticker, order_id, durable)
+
+    async def replace_order(self, ticker: str, order_id: int, price: Optional[float] = None,
+                            quantity: Optional[int] = None, durable: bool = False) -> Optional[Tuple[int, List[Dict]]]:
+        return await self._call(self.shard_for(ticker), 'replace', ticker, order_id, price, quantity, durable)
+
+    async def list_tickers(self):
+        results = await asyncio.gather(*[self._call(shard, 'list_tickers') for shard in range(self.num_shards)])
+        return [ticker for tickers in results for ticker in tickers]
+
+    async def get_order_book_snapshot(self, ticker: str):
+        return await self._call(self.shard_for(ticker), 'snapshot', ticker)
+
+    async def get_depth_snapshot(self, ticker: str, depth: Optional[int] = None):
+        return await self._call(self.shard_for(ticker), 'depth', ticker, depth)
+
+    async def close(self):
+        """
+        Drains every shard, waits for its trades to be committed and stops the workers.
+        """
+        if not self._processes:
+            return
+        self._closing = True
+        live_shards = [shard for shard in range(self.num_shards) if shard not in self._dead_shards]
+        # A shard that dies while draining is already reported by _shard_exited
+        await asyncio.gather(*[self._call(shard, 'close') for shard in live_shards], return_exceptions=True)
+        for writer in self._writers:
+            await self._loop.run_in_executor(None, writer.close)
+        for conn in self._connections:
+            self._loop.remove_reader(conn.fileno())
+            conn.close()
+        for process in self._processes:
+            process.join(timeout=5)
+        self._processes, self._connections, self._writers = [], [], []
+        self._dead_shards.clear()
+        self._closing = False
+        logging.info("Stopped matching shards")
@@ -1,46 +1,26 @@
-import pika
-import json
 import logging
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI
+
+from transport import create_transport
 
 app = FastAPI()
 
 # Setup basic logging
 logging.basicConfig(level=logging.INFO)
 
-# Function to get RabbitMQ connection
-def get_rabbitmq_connection():
-    try:
-        connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
-        channel = connection.channel()
-        channel.queue_declare(queue='trade_execution', durable=True)
-        return connection, channel
-    except pika.exceptions.AMQPConnectionError as e:
-        logging.error(f"Failed to connect to RabbitMQ: {e}")
-        raise HTTPException(status_code=500, detail="Could not connect to message broker")
+# Backend picked by TINYTRADER_TRANSPORT, see transport.py
+transport = create_transport()
 
 # Function to process trade executions
-def execute_trade(ch, method, properties, body):
-    trade = json.loads(body)
-    print(f" [x] Executing trade: {trade}")
+async def execute_trade(trade: dict):
+    logging.debug("Executing trade: %s", trade)
     # Add logic to update user balances, etc.
-    ch.basic_ack(delivery_tag=method.delivery_tag)
-
-# Start the trade execution service
-def start_trade_execution_service():
-    try:
-        connection, channel = get_rabbitmq_connection()
-        channel.basic_consume(queue='trade_execution', on_message_callback=execute_trade)
-        print(' [*] Waiting to execute trades. To exit press CTRL+C')
-        channel.start_consuming()
-    except Exception as e:
-        logging.error(f"Error in trade execution service: {e}")
-    finally:
-        try:
-            channel.close()
-            connection.close()
-        except Exception as close_err:
-            logging.error(f"Error closing RabbitMQ connection: {close_err}")
+
+@app.on_event("startup")
+async def startup_event():
+    await transport.start()
+    await transport.consume('trade_execution', execute_trade)
+    logging.info("Waiting to execute trades")
 
 @app.get("/")
 def read_root():
@@ -50,7 +30,8 @@ def read_root():
 @app.on_event("shutdown")
 async def shutdown_event():
     logging.info("Shutting down Trade Execution Service...")
-    # Add any necessary cleanup logic here
+    await transport.close()
 
 if __name__ == "__main__":
-    start_trade_execution_service()
\ No newline at end of file
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=8003)
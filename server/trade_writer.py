@@ -0,0 +1,101 @@
+import time
+import logging
+import asyncio
+from typing import Dict, List, Tuple
+
+from metrics import registry
+from history import HistoryTable
+from batch_writer import GroupCommitWriter
+
+trades_persisted_total = registry.counter('tinytrader_trades_persisted', 'Cleared trades committed to the database')
+trade_persist_seconds = registry.histogram('tinytrader_trade_persist_seconds',
+                                           'Time from queueing a cleared trade to its group commit')
+
+CREATE_CLEARED_TRADES = '''
+    CREATE TABLE IF NOT EXISTS cleared_trades (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ticker TEXT NOT NULL,
+        order_type TEXT NOT NULL,
+        price REAL NOT NULL,
+        quantity INTEGER NOT NULL,
+        cleared_at TEXT NOT NULL,
+        filler_user_id TEXT NOT NULL,
+        filled_user_id TEXT NOT NULL
+    )
+'''
+
+# Query view of cleared_trades; the writer creates its indexes with the table
+CLEARED_TRADES = HistoryTable('cleared_trades', ('ticker', 'order_type', 'price', 'quantity', 'cleared_at',
+                                                 'filler_user_id', 'filled_user_id'),
+                              time_column='cleared_at', user_columns=('filler_user_id', 'filled_user_id'))
+
+# The table and its indexes, created by the writer on start
+CLEARED_TRADES_SCHEMA = (CREATE_CLEARED_TRADES, *CLEARED_TRADES.index_statements())
+
+INSERT_CLEARED_TRADE = '''
+    INSERT INTO cleared_trades (ticker, order_type, price, quantity, cleared_at, filler_user_id, filled_user_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+# Group-commit writer for the cleared_trades table
+class TradeWriter(GroupCommitWriter):
+    """
+    Persists cleared trades. Fills are queued without blocking the matching loop and
+    flushed in group commits; each submitted trade gets a future that resolves to its row
+    id once committed.
+    """
+
+    name = "Trade writer"
+
+    def __init__(self, db_path: str, max_batch_size: int = 500, max_delay: float = 0.002):
+        super().__init__(db_path, schema=CLEARED_TRADES_SCHEMA, max_batch_size=max_batch_size,
+                         max_delay=max_delay, pragmas=('PRAGMA journal_mode=WAL',))
+
+    def submit(self, ticker: str, order_type: str, price: float, quantity: int,
+               filler_user_id: str, filled_user_id: str) -> asyncio.Future:
+        """
+        Queues a cleared trade for the next group commit. Never blocks.
+        Returns a future resolving to the trade's row id once the commit is durable.
+        """
+        row = (ticker, order_type, price, quantity, time.strftime('%Y-%m-%d %H:%M:%S'), filler_user_id, filled_user_id)
+        return self._enqueue((row, time.perf_counter(), asyncio.get_running_loop().create_future()))
+
+    async def fetch_trades(self, trade_ids: List[int]) -> Dict[int, Tuple]:
+        """
+        Looks trades up by row id (the INTEGER PRIMARY KEY index) on the writer connection.
+        Returns {id: (ticker, price, quantity, filler_user_id, filled_user_id)}.
+        """
+        if not trade_ids:
+            return {}
+        placeholders = ','.join('?' * len(trade_ids))
+        query = f'''
+            SELECT id, ticker, price, quantity, filler_user_id, filled_user_id
+            FROM cleared_trades WHERE id IN ({placeholders})
+        '''
+        async with self._db.execute(query, trade_ids) as cursor:
+            rows = await cursor.fetchall()
+        return {row[0]: tuple(row[1:]) for row in rows}
+
+    async def _write_batch(self, batch: List):
+        try:
+            await self._db.executemany(INSERT_CLEARED_TRADE, [row for row, _, _ in batch])
+            # A single writer inserting inside one transaction gets consecutive row ids
+            async with self._db.execute('SELECT last_insert_rowid()') as cursor:
+                (last_id,) = await cursor.fetchone()
+            await self._db.commit()
+        except Exception as e:
+            logging.error(f"Failed to persist {len(batch)} cleared trades: {e}")
+            await self._rollback()
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+                    future.exception()  # Already logged above; don't warn again if nobody awaits it
+            return
+        first_id = last_id - len(batch) + 1
+        committed = time.perf_counter()
+        for offset, (_, queued, future) in enumerate(batch):
+            trade_persist_seconds.observe(committed - queued)
+            if not future.done():
+                future.set_result(first_id + offset)
+        trades_persisted_total.inc(len(batch))
+        logging.debug("Committed %d cleared trades", len(batch))
@@ -0,0 +1,160 @@
+import math
+import struct
+from typing import Dict, List, Optional, Tuple
+
+# Compact binary encoding for the hot /ws messages: adds, their acks and fills.
+#
+# A client opts in by asking for the SUBPROTOCOL when it opens the WebSocket; the server
+# then accepts binary frames for adds and sends acks, fills and errors back as binary
+# frames. Every other command stays a JSON text frame on the same connection.
+#
+# Every frame starts with <message type u8><correlation id u32>. Requests carry an id
+# chosen by the client, which is echoed on the reply; unsolicited frames (fill
+# broadcasts) use id 0. Strings are <length u8 or u16><utf-8 bytes>; integers are
+# little-endian. Tickers and user ids longer than 255 bytes are rejected by Order
+# validation, so every accepted order's fills can be encoded.
+#
+#   ADD    <side u8><order type u8><quantity i64><price f64, NaN for market><ticker s8><user_id s8>
+#   ACK    <order id i64>                     the order rested without trading
+#   FILLS  <order id i64><count u32>, then per fill:
+#          <kind u8><price f64><quantity i64><order id i64><order id i64><timestamp f64><user_id s8><user_id s8>
+#          kind 0 lists buy then sell (limit cross); kind 1 lists maker then taker (market order)
+#   ERROR  <message s16>
+
+SUBPROTOCOL = 'tinytrader.v1'
+
+ADD = 1
+ACK = 2
+FILLS = 3
+ERROR = 4
+
+_HEADER = struct.Struct('<BI')
+_ADD = struct.Struct('<BBqd')
+_ACK = struct.Struct('<q')
+_FILLS = struct.Struct('<qI')
+_FILL = struct.Struct('<Bdqqqd')
+_U8 = struct.Struct('<B')
+_U16 = struct.Struct('<H')
+
+SIDES = ('buy', 'sell')
+ORDER_TYPES = ('limit', 'market')
+LIMIT_FILL = 0
+MARKET_FILL = 1
+
+# Raised for frames that can't be decoded; the message is safe to send back to the client
+class WireError(ValueError):
+    pass
+
+def _pack_str(value: str, length: struct.Struct = _U8) -> bytes:
+    data = value.encode()
+    if len(data) >= 1 << (8 * length.size):
+        raise WireError(f"String too long for the wire format: {value[:32]!r}")
+    return length.pack(len(data)) + data
+
+def _unpack_str(frame: bytes, offset: int, length: struct.Struct = _U8) -> Tuple[str, int]:
+    (size,) = length.unpack_from(frame, offset)
+    offset += length.size
+    if offset + size > len(frame):
+        raise WireError("Truncated string")
+    return frame[offset:offset + size].decode(), offset + size
+
+def read_header(frame: bytes) -> Tuple[int, int]:
+    """
+    Returns (message type, correlation id).
+    """
+    if len(frame) < _HEADER.size:
+        raise WireError("Frame shorter than its header")
+    return _HEADER.unpack_from(frame)
+
+def encode_add(correlation_id: int, order: Dict) -> bytes:
+    price = order.get('price')
+    return (_HEADER.pack(ADD, correlation_id)
+            + _ADD.pack(SIDES.index(order['side']), ORDER_TYPES.index(order['order_type']), order['quantity'],
+                        math.nan if price is None else price)
+            + _pack_str(order['ticker']) + _pack_str(order['user_id']))
+
+def decode_add(frame: bytes) -> Dict:
+    """
+    Decodes an ADD frame into the same dict a JSON 'add' carries, so it goes through the
+    same validation.
+    """
+    try:
+        side, order_type, quantity, price = _ADD.unpack_from(frame, _HEADER.size)
+        ticker, offset = _unpack_str(frame, _HEADER.size + _ADD.size)
+        user_id, _ = _unpack_str(frame, offset)
+    except (struct.error, UnicodeDecodeError) as e:
+        raise WireError(f"Malformed add frame: {e}")
+    if side >= len(SIDES) or order_type >= len(ORDER_TYPES):
+        raise WireError("Unknown side or order type in add frame")
+    order = {
+        'ticker': ticker,
+        'side': SIDES[side],
+        'quantity': quantity,
+        'user_id': user_id,
+        'order_type': ORDER_TYPES[order_type],
+    }
+    if not math.isnan(price):
+        order['price'] = price
+    return order
+
+def encode_ack(correlation_id: int, order_id: int) -> bytes:
+    return _HEADER.pack(ACK, correlation_id) + _ACK.pack(order_id)
+
+def encode_fills(correlation_id: int, order_id: int, matched_orders: List[Dict]) -> bytes:
+    parts = [_HEADER.pack(FILLS, correlation_id), _FILLS.pack(order_id, len(matched_orders))]
+    for fill in matched_orders:
+        if 'buy_user_id' in fill:
+            kind, first, second = LIMIT_FILL, 'buy', 'sell'
+        else:
+            kind, first, second = MARKET_FILL, 'maker', 'taker'
+        parts.append(_FILL.pack(kind, fill['price'], fill['quantity'], fill[f'{first}_order_id'],
+                                fill[f'{second}_order_id'], fill['timestamp']))
+        parts.append(_pack_str(fill[f'{first}_user_id']))
+        parts.append(_pack_str(fill[f'{second}_user_id']))
+    return b''.join(parts)
+
+def decode_fills(frame: bytes) -> Tuple[int, List[Dict]]:
+    """
+    Returns (order id, fills) with fills as the same dicts the JSON protocol sends.
+    """
+    order_id, count = _FILLS.unpack_from(frame, _HEADER.size)
+    offset = _HEADER.size + _FILLS.size
+    fills = []
+    for _ in range(count):
+        kind, price, quantity, first_id, second_id, timestamp = _FILL.unpack_from(frame, offset)
+        first_user, offset = _unpack_str(frame, offset + _FILL.size)
+        second_user, offset = _unpack_str(frame, offset)
+        first, second = ('buy', 'sell') if kind == LIMIT_FILL else ('maker', 'taker')
+        fills.append({
+            'price': price,
+            'quantity': quantity,
+            f'{first}_user_id': first_user,
+            f'{second}_user_id': second_user,
+            f'{first}_order_id': first_id,
+            f'{second}_order_id': second_id,
+            'timestamp': timestamp,
+        })
+    return order_id, fills
+
+def decode_ack(frame: bytes) -> int:
+    return _ACK.unpack_from(frame, _HEADER.size)[0]
+
+def encode_error(correlation_id: int, message: str) -> bytes:
+    return _HEADER.pack(ERROR, correlation_id) + _pack_str(message[:4096], _U16)
+
+def decode_error(frame: bytes) -> str:
+    return _unpack_str(frame, _HEADER.size, _U16)[0]
+
+def decode_reply(frame: bytes) -> Tuple[int, int, Optional[object]]:
+    """
+    Decodes any server frame into (message type, correlation id, body): the order id for
+    ACK, (order id, fills) for FILLS and the message for ERROR.
+    """
+    message_type, correlation_id = read_header(frame)
+    if message_type == ACK:
+        return message_type, correlation_id, decode_ack(frame)
+    if message_type == FILLS:
+        return message_type, correlation_id, decode_fills(frame)
+    if message_type == ERROR:
+        return message_type, correlation_id, decode_error(frame)
+    raise WireError(f"Unknown message type {message_type}")
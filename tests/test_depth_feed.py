@@ -0,0 +1,38 @@
+import os
+import sys
+import json
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from depth_feed import DepthFeed  # noqa: E402
+
+class RecordingSocket:
+    client = 'test'
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text: str):
+        self.sent.append(json.loads(text))
+
+async def get_snapshot(ticker: str):
+    return {'type': 'depth_snapshot', 'ticker': ticker, 'sequence': 3, 'bids': [], 'asks': []}
+
+async def subscribe(request_id):
+    feed, websocket = DepthFeed(), RecordingSocket()
+    await feed.subscribe(websocket, 'AAPL', get_snapshot, request_id)
+    feed.publish({'type': 'depth_update', 'ticker': 'AAPL', 'sequence': 4, 'bids': [], 'asks': []})
+    while len(websocket.sent) < 2:
+        await asyncio.sleep(0)
+    feed.unsubscribe_all(websocket)
+    return websocket.sent
+
+def test_first_snapshot_echoes_the_request_id():
+    snapshot, update = asyncio.run(subscribe(7))
+    assert snapshot['id'] == 7 and snapshot['type'] == 'depth_snapshot'
+    assert 'id' not in update
+
+def test_snapshot_without_a_request_id():
+    snapshot, _ = asyncio.run(subscribe(None))
+    assert 'id' not in snapshot
@@ -0,0 +1,73 @@
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from engine import OrderBookManager, fills_total, parse_order  # noqa: E402
+from journal import Journal, encode_order_ids  # noqa: E402
+
+def order(side: str, order_type: str = 'limit', price: float = 100.0, quantity: int = 1):
+    return parse_order({'ticker': 'AAPL', 'side': side, 'quantity': quantity, 'user_id': 'user1',
+                        'order_type': order_type, 'price': price})
+
+def manager(tmp_path, **kwargs) -> OrderBookManager:
+    return OrderBookManager(db_name=str(tmp_path / 'data.db'), verify_mode='off',
+                            journal_dir=str(tmp_path / 'journal'), **kwargs)
+
+async def next_order_id_after_restart(tmp_path, **kwargs) -> int:
+    first = manager(tmp_path, **kwargs)
+    await first.start()
+    await first.add_order(order('sell', quantity=5))
+    # Market orders never rest; the last one has the highest id handed out
+    await first.add_order(order('buy', 'market', quantity=2))
+    await first.add_order(order('buy', 'market', quantity=1))
+    await first.close()
+
+    second = manager(tmp_path, **kwargs)
+    await second.start()
+    next_order = order('buy', quantity=1)
+    await second.add_order(next_order)
+    await second.close()
+    return next_order.order_id
+
+def test_market_order_ids_survive_restart(tmp_path):
+    assert asyncio.run(next_order_id_after_restart(tmp_path)) == 4
+
+def test_market_order_ids_survive_restart_from_snapshot(tmp_path):
+    # A checkpoint after every record, so recovery starts from a snapshot
+    assert asyncio.run(next_order_id_after_restart(tmp_path, checkpoint_every=1)) == 4
+
+async def close_during_flush(tmp_path) -> int:
+    journal = Journal(str(tmp_path / 'journal'), sync_interval=0)
+    await journal.open()
+    for order_id in range(1, 1001):
+        journal.append(encode_order_ids('AAPL', order_id))
+    # Waiting on the flush that close() has to let finish rather than cancel
+    sync = asyncio.ensure_future(journal.sync())
+    while not journal._io_lock.locked():
+        await asyncio.sleep(0)
+    await journal.close()
+    await asyncio.wait_for(sync, 5)
+    return len(list(Journal(str(tmp_path / 'journal')).recover()))
+
+def test_close_finishes_pending_flush(tmp_path):
+    assert asyncio.run(close_during_flush(tmp_path)) == 1000
+
+async def replace_into_a_cross(tmp_path):
+    books = manager(tmp_path)
+    await books.start()
+    try:
+        await books.add_order(order('sell', price=101.0, quantity=3))
+        resting = order('buy', price=99.0, quantity=2)
+        await books.add_order(resting)
+        fills_counter = fills_total.labels()
+        before = fills_counter.value
+        _, fills = await books.replace_order('AAPL', resting.order_id, price=101.0)
+        return fills, fills_counter.value - before
+    finally:
+        await books.close()
+
+def test_replace_counts_its_fills(tmp_path):
+    fills, counted = asyncio.run(replace_into_a_cross(tmp_path))
+    assert fills and counted == len(fills)
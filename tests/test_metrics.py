@@ -0,0 +1,17 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from metrics import Histogram  # noqa: E402
+
+def test_out_of_range_values_only_count_under_inf():
+    histogram = Histogram()
+    for seconds in (0.5, 2147.0, 2148.0, 1e6):
+        histogram.observe(seconds)
+    buckets = {labels: value for name, labels, value in histogram.samples('latency') if name == 'latency_bucket'}
+    # The last finite bucket ends at 2**31 us
+    assert buckets['le="2147.48"'] == 2
+    assert buckets['le="+Inf"'] == 4
+    assert histogram.percentile(0.5) <= 2147.483648
+    assert histogram.percentile(1.0) == float('inf')
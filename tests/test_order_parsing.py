@@ -0,0 +1,79 @@
+import os
+import sys
+
+import pytest
+from pydantic import ValidationError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from engine import Order, order_batch_adapter, parse_order, parse_orders  # noqa: E402
+
+LIMIT = {'ticker': 'AAPL', 'side': 'buy', 'quantity': 10, 'user_id': 'user1', 'order_type': 'limit', 'price': 187.25}
+MARKET = {'ticker': 'AAPL', 'side': 'sell', 'quantity': 3, 'user_id': 'user2', 'order_type': 'market'}
+
+def variant(base, **changes):
+    order = dict(base, **changes)
+    return {key: value for key, value in order.items() if value is not ...}
+
+CASES = [
+    LIMIT,
+    MARKET,
+    variant(LIMIT, price=187),  # Integer price
+    variant(MARKET, price=187.25),  # Market orders drop their price
+    variant(MARKET, price=10 ** 400),
+    variant(LIMIT, price=10 ** 400),  # Too large for a float
+    variant(LIMIT, price=10 ** 20),
+    variant(LIMIT, price=...),  # Limit order without a price
+    variant(LIMIT, price=None),
+    variant(LIMIT, price='187.25'),
+    variant(LIMIT, quantity=True),
+    variant(LIMIT, quantity=0),
+    variant(LIMIT, quantity=-5),
+    variant(LIMIT, quantity=2 ** 63),
+    variant(LIMIT, quantity=10.0),
+    variant(LIMIT, quantity='10'),
+    variant(LIMIT, ticker=7),
+    variant(LIMIT, user_id=None),
+    variant(LIMIT, side='hold'),
+    variant(LIMIT, side='BUY'),
+    variant(LIMIT, order_type='stop'),
+    variant(LIMIT, ticker='T' * 255),
+    variant(LIMIT, ticker='T' * 256),
+    variant(LIMIT, user_id='\N{GRINNING FACE}' * 63),
+    variant(LIMIT, user_id='\N{GRINNING FACE}' * 64),  # 256 bytes
+    variant(LIMIT, ticker=...),
+    variant(LIMIT, extra='field'),
+    variant(LIMIT, timestamp=1.0),
+    variant(LIMIT, order_id=5),
+]
+
+def outcome(parse, data):
+    """
+    The parsed fields (timestamps differ between calls) or the validation errors.
+    """
+    try:
+        result = parse(data)
+    except ValidationError as e:
+        return 'error', [(error['loc'], error['type'], error['msg']) for error in e.errors()]
+    orders = result if isinstance(result, list) else [result]
+    return 'ok', [order.model_dump(exclude={'timestamp'}) for order in orders]
+
+@pytest.mark.parametrize('data', CASES)
+def test_parse_order_matches_pydantic(data):
+    assert outcome(parse_order, data) == outcome(lambda d: Order(**d), data)
+
+@pytest.mark.parametrize('data', CASES)
+def test_parse_orders_matches_pydantic(data):
+    batch = [LIMIT, MARKET, data, LIMIT]
+    assert outcome(parse_orders, batch) == outcome(order_batch_adapter.validate_python, batch)
+
+def test_batch_errors_are_located_by_index_and_field():
+    batch = [LIMIT, variant(LIMIT, quantity=0), MARKET, variant(MARKET, side='hold')]
+    with pytest.raises(ValidationError) as error:
+        parse_orders(batch)
+    assert [e['loc'] for e in error.value.errors()] == [(1, 'quantity'), (3, 'side')]
+
+def test_non_dict_order():
+    for data in (None, [], 'order'):
+        with pytest.raises(ValidationError):
+            parse_orders([LIMIT, data])
@@ -0,0 +1,133 @@
+import os
+import sys
+import asyncio
+import itertools
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from publisher import InMemoryBroker, Publisher, PublishError  # noqa: E402
+
+_broker_names = itertools.count()
+
+def new_broker():
+    """
+    A fresh InMemoryBroker and the memory:// URL that reaches it.
+    """
+    name = f"test-{next(_broker_names)}"
+    return InMemoryBroker.get(name), f"memory://{name}"
+
+def count_confirms(publisher: Publisher):
+    """
+    Wraps the publisher's confirm handler, returning the list each confirm frame is recorded in.
+    """
+    frames = []
+    on_confirm = publisher._on_confirm
+
+    def record(channel, frame):
+        frames.append(frame.method)
+        on_confirm(channel, frame)
+    publisher._on_confirm = record
+    return frames
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+def test_publish_returns_once_confirmed():
+    async def scenario():
+        broker, url = new_broker()
+        publisher = Publisher(url, 'orders', channels=2, queues=('matching_engine',))
+        await publisher.start()
+        assert publisher.connected
+        await publisher.publish('matching_engine', b'order-1')
+        await publisher.close()
+        return broker
+
+    broker = run(scenario())
+    assert broker.exchanges == {'orders': 'direct'}
+    assert broker.queues == {'matching_engine'}
+    assert broker.messages == {('orders', 'matching_engine'): [b'order-1']}
+
+def test_batches_are_confirmed_with_multiple_tag_acks():
+    async def scenario():
+        broker, url = new_broker()
+        publisher = Publisher(url, '', channels=2, batch_size=10)
+        await publisher.start()
+        confirms = count_confirms(publisher)
+        bodies = [f"order-{i}".encode() for i in range(35)]
+        await asyncio.gather(*[publisher.publish('matching_engine', body) for body in bodies])
+        await publisher.close()
+        return broker, bodies, confirms
+
+    broker, bodies, confirms = run(scenario())
+    assert broker.messages[('', 'matching_engine')] == bodies
+    # Four flush passes of at most 10 messages, each acked with one multiple-tag ack per channel
+    assert all(method.multiple for method in confirms)
+    assert len(confirms) <= 8
+
+def test_unconfirmed_messages_are_republished_after_reconnect():
+    async def scenario():
+        broker, url = new_broker()
+        publisher = Publisher(url, '', channels=2, reconnect_delay=0.01)
+        await publisher.start()
+        broker.hold_confirms = True
+        bodies = [f"order-{i}".encode() for i in range(10)]
+        publishes = asyncio.gather(*[publisher.publish('matching_engine', body) for body in bodies])
+        while len(broker.messages.get(('', 'matching_engine'), [])) < len(bodies):
+            await asyncio.sleep(0)
+        assert not publishes.done()
+        # The connection drops with every message sent but none confirmed
+        broker.hold_confirms = False
+        broker.drop_connections()
+        await publishes
+        await publisher.close()
+        return broker, bodies
+
+    broker, bodies = run(scenario())
+    # At-least-once: everything again, in the original order, after the unconfirmed copies
+    assert broker.messages[('', 'matching_engine')] == bodies + bodies
+
+def test_reconnects_with_backoff_after_refused_connections():
+    async def scenario():
+        broker, url = new_broker()
+        broker.refuse_connections = 3
+        publisher = Publisher(url, '', channels=1, reconnect_delay=0.01, max_reconnect_delay=0.02)
+        await publisher.start(timeout=0.001)
+        assert not publisher.connected
+        await publisher.publish('matching_engine', b'order-1')
+        assert publisher.connected
+        await publisher.close()
+        return broker
+
+    broker = run(scenario())
+    assert broker.refuse_connections == 0
+    assert broker.messages == {('', 'matching_engine'): [b'order-1']}
+
+def test_publish_times_out_without_a_confirm():
+    async def scenario():
+        broker, url = new_broker()
+        publisher = Publisher(url, '', channels=1, publish_timeout=0.05)
+        await publisher.start()
+        broker.hold_confirms = True
+        with pytest.raises(PublishError):
+            await publisher.publish('matching_engine', b'order-1')
+        await publisher.close()
+
+    run(scenario())
+
+def test_backlog_limit():
+    async def scenario():
+        broker, url = new_broker()
+        publisher = Publisher(url, '', channels=1, max_pending=5)
+        await publisher.start()
+        broker.hold_confirms = True
+        publishes = [asyncio.ensure_future(publisher.publish('matching_engine', b'order')) for _ in range(5)]
+        await asyncio.sleep(0)
+        with pytest.raises(PublishError):
+            await publisher.publish('matching_engine', b'one too many')
+        await publisher.close()
+        for publish in publishes:
+            publish.cancel()
+
+    run(scenario())